@@ -1,7 +1,10 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context
 from flask_login import login_required, current_user
+import csv
+import io
 import json
 import os
+import queue
 import sys
 from datetime import datetime
 
@@ -14,6 +17,17 @@ from services.ftp_user_service import FTPUserService
 from services.ftp_log_service import FTPLogService
 from services.ftp_connection_service import FTPConnectionService
 from services.ftp_config_service import FTPConfigService
+from services.log_ingest_service import LogIngestService
+from services.snapshot_service import SnapshotService
+from services.user_directory_service import UserDirectoryService
+from services.vsftpd_reload_service import VsftpdReloadService
+from services.quota_service import QuotaService
+from services.quota_policy_service import QuotaPolicyService
+from services.analytics_service import AnalyticsService
+from services.connection_history_service import ConnectionHistoryService
+from services.shared_state_service import SharedStateService
+from services.retention_service import RetentionService
+from services.log_archive_service import LogArchiveService
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -21,6 +35,35 @@ app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-product
 # Initialize database
 create_tables()
 
+def start_background_services():
+    # Stream new log lines into the FTPLog table in the background
+    LogIngestService.start()
+
+    # Sample connections and stats once for all dashboard clients
+    ConnectionHistoryService.load()
+    SnapshotService.start()
+
+    # Measure home directory usage off the request path; uploads/deletes adjust it in between
+    LogIngestService.add_listener(QuotaService.apply_records)
+    QuotaPolicyService.start()
+    QuotaService.start()
+
+    # Delete logs past their retention in small chunks and give the space back
+    RetentionService.start()
+
+# With several server workers only the elected leader runs them
+SharedStateService.elect(start_background_services)
+
+# One pooled database connection per request, returned when it ends
+@app.before_request
+def open_db_connection():
+    db.connect(reuse_if_open=True)
+
+@app.teardown_request
+def close_db_connection(exc):
+    if not db.is_closed():
+        db.close()
+
 # Initialize login manager
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
@@ -38,40 +81,37 @@ def index():
 def dashboard():
     return render_template('dashboard.html')
 
+@app.route('/quota')
+@login_required
+def quota():
+    return render_template('quota.html')
+
 # API Routes
 @app.route('/api/users', methods=['GET'])
 @login_required
 def get_ftp_users():
     try:
-        # Get users from database and sync with system users
-        db_users = list(FTPUser.select().dicts())
-        system_users = FTPUserService.get_system_users()
-        blocked_users = FTPUserService.get_blocked_users()
-        
-        # Combine information
-        users_data = []
-        
-        # Add database users
-        for user in db_users:
-            user['exists_in_system'] = user['username'] in system_users
-            user['is_blocked'] = user['username'] in blocked_users
-            users_data.append(user)
+        # Served from the cached passwd/user_list/FTPUser join; 304 while it is unchanged
+        etag = UserDirectoryService.etag()
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
         
-        # Add system users not in database
-        for sys_user in system_users:
-            if not any(u['username'] == sys_user for u in db_users):
-                users_data.append({
-                    'id': None,
-                    'username': sys_user,
-                    'home_directory': FTPUserService.get_user_home_dir(sys_user),
-                    'is_active': True,
-                    'is_blocked': sys_user in blocked_users,
-                    'created_at': None,
-                    'created_by': None,
-                    'exists_in_system': True
-                })
-        
-        return jsonify(users_data)
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', type=int)
+        users, total, next_cursor = UserDirectoryService.list_users(
+            sort=request.args.get('sort'),
+            order=request.args.get('order', 'asc'),
+            offset=offset,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            search=request.args.get('search', '').strip()
+        )
+        response = jsonify({'users': users, 'total': total, 'offset': offset, 'limit': limit,
+                            'next_cursor': next_cursor})
+        response.set_etag(etag)
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -115,6 +155,8 @@ def create_ftp_user():
                     is_active=True,
                     is_blocked=False
                 )
+                UserDirectoryService.invalidate()
+                SnapshotService.request_refresh()
                 return jsonify({'success': True, 'message': message, 'user_id': ftp_user.id})
             except Exception as db_error:
                 return jsonify({'success': True, 'message': f"{message} (DB warning: {str(db_error)})"})
@@ -124,6 +166,47 @@ def create_ftp_user():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/api/users/batch', methods=['POST'])
+@login_required
+def create_ftp_users_batch():
+    try:
+        # Accept a JSON list, {"users": [...]}, a CSV body or an uploaded CSV file
+        if 'file' in request.files:
+            entries = _parse_users_csv(request.files['file'].read().decode('utf-8'))
+        elif request.mimetype == 'text/csv':
+            entries = _parse_users_csv(request.get_data(as_text=True))
+        else:
+            data = request.json
+            entries = data.get('users', []) if isinstance(data, dict) else data
+        
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'success': False, 'message': 'No users supplied'}), 400
+        if len(entries) > FTPUserService.MAX_BATCH_SIZE:
+            return jsonify({'success': False, 'message': f'At most {FTPUserService.MAX_BATCH_SIZE} users per batch'}), 400
+        if not all(isinstance(entry, dict) for entry in entries):
+            return jsonify({'success': False, 'message': 'Each user must be an object'}), 400
+        
+        results, timing = FTPUserService.create_system_users_batch(entries, current_user)
+        created = sum(1 for result in results if result['success'])
+        UserDirectoryService.invalidate()
+        SnapshotService.request_refresh()
+        return jsonify({
+            'success': created == len(results),
+            'message': f'{created} of {len(results)} users created',
+            'results': results,
+            'timing': timing
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Unexpected error: {str(e)}'}), 500
+
+def _parse_users_csv(text):
+    """Parse username,password[,home_directory] rows; a header row is optional"""
+    rows = [row for row in csv.reader(io.StringIO(text)) if row and any(cell.strip() for cell in row)]
+    if rows and rows[0][0].strip().lower() == 'username':
+        rows = rows[1:]
+    fields = ['username', 'password', 'home_directory']
+    return [dict(zip(fields, row)) for row in rows]
+
 @app.route('/api/users/<username>', methods=['DELETE'])
 @login_required
 def delete_ftp_user(username):
@@ -139,6 +222,8 @@ def delete_ftp_user(username):
             except FTPUser.DoesNotExist:
                 pass  # User not in database, that's OK
             
+            UserDirectoryService.invalidate()
+            SnapshotService.request_refresh()
             return jsonify({'success': True, 'message': message})
         else:
             return jsonify({'success': False, 'message': message}), 400
@@ -151,7 +236,10 @@ def delete_ftp_user(username):
 def block_user(username):
     try:
         success, message = FTPUserService.block_user(username)
-        return jsonify({'success': success, 'message': message})
+        UserDirectoryService.invalidate()
+        SnapshotService.request_refresh()
+        return jsonify({'success': success, 'message': message,
+                        'reload': VsftpdReloadService.status()})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -160,7 +248,10 @@ def block_user(username):
 def unblock_user(username):
     try:
         success, message = FTPUserService.unblock_user(username)
-        return jsonify({'success': success, 'message': message})
+        UserDirectoryService.invalidate()
+        SnapshotService.request_refresh()
+        return jsonify({'success': success, 'message': message,
+                        'reload': VsftpdReloadService.status()})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
@@ -168,9 +259,61 @@ def unblock_user(username):
 @login_required
 def get_logs():
     try:
-        # Get logs from FTP log service
-        logs = FTPLogService.get_recent_logs(limit=100)
-        return jsonify(logs)
+        # Page through ingested logs, newest first
+        logs, next_cursor = FTPLogService.query_logs(
+            filters=request.args,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit')
+        )
+        return jsonify({'logs': logs, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/logs/archive', methods=['GET'])
+@login_required
+def get_archived_logs():
+    try:
+        # Page through archived logs, newest first; same filters as /api/logs
+        logs, next_cursor, scanned = LogArchiveService.query(
+            filters=request.args,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit')
+        )
+        return jsonify({'logs': logs, 'next_cursor': next_cursor, 'segments': scanned,
+                        'archive': LogArchiveService.status()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/logs/files', methods=['GET'])
+@login_required
+def get_file_logs():
+    try:
+        # Read straight from the log files, rotated and compressed copies included
+        logs, stats = FTPLogService.read_logs(filters=request.args, limit=request.args.get('limit'))
+        return jsonify({'logs': logs, 'files': stats})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/logs/search', methods=['GET'])
+@login_required
+def search_logs():
+    try:
+        # Full-text search over transfer history
+        logs, next_cursor = FTPLogService.search_logs(
+            request.args.get('q', ''),
+            field=request.args.get('field'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit')
+        )
+        return jsonify({'logs': logs, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -178,8 +321,8 @@ def get_logs():
 @login_required
 def get_connections():
     try:
-        # Get active connections
-        connections = FTPConnectionService.get_active_connections()
+        # Served from the background sampler's snapshot
+        connections = SnapshotService.get()['connections']
         return jsonify(connections)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -189,6 +332,7 @@ def get_connections():
 def kill_connection(pid):
     try:
         success, message = FTPConnectionService.kill_connection(pid)
+        SnapshotService.request_refresh()
         return jsonify({'success': success, 'message': message})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
@@ -221,41 +365,164 @@ def get_config():
 @login_required
 def update_config():
     try:
-        data = request.json
-        key = data.get('key')
-        value = data.get('value')
+        data = request.json or {}
+        changes = data.get('changes')
         
-        success, message = FTPConfigService.update_config(key, value, current_user)
-        return jsonify({'success': success, 'message': message})
+        if changes is not None:
+            # Several keys applied as one transaction: {"changes": {"key": "value", ...}}
+            if not isinstance(changes, dict):
+                return jsonify({'success': False, 'message': 'changes must be an object'}), 400
+            success, message = FTPConfigService.update_config_batch(changes, current_user)
+        else:
+            success, message = FTPConfigService.update_config(data.get('key'), data.get('value'), current_user)
+        return jsonify({'success': success, 'message': message,
+                        'reload': VsftpdReloadService.status()})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
-@app.route('/api/stats', methods=['GET'])
+@app.route('/api/quota', methods=['GET'])
 @login_required
-def get_stats():
+def get_quota():
     try:
-        # Get statistics for dashboard
-        system_users = FTPUserService.get_system_users()
-        blocked_users = FTPUserService.get_blocked_users()
-        active_connections = FTPConnectionService.get_active_connections()
-        
-        total_users = len(system_users)
-        total_blocked = len(blocked_users)
-        total_connections = len(active_connections)
-        
-        # Get recent activity
-        recent_logs = FTPLogService.get_recent_logs(limit=10)
+        # Results of the last background scan; never walks directories here
+        return jsonify({'users': QuotaService.get_quota(request.args.get('username')),
+                        'status': QuotaService.status()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/quota/scan', methods=['POST'])
+@login_required
+def scan_quota():
+    QuotaService.request_scan(force=True)
+    return jsonify({'success': True, 'message': 'Quota scan requested', 'status': QuotaService.status()})
+
+@app.route('/api/quota/limits/<username>', methods=['PUT'])
+@login_required
+def set_quota_limit(username):
+    try:
+        data = request.json or {}
+        mb = 1024 * 1024
+        soft = data.get('soft_limit_mb')
+        hard = data.get('hard_limit_mb')
+        result = QuotaPolicyService.set_limit(
+            username,
+            soft_limit=int(float(soft) * mb) if soft not in (None, '') else None,
+            hard_limit=int(float(hard) * mb) if hard not in (None, '') else None,
+            action=data.get('action', 'block')
+        )
+        SnapshotService.request_refresh()
+        return jsonify({'success': True, 'message': f'Quota limits for {username} saved', **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/api/quota/limits/<username>', methods=['DELETE'])
+@login_required
+def remove_quota_limit(username):
+    try:
+        result = QuotaPolicyService.remove_limit(username)
+        SnapshotService.request_refresh()
+        return jsonify({'success': True, 'message': f'Default quota limits apply to {username}', **result})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/api/analytics', methods=['GET'])
+@login_required
+def get_analytics():
+    try:
+        # Pre-aggregated traffic rollups; ?key= returns one user's/IP's buckets
+        dimension = request.args.get('dimension', 'user')
+        period = request.args.get('period', 'hour')
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        key = request.args.get('key')
         
+        if key:
+            return jsonify({'dimension': dimension, 'period': period, 'key': key,
+                            'series': AnalyticsService.series(dimension, key, period, start, end)})
         return jsonify({
-            'total_users': total_users,
-            'active_connections': total_connections,
-            'blocked_users': total_blocked,
-            'recent_activity': len(recent_logs),
-            'vsftpd_status': FTPConfigService.get_service_status()
+            'dimension': dimension,
+            'period': period,
+            'totals': AnalyticsService.totals(period, start, end),
+            'top': AnalyticsService.top(dimension, period, start, end,
+                                        metric=request.args.get('metric', 'bytes_in'),
+                                        limit=request.args.get('limit', 10, type=int))
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/reload', methods=['GET'])
+@login_required
+def get_reload_status():
+    """Pending vs applied generation of queued user_list/config changes"""
+    return jsonify(VsftpdReloadService.status())
+
+@app.route('/api/reload', methods=['POST'])
+@login_required
+def apply_reload():
+    try:
+        # Apply queued changes now instead of waiting for the debounce window
+        success, message = VsftpdReloadService.flush()
+        SnapshotService.request_refresh()
+        return jsonify({'success': success, 'message': message,
+                        'reload': VsftpdReloadService.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def get_stats():
+    try:
+        # Served from the background sampler's snapshot
+        return jsonify(SnapshotService.get()['stats'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stats/history', methods=['GET'])
+@login_required
+def get_stats_history():
+    try:
+        # ?range= seconds picks the finest tier that covers it; ?tier=&since= select explicitly
+        return jsonify(ConnectionHistoryService.history(
+            tier=request.args.get('tier'),
+            since=request.args.get('since', type=float),
+            seconds=request.args.get('range', 3600, type=int)
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream')
+@login_required
+def stream():
+    """Server-Sent Events: log lines, connection open/close and stat changes"""
+    def generate():
+        events = SnapshotService.subscribe()
+        try:
+            event_type, data = SnapshotService.snapshot_event()
+            # Nothing below queries the database; don't hold a pooled connection for hours
+            close_db_connection(None)
+            yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+            while True:
+                try:
+                    event_type, data = events.get(timeout=15)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            SnapshotService.unsubscribe(events)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Health check endpoint
 @app.route('/health')
 def health_check():
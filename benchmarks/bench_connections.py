@@ -0,0 +1,150 @@
+"""Benchmark for active connection collection.
+
+Opens thousands of established loopback connections to a listener in
+this process, then times the single-pass /proc collector used by
+FTPConnectionService against the previous netstat + psutil.process_iter
++ per-connection log scan approach. Both collectors are pointed at the
+benchmark's port and process name instead of vsftpd on port 21.
+
+    python benchmarks/bench_connections.py [--connections N] [--log-lines N]
+
+Linux only. netstat (net-tools) is optional; the legacy timing skips it
+when it is not installed.
+"""
+import argparse
+import os
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psutil
+
+from services.ftp_connection_service import FTPConnectionService
+from services.ftp_log_service import FTPLogService
+
+
+def open_connections(count):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+    clients, servers = [], []
+    for _ in range(count):
+        client = socket.create_connection(('127.0.0.1', port))
+        server, _ = listener.accept()
+        clients.append(client)
+        servers.append(server)
+    return listener, port, clients + servers
+
+
+def write_log(path, lines, pid):
+    with open(path, 'w') as f:
+        for i in range(lines):
+            f.write(f'Mon Dec  4 10:30:15 2023 [pid {100000 + i}] [user{i % 300}] OK LOGIN: '
+                    f'Client "10.0.{i % 250}.{i % 200}"\n')
+        f.write(f'Mon Dec  4 10:30:15 2023 [pid {pid}] [bench] OK LOGIN: Client "127.0.0.1"\n')
+
+
+def legacy_username(log_file, pid, ip_address):
+    """The previous _get_username_for_connection: two full log reads"""
+    with open(log_file, 'r') as f:
+        lines = f.readlines()
+    for line in reversed(lines[-50:]):
+        if f'[pid {pid}]' in line:
+            match = re.search(r'\[pid\s+' + str(pid) + r'\]\s+\[([^\]]+)\]', line)
+            if match:
+                return match.group(1)
+    with open(log_file, 'r') as f:
+        lines = f.readlines()
+    for line in reversed(lines[-100:]):
+        if ip_address in line and 'LOGIN' in line:
+            match = re.search(r'\[([^\]]+)\]\s+OK\s+LOGIN', line)
+            if match:
+                return match.group(1)
+    return 'unknown'
+
+
+def legacy_collect(port, process_name, log_file):
+    """The previous get_active_connections data sources"""
+    found = []
+    if shutil.which('netstat'):
+        result = subprocess.run(['netstat', '-tnp'], capture_output=True, text=True)
+        for line in result.stdout.split('\n'):
+            if f':{port} ' in line and 'ESTABLISHED' in line:
+                parts = line.split()
+                match = re.search(r'(\d+)/', parts[6]) if len(parts) > 6 else None
+                if match:
+                    ip = parts[4].rsplit(':', 1)[0]
+                    found.append((int(match.group(1)), ip, legacy_username(log_file, int(match.group(1)), ip)))
+    for proc in psutil.process_iter(['pid', 'name', 'connections']):
+        if process_name not in (proc.info['name'] or ''):
+            continue
+        for conn in proc.info.get('connections') or []:
+            if conn.status == psutil.CONN_ESTABLISHED and conn.laddr.port == port:
+                ip = conn.raddr.ip if conn.raddr else 'unknown'
+                found.append((proc.info['pid'], ip, legacy_username(log_file, proc.info['pid'], ip)))
+    return found
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--log-lines', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.connections * 2 + 64
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    workdir = tempfile.mkdtemp()
+    log_file = os.path.join(workdir, 'vsftpd.log')
+    write_log(log_file, args.log_lines, os.getpid())
+    FTPLogService.VSFTPD_LOG_FILE = log_file
+
+    listener, port, sockets = open_connections(args.connections)
+    process_name = psutil.Process().name()
+    print(f"{args.connections} established connections on port {port}, "
+          f"{args.log_lines:,} line vsftpd.log")
+
+    try:
+        from services.ftp_session_service import FTPSessionService
+        FTPSessionService.refresh()
+
+        current, sessions = timed(
+            lambda: FTPConnectionService._collect_sessions(port=port, process_name=process_name),
+            args.repeat)
+        print(f"/proc collector   {current * 1000:10.1f} ms  {len(sessions)} sessions")
+
+        legacy_repeat = 1 if args.connections > 200 else args.repeat
+        legacy, rows = timed(lambda: legacy_collect(port, process_name, log_file), legacy_repeat)
+        print(f"legacy collector  {legacy * 1000:10.1f} ms  {len(rows)} rows before merge")
+        print(f"speedup: {legacy / current:.0f}x")
+    finally:
+        for sock in sockets:
+            sock.close()
+        listener.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Micro-benchmark for the vsftpd.log / xferlog line parser.
+
+Generates a synthetic log (one million lines by default) and reports
+lines/sec for the single-pass parser in utils.log_parser next to the
+previous three-pattern implementation.
+
+    python benchmarks/bench_log_parser.py [--lines N]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log_parser import parse_vsftpd_line, parse_xfer_line
+
+
+def synthetic_lines(count, seed=42):
+    rnd = random.Random(seed)
+    users = [f'user{i}' for i in range(200)]
+    start = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    vsftpd, xfer = [], []
+    for i in range(count):
+        ts = time.strftime('%a %b %e %H:%M:%S %Y', time.localtime(start + i // 20))
+        pid = 1000 + rnd.randrange(5000)
+        ip = f'10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}'
+        user = rnd.choice(users)
+        kind = rnd.random()
+        if kind < 0.1:
+            vsftpd.append(f'{ts} [pid {pid}] CONNECT: Client "{ip}"')
+        elif kind < 0.3:
+            status = 'OK' if rnd.random() < 0.9 else 'FAIL'
+            vsftpd.append(f'{ts} [pid {pid}] [{user}] {status} LOGIN: Client "{ip}"')
+        elif kind < 0.8:
+            vsftpd.append(f'{ts} [pid {pid}] [{user}] OK UPLOAD: Client "{ip}", '
+                          f'"/uploads/file_{i}.dat", {rnd.randrange(1 << 20)} bytes, 512.00Kbyte/sec')
+        else:
+            xfer.append(f'{ts} 1 {ip} {rnd.randrange(1 << 20)} /home/{user}/file_{i}.dat '
+                        f'b _ i r {user} ftp 0 * c')
+    return vsftpd, xfer
+
+
+LEGACY_PATTERNS = [
+    r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+\[pid\s+(\d+)\]\s+\[([^\]]+)\]\s+(\w+)\s+(\w+):\s+(.+)',
+    r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+\[pid\s+(\d+)\]\s+(\w+):\s+(.+)',
+    r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+(.+)',
+]
+
+
+def legacy_extract_ip(text):
+    match = re.search(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b', text)
+    return match.group(0) if match else 'unknown'
+
+
+def legacy_parse(line):
+    """The previous FTPLogService._parse_log_line"""
+    for pattern in LEGACY_PATTERNS:
+        match = re.match(pattern, line)
+        if match:
+            groups = match.groups()
+            if len(groups) >= 6:
+                return {'timestamp': groups[0], 'pid': groups[1], 'username': groups[2],
+                        'status': groups[3], 'action': groups[4], 'details': groups[5],
+                        'ip_address': legacy_extract_ip(groups[5])}
+            elif len(groups) >= 4:
+                return {'timestamp': groups[0], 'pid': groups[1], 'username': 'unknown',
+                        'status': 'INFO', 'action': groups[2], 'details': groups[3],
+                        'ip_address': legacy_extract_ip(groups[3])}
+            return {'timestamp': groups[0], 'pid': 'unknown', 'username': 'unknown',
+                    'status': 'INFO', 'action': 'LOG', 'details': groups[1],
+                    'ip_address': legacy_extract_ip(groups[1])}
+    return {'timestamp': datetime.now().strftime('%a %b %d %H:%M:%S %Y'), 'pid': 'unknown',
+            'username': 'unknown', 'status': 'INFO', 'action': 'LOG', 'details': line,
+            'ip_address': legacy_extract_ip(line)}
+
+
+def bench(name, func, lines):
+    started = time.perf_counter()
+    for line in lines:
+        func(line)
+    elapsed = time.perf_counter() - started
+    rate = len(lines) / elapsed if elapsed else float('inf')
+    print(f"{name:<28} {len(lines):>9} lines  {elapsed:8.3f}s  {rate:>12,.0f} lines/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"Generating {args.lines:,} synthetic log lines...")
+    vsftpd, xfer = synthetic_lines(args.lines)
+
+    legacy = bench('legacy vsftpd parser', legacy_parse, vsftpd)
+    current = bench('single-pass vsftpd parser', parse_vsftpd_line, vsftpd)
+    bench('xferlog parser', parse_xfer_line, xfer)
+    print(f"speedup: {current / legacy:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
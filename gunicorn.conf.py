@@ -0,0 +1,25 @@
+# Production server settings, used by start.sh:
+#   gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = f"{os.environ.get('FLASK_HOST', '0.0.0.0')}:{os.environ.get('FLASK_PORT', 5000)}"
+
+# Worker processes; one of them is elected to run the background services
+# and shares its results with the others (services/shared_state_service.py)
+workers = int(os.environ.get('FTPMAN_WORKERS', 2))
+# Threads per worker; every open dashboard keeps one busy with /api/stream
+threads = int(os.environ.get('FTPMAN_THREADS', 16))
+worker_class = 'gthread'
+timeout = 120
+graceful_timeout = 10
+
+# The app reads the worker count to decide whether to share state
+os.environ['FTPMAN_WORKERS'] = str(workers)
+
+
+def on_starting(server):
+    # Create the schema once, before the workers race to do it
+    from models import create_tables, db
+    create_tables()
+    # Forked workers must not inherit the master's pooled connection
+    db.close_all()
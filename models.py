@@ -1,9 +1,46 @@
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
+from playhouse.sqlite_ext import AutoIncrementField, FTS5Model, SearchField
 from flask_login import UserMixin
 from datetime import datetime
 import hashlib
+import os
+from utils.log_parser import parse_timestamp
 
-db = SqliteDatabase('vsftpd_manager.db')
+# Absolute, so every worker and helper script opens the same file whatever its cwd
+DB_PATH = os.path.abspath(os.environ.get(
+    'FTPMAN_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vsftpd_manager.db')))
+
+class FTPManDatabase(PooledSqliteDatabase):
+    def atomic(self, lock_type='IMMEDIATE'):
+        # Take the write lock up front: a deferred transaction that has read
+        # and then writes fails at once with "database is locked" in WAL mode
+        # when another connection committed meanwhile, instead of waiting
+        return super().atomic(lock_type=lock_type)
+
+# WAL lets the API read while log ingestion writes; connections are pooled
+# per thread and handed back after each request (see the hooks in app.py)
+db = FTPManDatabase(
+    DB_PATH,
+    max_connections=int(os.environ.get('FTPMAN_DB_POOL_SIZE', 64)),
+    stale_timeout=300,
+    # A pooled connection is handed to whichever thread asks next
+    check_same_thread=False,
+    pragmas={
+        # Only applies to a new, still empty database, so it comes first;
+        # older ones are converted once by RetentionService
+        'auto_vacuum': 'incremental',
+        'journal_mode': 'wal',
+        # Durable across application crashes; only fsyncs at checkpoints
+        'synchronous': 'normal',
+        # Negative values are KiB; per connection
+        'cache_size': -1024 * int(os.environ.get('FTPMAN_DB_CACHE_MB', 16)),
+        'mmap_size': 256 * 1024 * 1024,
+        # Wait for a writer instead of failing with "database is locked"
+        'busy_timeout': 10000,
+    }
+)
 
 class BaseModel(Model):
     class Meta:
@@ -31,14 +68,140 @@ class FTPUser(BaseModel):
     created_by = ForeignKeyField(User, backref='ftp_users')
 
 class FTPLog(BaseModel):
-    timestamp = DateTimeField()
+    # Epoch seconds (DATETIME text before schema version 1)
+    timestamp = IntegerField(index=True)
     username = CharField()
     action = CharField()
     ip_address = CharField()
     file_path = CharField(null=True)
     status = CharField()
+    pid = CharField(null=True)
+    details = TextField(null=True)
+    source = CharField(default='vsftpd')
+    # SHA-1 of the raw log line; the unique index deduplicates re-read lines
+    content_hash = CharField(null=True, unique=True)
     created_at = DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = (
+            (('username', 'timestamp'), False),
+            (('ip_address', 'timestamp'), False),
+            (('source', 'timestamp'), False),
+            (('action', 'timestamp'), False),
+        )
+
+class FTPLogSearch(FTS5Model):
+    """Full-text index over transfer records (rows of FTPLog with a file_path)
+
+    External content table: the text lives in FTPLog and is kept in sync by
+    the triggers created in create_tables(), so nothing is stored twice.
+    """
+    file_path = SearchField()
+    username = SearchField()
+    ip_address = SearchField()
+
+    class Meta:
+        database = db
+        table_name = 'ftplog_search'
+        options = {
+            'content': FTPLog,
+            'content_rowid': 'id',
+            'prefix': [2, 3],
+            'tokenize': 'unicode61',
+        }
+
+FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS ftplog_search_ai AFTER INSERT ON ftplog
+       WHEN new.file_path IS NOT NULL BEGIN
+         INSERT INTO ftplog_search(rowid, file_path, username, ip_address)
+         VALUES (new.id, new.file_path, new.username, new.ip_address);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS ftplog_search_ad AFTER DELETE ON ftplog
+       WHEN old.file_path IS NOT NULL BEGIN
+         INSERT INTO ftplog_search(ftplog_search, rowid, file_path, username, ip_address)
+         VALUES ('delete', old.id, old.file_path, old.username, old.ip_address);
+       END""",
+)
+
+class LogOffset(BaseModel):
+    """Read position of the ingestion worker in each log file"""
+    path = CharField(unique=True)
+    inode = IntegerField(null=True)
+    offset = IntegerField(default=0)
+    updated_at = DateTimeField(default=datetime.now)
+
+class ArchivedLogFile(BaseModel):
+    """Rotated log file already converted into archive segments"""
+    # SHA-1 of the first 64 KiB of the decompressed content; survives
+    # renames (.1 -> .2) and compression (.2 -> .2.gz)
+    fingerprint = CharField(unique=True)
+    path = CharField()
+    source = CharField()
+    rows = IntegerField(default=0)
+    archived_at = DateTimeField(default=datetime.now)
+
+class QuotaLimit(BaseModel):
+    """Per-user disk quota; limits in bytes, None falls back to the default"""
+    username = CharField(unique=True)
+    soft_limit = BigIntegerField(null=True)
+    hard_limit = BigIntegerField(null=True)
+    # What happens above the hard limit: 'block' or 'readonly'
+    action = CharField(default='block')
+    # Action currently applied by the quota policy, None when not enforced
+    enforced = CharField(null=True)
+    updated_at = DateTimeField(default=datetime.now)
+
+class TrafficRollup(BaseModel):
+    """Transfer and login counters per user or IP in minute/hour/day buckets"""
+    period = CharField()
+    # Bucket start, epoch seconds aligned to UTC
+    bucket = IntegerField()
+    dimension = CharField()
+    key = CharField()
+    bytes_in = BigIntegerField(default=0)
+    bytes_out = BigIntegerField(default=0)
+    files_in = IntegerField(default=0)
+    files_out = IntegerField(default=0)
+    transfer_seconds = IntegerField(default=0)
+    logins = IntegerField(default=0)
+    failed_logins = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('period', 'dimension', 'key', 'bucket'), True),
+            (('period', 'dimension', 'bucket'), False),
+        )
+
+class ConnectionSample(BaseModel):
+    """Connection counts averaged over minute or hour buckets"""
+    tier = CharField()
+    # Bucket start, epoch seconds aligned to UTC
+    bucket = IntegerField()
+    active = FloatField()
+    max_active = IntegerField()
+    unique_ips = FloatField()
+    unique_users = FloatField()
+
+    class Meta:
+        indexes = (
+            (('tier', 'bucket'), True),
+        )
+
+class SharedState(BaseModel):
+    """JSON values shared between server workers (see SharedStateService)"""
+    key = CharField(unique=True)
+    value = TextField(null=True)
+    version = IntegerField(default=1)
+    updated_at = FloatField()
+
+class SharedEvent(BaseModel):
+    """Stream events relayed from the leader worker to the others"""
+    # AUTOINCREMENT: ids must keep growing after old events are pruned
+    id = AutoIncrementField()
+    event_type = CharField()
+    data = TextField()
+    created_at = FloatField(index=True)
+
 class FTPConnection(BaseModel):
     username = CharField()
     ip_address = CharField()
@@ -51,8 +214,114 @@ class ConfigChange(BaseModel):
     old_value = TextField(null=True)
     new_value = TextField()
     changed_by = ForeignKeyField(User, backref='config_changes')
-    changed_at = DateTimeField(default=datetime.now)
+    changed_at = DateTimeField(default=datetime.now, index=True)
+
+    class Meta:
+        indexes = (
+            (('config_key', 'changed_at'), False),
+        )
+
+def _add_missing_columns(model):
+    """Add columns introduced after the table was first created"""
+    table = model._meta.table_name
+    if not db.table_exists(table):
+        return
+    existing = {column.name for column in db.get_columns(table)}
+    migrator = SqliteMigrator(db)
+    operations = [
+        migrator.add_column(table, field.column_name, field)
+        for field in model._meta.sorted_fields
+        if field.column_name not in existing
+    ]
+    if operations:
+        migrate(*operations)
+
+def _create_search_index():
+    """Create the FTS5 transfer index and backfill it on first creation"""
+    created = not FTPLogSearch.table_exists()
+    FTPLogSearch.create_table()
+    for trigger in FTS_TRIGGERS:
+        db.execute_sql(trigger)
+    if created:
+        db.execute_sql(
+            'INSERT INTO ftplog_search(rowid, file_path, username, ip_address) '
+            'SELECT id, file_path, username, ip_address FROM ftplog WHERE file_path IS NOT NULL'
+        )
+
+def _text_to_epoch(value):
+    """Epoch seconds of a stored time text, None if it cannot be read"""
+    if not value:
+        return None
+    # sync_logs_to_db stored the vsftpd ctime text ('Mon Dec  4 10:30:15 2023')
+    epoch = parse_timestamp(value)
+    if epoch is not None:
+        return epoch
+    # DateTimeField text, local time
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+def _migrate_ftplog_epoch():
+    """FTPLog.timestamp: local time text -> epoch seconds, so ranges compare integers"""
+    # Parsed in Python: SQLite's strftime() cannot read the ctime format
+    rows = db.execute_sql(
+        "SELECT id, timestamp, created_at FROM ftplog WHERE typeof(timestamp) = 'text'"
+    ).fetchall()
+    updates, unreadable = [], []
+    for row_id, timestamp, created_at in rows:
+        epoch = _text_to_epoch(timestamp)
+        if epoch is None:
+            epoch = _text_to_epoch(created_at)
+        if epoch is None:
+            unreadable.append(row_id)
+        else:
+            updates.append((epoch, row_id))
+    db.cursor().executemany('UPDATE ftplog SET timestamp = ? WHERE id = ?', updates)
+    for i in range(0, len(unreadable), 500):
+        FTPLog.delete().where(FTPLog.id.in_(unreadable[i:i + 500])).execute()
+    if unreadable:
+        print(f"Dropped {len(unreadable)} log rows without a readable time")
+
+def _migrate_incremental_vacuum():
+    """Let RetentionService hand pages freed by deletes back to the filesystem"""
+    # Takes effect only after a full VACUUM, which blocks every writer for
+    # as long as it takes to copy the database; RetentionService runs it
+    # once in the background instead of here on the startup path
+    db.execute_sql('PRAGMA auto_vacuum = INCREMENTAL')
+
+# (version, function, runs in a transaction); append only, never renumber.
+# The applied version is kept in PRAGMA user_version.
+MIGRATIONS = (
+    (1, _migrate_ftplog_epoch, True),
+    (2, _migrate_incremental_vacuum, False),
+)
+
+def _schema_version():
+    return db.execute_sql('PRAGMA user_version').fetchone()[0]
+
+def _apply_migrations():
+    for version, migration, transactional in MIGRATIONS:
+        if transactional:
+            # The version is re-checked under the write lock: workers start concurrently
+            with db.atomic():
+                if _schema_version() >= version:
+                    continue
+                migration()
+                db.execute_sql(f'PRAGMA user_version = {version}')
+        elif _schema_version() < version:
+            # Must be idempotent, another worker may be running it too
+            migration()
+            db.execute_sql(f'PRAGMA user_version = {version}')
+        else:
+            continue
+        print(f"Applied database migration {version}: {migration.__doc__}")
 
 def create_tables():
-    with db:
-        db.create_tables([User, FTPUser, FTPLog, FTPConnection, ConfigChange])
\ No newline at end of file
+    with db.connection_context():
+        with db.atomic():
+            _add_missing_columns(FTPLog)
+            db.create_tables([User, FTPUser, FTPLog, FTPConnection, ConfigChange, LogOffset, QuotaLimit,
+                              TrafficRollup, ConnectionSample, SharedState, SharedEvent, ArchivedLogFile])
+            _create_search_index()
+        _apply_migrations()
\ No newline at end of file
@@ -0,0 +1,162 @@
+import time
+from peewee import EXCLUDED, fn
+from models import TrafficRollup
+
+class AnalyticsService:
+    """Per-user and per-IP traffic rollups maintained during log ingestion
+
+    Every ingested batch is folded into minute, hour and day buckets in
+    Python and upserted (counter += batch total) in the same transaction
+    that stores the log rows, so reports read a handful of pre-aggregated
+    rows instead of scanning logs.
+    """
+
+    PERIODS = {'minute': 60, 'hour': 3600, 'day': 86400}
+    DIMENSIONS = ('user', 'ip')
+    COUNTERS = ('bytes_in', 'bytes_out', 'files_in', 'files_out',
+                'transfer_seconds', 'logins', 'failed_logins')
+    # Seconds each period is kept; None keeps it forever
+    RETENTION = {'minute': 2 * 86400, 'hour': 90 * 86400, 'day': None}
+    MAX_RANGE_BUCKETS = 5000
+    BATCH_SIZE = 300
+
+    @staticmethod
+    def rollup(source, records):
+        """Fold parsed log records into {(period, bucket, dimension, key): counters}"""
+        increments = {}
+        for record in records:
+            counters = AnalyticsService._counters(source, record)
+            if counters is None:
+                continue
+            for dimension, key in (('user', record.username), ('ip', record.ip_address)):
+                if not key or key == 'unknown':
+                    continue
+                for period, seconds in AnalyticsService.PERIODS.items():
+                    bucket_key = (period, record.epoch - record.epoch % seconds, dimension, key)
+                    totals = increments.get(bucket_key)
+                    if totals is None:
+                        increments[bucket_key] = dict(counters)
+                    else:
+                        for name, value in counters.items():
+                            totals[name] = totals.get(name, 0) + value
+        return increments
+
+    @staticmethod
+    def _counters(source, record):
+        if source == 'xferlog':
+            if record.direction == 'i':
+                return {'bytes_in': record.file_size, 'files_in': 1,
+                        'transfer_seconds': record.transfer_time}
+            if record.direction == 'o':
+                return {'bytes_out': record.file_size, 'files_out': 1,
+                        'transfer_seconds': record.transfer_time}
+            return None
+        if record.action == 'LOGIN':
+            return {'logins': 1} if record.status == 'OK' else {'failed_logins': 1}
+        return None
+
+    @staticmethod
+    def store(increments):
+        """Add rollup increments to the stored counters (call inside a transaction)"""
+        if not increments:
+            return
+        rows = []
+        for (period, bucket, dimension, key), counters in increments.items():
+            row = {'period': period, 'bucket': bucket, 'dimension': dimension, 'key': key}
+            for name in AnalyticsService.COUNTERS:
+                row[name] = counters.get(name, 0)
+            rows.append(row)
+
+        update = {getattr(TrafficRollup, name): getattr(TrafficRollup, name) + getattr(EXCLUDED, name)
+                  for name in AnalyticsService.COUNTERS}
+        for i in range(0, len(rows), AnalyticsService.BATCH_SIZE):
+            TrafficRollup.insert_many(rows[i:i + AnalyticsService.BATCH_SIZE]).on_conflict(
+                conflict_target=[TrafficRollup.period, TrafficRollup.dimension,
+                                 TrafficRollup.key, TrafficRollup.bucket],
+                update=update
+            ).execute()
+
+    @staticmethod
+    def prune(now=None):
+        """Drop buckets older than their period's retention; returns rows deleted"""
+        now = now if now is not None else time.time()
+        deleted = 0
+        for period, retention in AnalyticsService.RETENTION.items():
+            if retention is None:
+                continue
+            deleted += TrafficRollup.delete().where(
+                (TrafficRollup.period == period) & (TrafficRollup.bucket < now - retention)
+            ).execute()
+        return deleted
+
+    @staticmethod
+    def _range(period, start, end):
+        if period not in AnalyticsService.PERIODS:
+            raise ValueError(f"period must be one of {', '.join(AnalyticsService.PERIODS)}")
+        seconds = AnalyticsService.PERIODS[period]
+        end = int(end if end is not None else time.time())
+        start = int(start if start is not None else end - 24 * seconds)
+        if start > end:
+            raise ValueError("start must not be after end")
+        if (end - start) // seconds > AnalyticsService.MAX_RANGE_BUCKETS:
+            raise ValueError(f"At most {AnalyticsService.MAX_RANGE_BUCKETS} {period} buckets per request")
+        return start - start % seconds, end
+
+    @staticmethod
+    def _check_dimension(dimension):
+        if dimension not in AnalyticsService.DIMENSIONS:
+            raise ValueError(f"dimension must be one of {', '.join(AnalyticsService.DIMENSIONS)}")
+
+    @staticmethod
+    def _with_rate(row):
+        moved = row['bytes_in'] + row['bytes_out']
+        row['avg_rate'] = round(moved / row['transfer_seconds'], 1) if row['transfer_seconds'] else None
+        return row
+
+    @staticmethod
+    def series(dimension, key, period='hour', start=None, end=None):
+        """Buckets of one user or IP between start and end (epoch seconds)"""
+        AnalyticsService._check_dimension(dimension)
+        start, end = AnalyticsService._range(period, start, end)
+        query = (TrafficRollup
+                 .select(TrafficRollup.bucket, *[getattr(TrafficRollup, name) for name in AnalyticsService.COUNTERS])
+                 .where((TrafficRollup.period == period) & (TrafficRollup.dimension == dimension) &
+                        (TrafficRollup.key == key) & TrafficRollup.bucket.between(start, end))
+                 .order_by(TrafficRollup.bucket)
+                 .dicts())
+        return [AnalyticsService._with_rate(row) for row in query]
+
+    @staticmethod
+    def top(dimension, period='hour', start=None, end=None, metric='bytes_in', limit=10):
+        """Users or IPs with the highest totals of ``metric`` in the range"""
+        AnalyticsService._check_dimension(dimension)
+        if metric not in AnalyticsService.COUNTERS:
+            raise ValueError(f"metric must be one of {', '.join(AnalyticsService.COUNTERS)}")
+        start, end = AnalyticsService._range(period, start, end)
+        limit = max(1, min(int(limit), 100))
+
+        totals = [fn.SUM(getattr(TrafficRollup, name)).alias(name) for name in AnalyticsService.COUNTERS]
+        query = (TrafficRollup
+                 .select(TrafficRollup.key, *totals)
+                 .where((TrafficRollup.period == period) & (TrafficRollup.dimension == dimension) &
+                        TrafficRollup.bucket.between(start, end))
+                 .group_by(TrafficRollup.key)
+                 .order_by(fn.SUM(getattr(TrafficRollup, metric)).desc())
+                 .limit(limit)
+                 .dicts())
+        return [AnalyticsService._with_rate(row) for row in query]
+
+    @staticmethod
+    def totals(period='hour', start=None, end=None):
+        """Counters summed over every user, plus the number of active IPs"""
+        start, end = AnalyticsService._range(period, start, end)
+        in_range = ((TrafficRollup.period == period) & TrafficRollup.bucket.between(start, end))
+        sums = [fn.COALESCE(fn.SUM(getattr(TrafficRollup, name)), 0).alias(name)
+                for name in AnalyticsService.COUNTERS]
+        totals = (TrafficRollup.select(*sums)
+                  .where(in_range & (TrafficRollup.dimension == 'user'))
+                  .dicts().get())
+        totals['unique_ips'] = (TrafficRollup.select(fn.COUNT(TrafficRollup.key.distinct()))
+                                .where(in_range & (TrafficRollup.dimension == 'ip'))
+                                .scalar())
+        return AnalyticsService._with_rate(totals)
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from models import ConnectionSample, db
+from utils.ring_series import RingSeries
+from services.shared_state_service import SharedStateService
+
+class ConnectionHistoryService:
+    """Connection counts over time for the dashboard chart
+
+    Every sampler tick is appended to a fixed-size raw ring and folded into
+    minute and hour buckets (average counts plus the peak of active
+    connections). Finished buckets go into their own rings and are written
+    to SQLite every PERSIST_INTERVAL seconds, so longer tiers survive a
+    restart. Memory use is fixed by the ring capacities.
+
+    In a multi-worker server the leader also writes raw points and writes
+    on every tick, and the other workers read the history from SQLite.
+    """
+
+    FIELDS = ('active', 'max_active', 'unique_ips', 'unique_users')
+    # tier: (seconds per point, points kept); raw step is the sampler interval
+    TIERS = {
+        'raw': (float(os.environ.get('FTPMAN_SAMPLE_INTERVAL', 5)), 720),
+        'minute': (60, 1440),
+        'hour': (3600, 24 * 90),
+    }
+    PERSISTED = ('minute', 'hour')
+    PERSIST_INTERVAL = 300.0
+
+    _series = {}
+    # Bucket being accumulated per persisted tier
+    _open = {}
+    _pending = []
+    _next_persist = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def load():
+        """Fill the minute and hour rings from SQLite (call once at startup)"""
+        with ConnectionHistoryService._lock:
+            for tier in ConnectionHistoryService.PERSISTED:
+                capacity = ConnectionHistoryService.TIERS[tier][1]
+                series = RingSeries(capacity, ConnectionHistoryService.FIELDS)
+                query = (ConnectionSample.select()
+                         .where(ConnectionSample.tier == tier)
+                         .order_by(ConnectionSample.bucket.desc())
+                         .limit(capacity)
+                         .dicts())
+                for row in reversed(list(query)):
+                    series.append(row['bucket'], row)
+                ConnectionHistoryService._series[tier] = series
+
+    @staticmethod
+    def _ring(tier):
+        series = ConnectionHistoryService._series.get(tier)
+        if series is None:
+            capacity = ConnectionHistoryService.TIERS[tier][1]
+            series = ConnectionHistoryService._series[tier] = RingSeries(capacity, ConnectionHistoryService.FIELDS)
+        return series
+
+    @staticmethod
+    def record(epoch, stats):
+        """Add one sample of FTPConnectionService.get_connection_stats()"""
+        if 'error' in stats:
+            return
+        sample = {
+            'active': stats['total_active'],
+            'max_active': stats['total_active'],
+            'unique_ips': stats['unique_ips'],
+            'unique_users': stats['unique_users'],
+        }
+        with ConnectionHistoryService._lock:
+            ConnectionHistoryService._ring('raw').append(epoch, sample)
+            if SharedStateService.enabled():
+                ConnectionHistoryService._pending.append(('raw', int(epoch), sample))
+            for tier in ConnectionHistoryService.PERSISTED:
+                step = ConnectionHistoryService.TIERS[tier][0]
+                bucket = int(epoch) - int(epoch) % step
+                current = ConnectionHistoryService._open.get(tier)
+                if current is not None and current['bucket'] != bucket:
+                    point = ConnectionHistoryService._close(current)
+                    ConnectionHistoryService._ring(tier).append(current['bucket'], point)
+                    ConnectionHistoryService._pending.append((tier, current['bucket'], point))
+                    current = None
+                if current is None:
+                    current = {'bucket': bucket, 'count': 0, 'max_active': 0,
+                               'sums': dict.fromkeys(('active', 'unique_ips', 'unique_users'), 0)}
+                    ConnectionHistoryService._open[tier] = current
+                current['count'] += 1
+                current['max_active'] = max(current['max_active'], sample['max_active'])
+                for name in current['sums']:
+                    current['sums'][name] += sample[name]
+
+            due = SharedStateService.enabled() or time.monotonic() >= ConnectionHistoryService._next_persist
+            if due:
+                ConnectionHistoryService._next_persist = time.monotonic() + ConnectionHistoryService.PERSIST_INTERVAL
+                pending = ConnectionHistoryService._pending
+                ConnectionHistoryService._pending = []
+        if due and pending:
+            ConnectionHistoryService._persist(pending)
+
+    @staticmethod
+    def _close(current):
+        point = {name: round(total / current['count'], 2) for name, total in current['sums'].items()}
+        point['max_active'] = current['max_active']
+        return point
+
+    @staticmethod
+    def _persist(pending):
+        """Upsert finished buckets and drop those that fell out of their ring"""
+        rows = [dict(point, tier=tier, bucket=bucket) for tier, bucket, point in pending]
+        try:
+            with db.connection_context():
+                with db.atomic():
+                    for i in range(0, len(rows), 100):
+                        ConnectionSample.insert_many(rows[i:i + 100]).on_conflict_replace().execute()
+                    now = time.time()
+                    for tier in ConnectionHistoryService._stored_tiers():
+                        step, capacity = ConnectionHistoryService.TIERS[tier]
+                        ConnectionSample.delete().where(
+                            (ConnectionSample.tier == tier) & (ConnectionSample.bucket < now - step * capacity)
+                        ).execute()
+        except Exception as e:
+            print(f"Error saving connection history: {e}")
+            # Keep the buckets for the next attempt
+            with ConnectionHistoryService._lock:
+                ConnectionHistoryService._pending[:0] = pending
+
+    @staticmethod
+    def _stored_tiers():
+        if SharedStateService.enabled():
+            return ('raw',) + ConnectionHistoryService.PERSISTED
+        return ConnectionHistoryService.PERSISTED
+
+    @staticmethod
+    def tier_for(seconds):
+        """The finest tier that covers the last ``seconds`` seconds"""
+        for tier, (step, capacity) in ConnectionHistoryService.TIERS.items():
+            if step * capacity >= seconds:
+                return tier
+        return 'hour'
+
+    @staticmethod
+    def history(tier=None, since=None, seconds=3600):
+        """Points of one tier, the unfinished bucket included, oldest first"""
+        if tier is None:
+            tier = ConnectionHistoryService.tier_for(seconds)
+        if tier not in ConnectionHistoryService.TIERS:
+            raise ValueError(f"tier must be one of {', '.join(ConnectionHistoryService.TIERS)}")
+        if since is None:
+            since = time.time() - seconds
+        if not SharedStateService.is_leader():
+            return ConnectionHistoryService._stored_history(tier, since)
+
+        with ConnectionHistoryService._lock:
+            points = ConnectionHistoryService._ring(tier).points(since)
+            current = ConnectionHistoryService._open.get(tier)
+            if current is not None and current['bucket'] >= since:
+                points.append(dict(ConnectionHistoryService._close(current), t=current['bucket']))
+
+        for point in points:
+            point['t'] = int(point['t'])
+            point['max_active'] = int(point['max_active'])
+        return {'tier': tier, 'step': ConnectionHistoryService.TIERS[tier][0], 'points': points}
+
+    @staticmethod
+    def _stored_history(tier, since):
+        """History as persisted by the leader worker"""
+        query = (ConnectionSample
+                 .select(ConnectionSample.bucket.alias('t'),
+                         *[getattr(ConnectionSample, name) for name in ConnectionHistoryService.FIELDS])
+                 .where((ConnectionSample.tier == tier) & (ConnectionSample.bucket >= since))
+                 .order_by(ConnectionSample.bucket.desc())
+                 .limit(ConnectionHistoryService.TIERS[tier][1])
+                 .dicts())
+        return {'tier': tier, 'step': ConnectionHistoryService.TIERS[tier][0], 'points': list(query)[::-1]}
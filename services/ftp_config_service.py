@@ -1,7 +1,15 @@
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import threading
+from datetime import datetime
 from models import ConfigChange, db
+from utils.vsftpd_conf import VsftpdConf, coerce_value
+from services.vsftpd_reload_service import VsftpdReloadService
+
+CONFIG_KEY_RE = re.compile(r'^[a-z0-9_]+$')
 
 class FTPConfigService:
     CONFIG_FILE = '/etc/vsftpd/vsftpd.conf'
@@ -30,134 +38,195 @@ class FTPConfigService:
         'pasv_max_port': {'type': 'int', 'description': 'Passive mode max port'}
     }
     
+    _model = None
+    _model_key = None
+    _model_lock = threading.Lock()
+    
+    @staticmethod
+    def _load_model():
+        """Parsed vsftpd.conf, re-parsed only when the file's inode/mtime/size change"""
+        try:
+            st = os.stat(FTPConfigService.CONFIG_FILE)
+        except FileNotFoundError:
+            return VsftpdConf()
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with FTPConfigService._model_lock:
+            if FTPConfigService._model_key != key:
+                FTPConfigService._model = VsftpdConf.load(FTPConfigService.CONFIG_FILE)
+                FTPConfigService._model_key = key
+            return FTPConfigService._model
+    
+    @staticmethod
+    def _store_model(conf):
+        """Cache a model that was just written so it is not parsed again"""
+        st = os.stat(FTPConfigService.CONFIG_FILE)
+        with FTPConfigService._model_lock:
+            FTPConfigService._model = conf
+            FTPConfigService._model_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    
     @staticmethod
     def read_config():
         """Read current vsftpd configuration"""
-        config = {}
         try:
-            if not os.path.exists(FTPConfigService.CONFIG_FILE):
-                return config
-                
-            with open(FTPConfigService.CONFIG_FILE, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        if '=' in line:
-                            key, value = line.split('=', 1)
-                            config[key.strip()] = value.strip()
+            return FTPConfigService._load_model().as_dict()
         except Exception as e:
             print(f"Error reading config: {str(e)}")
-            
-        return config
+            return {}
+    
+    @staticmethod
+    def get_option(key, default=None):
+        """Current value of an option converted to its CONFIG_OPTIONS type"""
+        return FTPConfigService._load_model().get_typed(key, FTPConfigService.CONFIG_OPTIONS, default)
     
     @staticmethod
     def update_config(key, value, user):
-        """Update vsftpd configuration"""
+        """Update a single vsftpd configuration option"""
+        return FTPConfigService.update_config_batch({key: value}, user)
+    
+    @staticmethod
+    def update_config_batch(changes, user):
+        """Apply several configuration changes as one transaction
+
+        The cached config model is patched in memory (comments and option
+        order are kept), the file is backed up once and swapped in with a
+        single atomic rename. The new file is validated before the
+        change rows are recorded; any failure puts the previous file back.
+        One reload is scheduled for the whole batch. Raises ValueError when
+        a value is not a string or number.
+        """
+        if not changes:
+            return False, "No configuration changes given"
+        for key, value in changes.items():
+            # str(None) would write the literal 'None' into vsftpd.conf
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise ValueError(f"{key}: value must be a string or a number")
+        changes = {str(k).strip(): str(v).strip() for k, v in changes.items()}
+        
+        errors = FTPConfigService._check_values(changes)
+        if errors:
+            return False, "Invalid configuration: " + "; ".join(errors)
+        
+        config_file = FTPConfigService.CONFIG_FILE
+        backup_file = None
         try:
-            # Backup current config
-            backup_success, backup_msg = FTPConfigService._backup_config()
-            if not backup_success:
-                return False, f"Failed to backup config: {backup_msg}"
-            
-            # Read current config
-            current_config = FTPConfigService.read_config()
-            old_value = current_config.get(key, None)
-            
-            # Read file content
-            with open(FTPConfigService.CONFIG_FILE, 'r') as f:
-                lines = f.readlines()
-            
-            # Update or add configuration
-            updated = False
-            new_lines = []
-            
-            for line in lines:
-                stripped_line = line.strip()
-                if stripped_line.startswith(f'{key}='):
-                    new_lines.append(f'{key}={value}\n')
-                    updated = True
-                else:
-                    new_lines.append(line)
+            conf = FTPConfigService._load_model().copy()
+            old_values = {key: conf.get(key) for key in changes}
+            changed = {k: v for k, v in changes.items() if old_values.get(k) != v}
+            if not changed:
+                return True, "Configuration unchanged"
             
-            # If key wasn't found, add it
-            if not updated:
-                new_lines.append(f'{key}={value}\n')
+            success, backup_file = FTPConfigService._backup_config()
+            if not success:
+                return False, f"Failed to backup config: {backup_file}"
             
-            # Write back to temporary file first
-            temp_file = f"{FTPConfigService.CONFIG_FILE}.tmp"
-            with open(temp_file, 'w') as f:
-                f.writelines(new_lines)
+            for key, value in changed.items():
+                conf.set(key, value)
+            FTPConfigService._write_atomic(config_file, conf.serialize())
+            FTPConfigService._store_model(conf)
             
-            # Move temp file to actual config file
-            subprocess.run(['sudo', 'mv', temp_file, FTPConfigService.CONFIG_FILE], 
-                         check=True, capture_output=True, text=True)
-            subprocess.run(['sudo', 'chmod', '644', FTPConfigService.CONFIG_FILE], 
-                         check=True, capture_output=True, text=True)
+            valid, message = FTPConfigService.validate_config(changed.keys())
+            if not valid:
+                FTPConfigService._restore_backup(backup_file)
+                return False, f"{message}; previous configuration restored"
             
-            # Log change
-            ConfigChange.create(
-                config_key=key,
-                old_value=old_value,
-                new_value=value,
-                changed_by=user
-            )
-            
-            # Restart vsftpd
-            restart_success, restart_msg = FTPConfigService._restart_vsftpd()
-            if not restart_success:
-                return False, f"Config updated but failed to restart VSFTPD: {restart_msg}"
-            
-            return True, "Configuration updated successfully"
-            
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if e.stderr else str(e)
-            return False, f"Error updating config: {error_msg}"
+            with db.atomic():
+                ConfigChange.insert_many([{
+                    'config_key': key,
+                    'old_value': old_values.get(key),
+                    'new_value': value,
+                    'changed_by': user.id,
+                    'changed_at': datetime.now()
+                } for key, value in changed.items()]).execute()
         except Exception as e:
+            if backup_file:
+                FTPConfigService._restore_backup(backup_file)
             return False, f"Error updating config: {str(e)}"
+        
+        # Reload vsftpd together with any other pending changes
+        generation = VsftpdReloadService.config_changed(changed.keys())
+        return True, f"Configuration updated: {', '.join(changed)} (pending reload, generation {generation})"
+    
+    @staticmethod
+    def _write_atomic(path, text):
+        """Write a file through a temp file in the same directory and rename it"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.vsftpd.conf.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
     
     @staticmethod
     def _backup_config():
-        """Create backup of current configuration"""
+        """Create backup of current configuration; returns (success, backup path or error)"""
         try:
-            from datetime import datetime
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = f"{FTPConfigService.CONFIG_FILE}.backup.{timestamp}"
-            
-            subprocess.run([
-                'sudo', 'cp', FTPConfigService.CONFIG_FILE, backup_file
-            ], check=True, capture_output=True, text=True)
-            
-            return True, f"Config backed up to {backup_file}"
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if e.stderr else str(e)
-            return False, f"Backup failed: {error_msg}"
+            config_file = FTPConfigService.CONFIG_FILE
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            backup_file = f"{config_file}.backup.{timestamp}"
+            if os.path.exists(config_file):
+                shutil.copy2(config_file, backup_file)
+            else:
+                # Nothing to back up: an empty backup restores to an empty file
+                open(backup_file, 'w').close()
+            return True, backup_file
         except Exception as e:
             return False, str(e)
     
     @staticmethod
-    def _restart_vsftpd():
-        """Restart VSFTPD service"""
+    def _restore_backup(backup_file):
+        """Put a backup taken by _backup_config back in place"""
         try:
-            subprocess.run(['sudo', 'systemctl', 'restart', 'vsftpd'], 
-                         check=True, capture_output=True, text=True)
-            return True, "VSFTPD restarted successfully"
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if e.stderr else str(e)
-            return False, f"Failed to restart VSFTPD: {error_msg}"
+            with open(backup_file, 'r') as f:
+                text = f.read()
+            FTPConfigService._write_atomic(FTPConfigService.CONFIG_FILE, text)
+        except Exception as e:
+            print(f"Error restoring config backup {backup_file}: {e}")
+    
+    @staticmethod
+    def _check_values(config):
+        """Type check option values against CONFIG_OPTIONS; returns a list of errors"""
+        errors = []
+        for key, value in config.items():
+            if not CONFIG_KEY_RE.match(key):
+                errors.append(f"invalid option name '{key}'")
+                continue
+            if '\n' in value or '\r' in value:
+                errors.append(f"{key}: value must be a single line")
+                continue
+            try:
+                coerce_value(value, FTPConfigService.CONFIG_OPTIONS.get(key, {}).get('type'))
+            except ValueError as e:
+                errors.append(f"{key}: {e}")
+        return errors
     
     @staticmethod
-    def validate_config():
-        """Validate current VSFTPD configuration"""
+    def validate_config(keys=None):
+        """Validate current VSFTPD configuration
+
+        vsftpd has no config test mode, so the file is checked in process:
+        option names, value types of known options and the passive port range.
+        With ``keys`` only those options are type checked (plus the
+        cross-option checks), so a line nobody touched cannot block an update.
+        """
         try:
-            # Test configuration by checking if vsftpd can start
-            result = subprocess.run([
-                'sudo', 'vsftpd', '-t', FTPConfigService.CONFIG_FILE
-            ], capture_output=True, text=True)
+            config = FTPConfigService.read_config()
+            checked = config if keys is None else {key: config[key] for key in keys if key in config}
+            errors = FTPConfigService._check_values(checked)
             
-            if result.returncode == 0:
-                return True, "Configuration is valid"
-            else:
-                return False, f"Configuration error: {result.stderr}"
+            pasv_min = config.get('pasv_min_port', '')
+            pasv_max = config.get('pasv_max_port', '')
+            if pasv_min.isdigit() and pasv_max.isdigit() and int(pasv_min) > int(pasv_max):
+                errors.append("pasv_min_port is greater than pasv_max_port")
+            
+            if errors:
+                return False, "Configuration error: " + "; ".join(errors)
+            return True, "Configuration is valid"
                 
         except Exception as e:
             return False, f"Error validating config: {str(e)}"
@@ -1,239 +1,114 @@
 import subprocess
 import psutil,os
-import re
 from datetime import datetime
 from models import FTPConnection, db
+from services.ftp_session_service import FTPSessionService
+from utils.proc_net import ProcNet
 
 class FTPConnectionService:
+    FTP_PORT = 21
+    PROCESS_NAME = 'vsftpd'
+    PROC_ROOT = '/proc'
     
     @staticmethod
     def get_active_connections():
         """Get currently active FTP connections with proper username detection"""
-        connections = []
-        
         try:
-            # Method 1: Parse vsftpd log for active sessions
-            log_connections = FTPConnectionService._get_connections_from_logs()
-            connections.extend(log_connections)
-            
-            # Method 2: Use netstat with process info
-            netstat_connections = FTPConnectionService._get_connections_netstat()
-            connections.extend(netstat_connections)
+            # Bring the login index up to date once; lookups below are dict accesses
+            FTPSessionService.refresh()
             
-            # Method 3: Parse vsftpd processes
-            process_connections = FTPConnectionService._get_connections_from_processes()
-            connections.extend(process_connections)
-            
-            # Remove duplicates and merge information
-            unique_connections = FTPConnectionService._merge_connection_data(connections)
-            
-            return unique_connections
+            if os.path.exists(os.path.join(FTPConnectionService.PROC_ROOT, 'net', 'tcp')):
+                return FTPConnectionService._collect_sessions()
+            return FTPConnectionService._collect_sessions_psutil()
             
         except Exception as e:
             print(f"Error getting connections: {e}")
             return []
     
     @staticmethod
-    def _get_connections_from_logs():
-        """Extract active connections from vsftpd logs"""
+    def _collect_sessions(port=None, process_name=None, proc_root=None):
+        """Collect established FTP sessions in one pass over /proc
+
+        Reads /proc/net/tcp and tcp6 once, then maps socket inodes to pids by
+        scanning only the fd directories of vsftpd processes. Each socket is
+        reported once even when the session's parent and child both hold it.
+        """
+        port = port or FTPConnectionService.FTP_PORT
+        process_name = process_name or FTPConnectionService.PROCESS_NAME
+        proc_root = proc_root or FTPConnectionService.PROC_ROOT
+        
+        sockets = ProcNet.established_sockets(port, proc_root)
+        if not sockets:
+            return []
+        
+        pids = ProcNet.find_pids(process_name, proc_root)
+        owners = ProcNet.socket_owners(sockets.keys(), pids, proc_root)
+        
         connections = []
-        try:
-            log_file = '/var/log/vsftpd.log'
-            if not os.path.exists(log_file):
-                return connections
-            
-            # Read recent log entries
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-            
-            # Look for recent LOGIN entries without corresponding logout
-            recent_logins = {}
-            
-            # Process last 100 lines to find active sessions
-            for line in lines[-100:]:
-                # Parse login entries
-                login_match = re.search(r'\[pid\s+(\d+)\]\s+\[([^\]]+)\]\s+OK\s+LOGIN:', line)
-                if login_match:
-                    pid = login_match.group(1)
-                    username = login_match.group(2)
-                    
-                    # Extract IP address
-                    ip_match = re.search(r'Client\s+"([^"]+)"', line)
-                    ip_address = ip_match.group(1) if ip_match else 'unknown'
-                    
-                    # Extract timestamp
-                    time_match = re.search(r'^(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)', line)
-                    timestamp = time_match.group(1) if time_match else datetime.now().strftime('%a %b %d %H:%M:%S %Y')
-                    
-                    recent_logins[pid] = {
-                        'pid': int(pid),
-                        'username': username,
-                        'ip_address': ip_address,
-                        'connected_at': timestamp,
-                        'status': 'ACTIVE',
-                        'source': 'log'
-                    }
-                
-                # Look for logout/disconnect entries to remove from active list
-                logout_match = re.search(r'\[pid\s+(\d+)\].*(?:LOGOUT|FTP session closed)', line)
-                if logout_match:
-                    pid = logout_match.group(1)
-                    if pid in recent_logins:
-                        del recent_logins[pid]
-            
-            # Check if PIDs are still active
-            for pid_str, conn_info in recent_logins.items():
-                try:
-                    # Check if process still exists
-                    proc = psutil.Process(int(pid_str))
-                    if proc.is_running():
-                        connections.append(conn_info)
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    # Process no longer exists
-                    continue
-                    
-        except Exception as e:
-            print(f"Error parsing logs for connections: {e}")
-            
+        for inode, socket_pids in owners.items():
+            local_ip, local_port, remote_ip, remote_port = sockets[inode]
+            connections.append(FTPConnectionService._build_connection(
+                socket_pids, remote_ip, f"{local_ip}:{local_port}", f"{remote_ip}:{remote_port}"
+            ))
         return connections
     
     @staticmethod
-    def _get_connections_netstat():
-        """Get connections using netstat with enhanced username detection"""
+    def _collect_sessions_psutil():
+        """Fallback for systems without /proc/net: one psutil socket snapshot"""
+        owners = {}
+        for conn in psutil.net_connections(kind='tcp'):
+            if (conn.status == psutil.CONN_ESTABLISHED and conn.pid and conn.raddr and
+                    conn.laddr.port == FTPConnectionService.FTP_PORT):
+                key = (conn.laddr, conn.raddr)
+                owners.setdefault(key, []).append(conn.pid)
+        
         connections = []
-        try:
-            # Get FTP connections on port 21
-            result = subprocess.run([
-                'netstat', '-tnp'
-            ], capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                lines = result.stdout.split('\n')
-                for line in lines:
-                    if ':21 ' in line and 'ESTABLISHED' in line:
-                        parts = line.split()
-                        if len(parts) >= 7:
-                            local_addr = parts[3]
-                            foreign_addr = parts[4]
-                            pid_program = parts[6] if len(parts) > 6 else ''
-                            
-                            # Extract PID
-                            pid_match = re.search(r'(\d+)/', pid_program)
-                            if pid_match:
-                                pid = int(pid_match.group(1))
-                                
-                                # Extract IP
-                                ip_match = re.search(r'([0-9.]+):', foreign_addr)
-                                ip = ip_match.group(1) if ip_match else 'unknown'
-                                
-                                # Get username from process or log correlation
-                                username = FTPConnectionService._get_username_for_connection(pid, ip)
-                                
-                                connections.append({
-                                    'pid': pid,
-                                    'ip_address': ip,
-                                    'username': username,
-                                    'connected_at': datetime.now().isoformat(),
-                                    'local_address': local_addr,
-                                    'remote_address': foreign_addr,
-                                    'status': 'ESTABLISHED',
-                                    'source': 'netstat'
-                                })
-                                
-        except Exception as e:
-            print(f"Error with netstat: {e}")
-            
+        for (laddr, raddr), pids in owners.items():
+            connections.append(FTPConnectionService._build_connection(
+                pids, raddr.ip, f"{laddr.ip}:{laddr.port}", f"{raddr.ip}:{raddr.port}"
+            ))
         return connections
     
     @staticmethod
-    def _get_connections_from_processes():
-        """Get connections by analyzing vsftpd processes"""
-        connections = []
-        try:
-            # Find all vsftpd processes
-            for proc in psutil.process_iter(['pid', 'name', 'username', 'create_time', 'connections', 'cmdline']):
-                try:
-                    if 'vsftpd' in proc.info['name'].lower():
-                        pid = proc.info['pid']
-                        
-                        # Skip the main vsftpd process (usually has no connections)
-                        proc_connections = proc.info.get('connections', [])
-                        if not proc_connections:
-                            continue
-                        
-                        # Look for established connections on port 21
-                        for conn in proc_connections:
-                            if (hasattr(conn, 'status') and 
-                                conn.status == psutil.CONN_ESTABLISHED and 
-                                hasattr(conn, 'laddr') and 
-                                conn.laddr.port == 21):
-                                
-                                ip_address = conn.raddr.ip if hasattr(conn, 'raddr') and conn.raddr else 'unknown'
-                                
-                                # Try to get username from log correlation
-                                username = FTPConnectionService._get_username_for_connection(pid, ip_address)
-                                
-                                connections.append({
-                                    'pid': pid,
-                                    'ip_address': ip_address,
-                                    'username': username,
-                                    'connected_at': datetime.fromtimestamp(proc.info['create_time']).isoformat(),
-                                    'local_address': f"{conn.laddr.ip}:{conn.laddr.port}",
-                                    'remote_address': f"{conn.raddr.ip}:{conn.raddr.port}" if hasattr(conn, 'raddr') and conn.raddr else 'unknown',
-                                    'status': 'ESTABLISHED',
-                                    'source': 'process'
-                                })
-                                
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    continue
-                    
-        except Exception as e:
-            print(f"Error analyzing processes: {e}")
-            
-        return connections
+    def _build_connection(pids, ip_address, local_address, remote_address):
+        # Prefer the pid that logged the login; otherwise the session parent
+        pid = next((p for p in pids if FTPSessionService.lookup_pid(p)), min(pids))
+        session = FTPSessionService.lookup_pid(pid)
+        
+        if session:
+            username = session[0]
+            connected_at = datetime.fromtimestamp(session[2]).isoformat()
+        else:
+            username = FTPConnectionService._get_username_for_connection(pid, ip_address)
+            try:
+                connected_at = datetime.fromtimestamp(psutil.Process(pid).create_time()).isoformat()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                connected_at = datetime.now().isoformat()
+        
+        return {
+            'pid': pid,
+            'ip_address': ip_address,
+            'username': username,
+            'connected_at': connected_at,
+            'local_address': local_address,
+            'remote_address': remote_address,
+            'status': 'ESTABLISHED'
+        }
     
     @staticmethod
     def _get_username_for_connection(pid, ip_address):
         """Get username for a connection using multiple methods"""
         try:
-            # Method 1: Check recent log entries for this PID
-            log_file = '/var/log/vsftpd.log'
-            if os.path.exists(log_file):
-                try:
-                    with open(log_file, 'r') as f:
-                        lines = f.readlines()
-                    
-                    # Look for login entries with this PID
-                    for line in reversed(lines[-50:]):  # Check last 50 lines
-                        if f'[pid {pid}]' in line:
-                            # Look for username in brackets
-                            username_match = re.search(r'\[pid\s+' + str(pid) + r'\]\s+\[([^\]]+)\]', line)
-                            if username_match:
-                                return username_match.group(1)
-                            
-                            # Alternative pattern for LOGIN entries
-                            login_match = re.search(r'\[pid\s+' + str(pid) + r'\].*LOGIN.*user\s+(\w+)', line, re.IGNORECASE)
-                            if login_match:
-                                return login_match.group(1)
-                
-                except Exception:
-                    pass
+            # Method 1: Login recorded for this PID
+            session = FTPSessionService.lookup_pid(pid)
+            if session:
+                return session[0]
             
-            # Method 2: Check if we can correlate by IP address from recent logs
+            # Method 2: Last login from the same IP address
             if ip_address != 'unknown':
-                try:
-                    with open(log_file, 'r') as f:
-                        lines = f.readlines()
-                    
-                    # Look for recent logins from this IP
-                    for line in reversed(lines[-100:]):
-                        if ip_address in line and 'LOGIN' in line:
-                            username_match = re.search(r'\[([^\]]+)\]\s+OK\s+LOGIN', line)
-                            if username_match:
-                                return username_match.group(1)
-                
-                except Exception:
-                    pass
+                last_login = FTPSessionService.lookup_ip(ip_address)
+                if last_login:
+                    return last_login[0]
             
             # Method 3: Try to get process owner (may not be the FTP user)
             try:
@@ -250,31 +125,6 @@ class FTPConnectionService:
         
         return 'unknown'
     
-    @staticmethod
-    def _merge_connection_data(connections):
-        """Merge connection data from different sources"""
-        merged = {}
-        
-        for conn in connections:
-            key = f"{conn['pid']}_{conn['ip_address']}"
-            
-            if key not in merged:
-                merged[key] = conn
-            else:
-                # Merge data, preferring log data for usernames
-                existing = merged[key]
-                if conn.get('source') == 'log' and existing.get('username') in ['unknown', 'nobody']:
-                    existing['username'] = conn['username']
-                elif conn.get('username') not in ['unknown', 'nobody'] and existing.get('username') in ['unknown', 'nobody']:
-                    existing['username'] = conn['username']
-                
-                # Update other fields if they're better
-                for field in ['local_address', 'remote_address', 'status']:
-                    if field in conn and conn[field] != 'unknown':
-                        existing[field] = conn[field]
-        
-        return list(merged.values())
-    
     @staticmethod
     def kill_connection(pid):
         """Kill an FTP connection by PID"""
@@ -298,10 +148,11 @@ class FTPConnectionService:
             return False, f"Error killing connection: {str(e)}"
     
     @staticmethod
-    def get_connection_stats():
-        """Get connection statistics"""
+    def get_connection_stats(connections=None):
+        """Get connection statistics, optionally of already collected connections"""
         try:
-            connections = FTPConnectionService.get_active_connections()
+            if connections is None:
+                connections = FTPConnectionService.get_active_connections()
             
             stats = {
                 'total_active': len(connections),
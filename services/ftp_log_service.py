@@ -1,11 +1,62 @@
+import base64
+import json
 import os
 import re
-from datetime import datetime
-from models import FTPLog, db
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from peewee import Tuple
+from models import FTPLog, FTPLogSearch, db
+from utils.log_parser import parse_vsftpd_line, parse_xfer_line, extract_ip
+from utils.log_tailer import LogTailer
+from utils.rotated_logs import read_lines, read_lines_reversed, rotated_siblings
+from services.analytics_service import AnalyticsService
 
 class FTPLogService:
     VSFTPD_LOG_FILE = '/var/log/vsftpd.log'
     XFERLOG_FILE = '/var/log/xferlog'
+    # Lines kept in memory per log file by the shared tailers
+    TAIL_LINES = 1000
+    # Page size bounds for query_logs
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    # Query parameters accepted by query_logs mapped to FTPLog columns
+    FILTER_FIELDS = {
+        'username': 'username',
+        'ip': 'ip_address',
+        'action': 'action',
+        'status': 'status',
+        'source': 'source',
+    }
+    # Fields a full-text search can be restricted to
+    SEARCH_FIELDS = {
+        'filename': 'file_path',
+        'username': 'username',
+        'ip': 'ip_address',
+    }
+    SEARCH_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+    # Last parsed lines of each rotated file kept with its time span
+    ROTATED_TAIL_LINES = 100
+
+    # (st_dev, st_ino) -> ((size, mtime), first epoch, last epoch, tail records)
+    _file_spans = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def log_sources():
+        """Log files as (source, path, line parser)"""
+        return [
+            ('vsftpd', FTPLogService.VSFTPD_LOG_FILE, parse_vsftpd_line),
+            ('xferlog', FTPLogService.XFERLOG_FILE, parse_xfer_line),
+        ]
+
+    @staticmethod
+    def log_files(path):
+        """A log file and its rotated (.1, .2.gz, -YYYYMMDD) copies, newest first"""
+        files = rotated_siblings(path)
+        if os.path.exists(path):
+            files.insert(0, path)
+        return files
     
     @staticmethod
     def get_recent_logs(limit=100):
@@ -20,22 +71,150 @@ class FTPLogService:
         if os.path.exists(FTPLogService.XFERLOG_FILE):
             logs.extend(FTPLogService._parse_xfer_log(limit))
         
+        # Right after a rotation the live files hold little or nothing
+        if len(logs) < limit:
+            logs.extend(FTPLogService._rotated_tail(limit - len(logs)))
+        
         # Sort by timestamp and limit
-        logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        logs.sort(key=lambda x: x.get('epoch', 0), reverse=True)
         return logs[:limit]
     
+    @staticmethod
+    def query_logs(filters=None, cursor=None, limit=None):
+        """Get one page of ingested logs, newest first
+
+        Uses keyset pagination on (timestamp, id), so every page is an index
+        range scan whose cost depends on the page size only. Returns
+        (logs, next_cursor); next_cursor is None on the last page.
+        """
+        filters = filters or {}
+        limit = min(max(int(limit or FTPLogService.DEFAULT_PAGE_SIZE), 1), FTPLogService.MAX_PAGE_SIZE)
+
+        query = FTPLog.select()
+        for param, column in FTPLogService.FILTER_FIELDS.items():
+            value = filters.get(param)
+            if value:
+                query = query.where(getattr(FTPLog, column) == value)
+        if filters.get('since'):
+            query = query.where(FTPLog.timestamp >= FTPLogService._parse_time(filters['since']))
+        if filters.get('until'):
+            query = query.where(FTPLog.timestamp < FTPLogService._parse_time(filters['until']))
+        if cursor:
+            timestamp, row_id = FTPLogService._decode_cursor(cursor)
+            query = query.where(
+                Tuple(FTPLog.timestamp, FTPLog.id) < Tuple(timestamp, row_id)
+            )
+
+        rows = list(query.order_by(FTPLog.timestamp.desc(), FTPLog.id.desc()).limit(limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = FTPLogService._encode_cursor(rows[-1])
+
+        return [FTPLogService._log_to_dict(row) for row in rows], next_cursor
+    
+    @staticmethod
+    def search_logs(query, field=None, cursor=None, limit=None):
+        """Full-text search over transfer filenames, usernames and IPs
+
+        Bare words must all match, "quoted text" matches a phrase and a
+        trailing * matches a prefix (invoice_20*). Results are newest first;
+        returns (logs, next_cursor).
+        """
+        expression = FTPLogService._build_match_expression(query, field)
+        limit = min(max(int(limit or FTPLogService.DEFAULT_PAGE_SIZE), 1), FTPLogService.MAX_PAGE_SIZE)
+
+        matches = FTPLogSearch.select(FTPLogSearch.rowid).where(FTPLogSearch.match(expression))
+        if cursor:
+            try:
+                before = int(cursor)
+            except ValueError:
+                raise ValueError("Invalid cursor")
+            matches = matches.where(FTPLogSearch.rowid < before)
+        matches = matches.order_by(FTPLogSearch.rowid.desc()).limit(limit + 1)
+
+        rows = list(FTPLog.select().where(FTPLog.id.in_(matches)).order_by(FTPLog.id.desc()))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1].id)
+
+        return [FTPLogService._log_to_dict(row) for row in rows], next_cursor
+    
+    @staticmethod
+    def _build_match_expression(query, field=None):
+        """Turn a user query into an FTS5 expression with every term quoted"""
+        terms = []
+        for phrase, word in FTPLogService.SEARCH_TOKEN_RE.findall(query or ''):
+            prefix = False
+            text = phrase.strip()
+            if not phrase:
+                prefix = word.endswith('*')
+                text = word.rstrip('*')
+            if not text:
+                continue
+            term = '"' + text.replace('"', '""') + '"'
+            terms.append(term + '*' if prefix else term)
+
+        if not terms:
+            raise ValueError("Search query is empty")
+
+        expression = ' AND '.join(terms)
+        if field:
+            if field not in FTPLogService.SEARCH_FIELDS:
+                raise ValueError(f"Unknown search field: {field}")
+            expression = f"{FTPLogService.SEARCH_FIELDS[field]} : ({expression})"
+        return expression
+    
+    @staticmethod
+    def _log_to_dict(row):
+        return {
+            'id': row.id,
+            'timestamp': datetime.fromtimestamp(row.timestamp).isoformat(),
+            'epoch': row.timestamp,
+            'pid': row.pid,
+            'username': row.username,
+            'status': row.status,
+            'action': row.action,
+            'details': row.details,
+            'ip_address': row.ip_address,
+            'file_path': row.file_path,
+            'source': row.source,
+        }
+    
+    @staticmethod
+    def _parse_time(value):
+        """Accept epoch seconds or an ISO 8601 string; returns epoch seconds"""
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid time value: {value}")
+    
+    @staticmethod
+    def _encode_cursor(row):
+        payload = json.dumps([row.timestamp, row.id]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+            return int(timestamp), int(row_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+    
     @staticmethod
     def _parse_vsftpd_log(limit=50):
         """Parse vsftpd.log file"""
         logs = []
         try:
-            with open(FTPLogService.VSFTPD_LOG_FILE, 'r') as f:
-                lines = f.readlines()
-                
-            # Get last N lines
-            recent_lines = lines[-limit:] if len(lines) > limit else lines
-            
-            for line in recent_lines:
+            tailer = LogTailer.for_file(FTPLogService.VSFTPD_LOG_FILE, FTPLogService.TAIL_LINES)
+            for line in tailer.recent(limit):
                 line = line.strip()
                 if not line:
                     continue
@@ -55,13 +234,8 @@ class FTPLogService:
         """Parse xferlog (transfer log) file"""
         logs = []
         try:
-            with open(FTPLogService.XFERLOG_FILE, 'r') as f:
-                lines = f.readlines()
-                
-            # Get last N lines
-            recent_lines = lines[-limit:] if len(lines) > limit else lines
-            
-            for line in recent_lines:
+            tailer = LogTailer.for_file(FTPLogService.XFERLOG_FILE, FTPLogService.TAIL_LINES)
+            for line in tailer.recent(limit):
                 line = line.strip()
                 if not line:
                     continue
@@ -76,138 +250,227 @@ class FTPLogService:
             
         return logs
     
+    @staticmethod
+    def _rotated_tail(limit):
+        """Newest lines of the rotated log files, from the span cache"""
+        logs = []
+        for source, path, parser in FTPLogService.log_sources():
+            found = []
+            for rotated in rotated_siblings(path):
+                if len(found) >= limit:
+                    break
+                try:
+                    span = FTPLogService._file_span(rotated, parser)
+                except OSError as e:
+                    print(f"Error reading {rotated}: {e}")
+                    continue
+                if span:
+                    found.extend(reversed(span[2][-(limit - len(found)):]))
+            logs.extend(record.to_dict() for record in found)
+        return logs
+
+    @staticmethod
+    def read_logs(filters=None, limit=None):
+        """Newest log lines read from the log files themselves, newest first
+
+        Covers the rotated copies too, decompressing .gz files as they are
+        streamed, so history that was never ingested (or has been archived)
+        stays reachable. Files are visited newest first and only until
+        ``limit`` lines are found; plain files are read from the end. Accepts
+        the filters of query_logs; files whose time span lies outside
+        since/until are not read. Returns (logs, stats).
+        """
+        filters = filters or {}
+        limit = min(max(int(limit or FTPLogService.DEFAULT_PAGE_SIZE), 1), FTPLogService.MAX_PAGE_SIZE)
+        start = FTPLogService._parse_time(filters['since']) if filters.get('since') else None
+        end = FTPLogService._parse_time(filters['until']) if filters.get('until') else None
+        wanted = {column: filters.get(param) for param, column in FTPLogService.FILTER_FIELDS.items()
+                  if filters.get(param)}
+        stats = {'files': 0, 'read': 0}
+
+        records = []
+        for source, path, parser in FTPLogService.log_sources():
+            if wanted.get('source', source) != source:
+                continue
+            found = []
+            for log_file in FTPLogService.log_files(path):
+                if len(found) >= limit:
+                    break
+                stats['files'] += 1
+                try:
+                    span = FTPLogService._file_span(log_file, parser, live=log_file == path)
+                    if span is None:
+                        continue
+                    first, last = span[0], span[1]
+                    if (end is not None and first >= end) or (start is not None and last is not None and last < start):
+                        continue
+                    stats['read'] += 1
+                    found.extend(FTPLogService._newest_matches(log_file, parser, start, end, wanted,
+                                                               limit - len(found)))
+                except OSError as e:
+                    print(f"Error reading {log_file}: {e}")
+            records.extend(found)
+
+        records.sort(key=lambda record: record.epoch, reverse=True)
+        return [record.to_dict() for record in records[:limit]], stats
+
+    @staticmethod
+    def _newest_matches(path, parser, start, end, wanted, limit):
+        """Up to ``limit`` newest records of one log file matching the filters, newest first
+
+        Plain files are read backwards from the end and only as far as
+        needed; gzip streams can only be read forwards, so those are read
+        whole, keeping the newest matches.
+        """
+        def matching(record):
+            return (record is not None
+                    and (end is None or record.epoch < end)
+                    and all(getattr(record, column) == value for column, value in wanted.items()
+                            if column != 'source'))
+
+        if path.endswith('.gz'):
+            matches = deque(maxlen=limit)
+            for line in read_lines(path):
+                record = FTPLogService._parse_record(parser, line)
+                if matching(record) and (start is None or record.epoch >= start):
+                    matches.append(record)
+            return list(reversed(matches))
+
+        matches = []
+        for line in read_lines_reversed(path):
+            record = FTPLogService._parse_record(parser, line)
+            if record is None:
+                continue
+            if start is not None and record.epoch < start:
+                # Lines are in time order: everything before this is older
+                break
+            if matching(record):
+                matches.append(record)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    @staticmethod
+    def _file_span(path, parser, live=False):
+        """(first epoch, last epoch, newest records) of a log file, None if it has no lines
+
+        Rotated files no longer change, so each is read once and its span
+        cached by inode, which survives logrotate renaming .1 to .2; a
+        changed size or mtime (e.g. a copy being compressed in place) reads
+        it again. The live file still grows: only its first line is read,
+        its span is open-ended (last is None) and no records are kept.
+        Lines without a timestamp of their own never count towards the span.
+        """
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino)
+        version = (st.st_size, st.st_mtime)
+        with FTPLogService._lock:
+            cached = FTPLogService._file_spans.get(key)
+        if cached is not None:
+            # Entries of the live file keep no records (cached[3] is None)
+            if live and cached[3] is None and cached[0][0] <= st.st_size:
+                return cached[1:]
+            if not live and cached[3] is not None and cached[0] == version:
+                return cached[1:] if cached[1] is not None else None
+
+        first = last = None
+        tail = deque(maxlen=FTPLogService.ROTATED_TAIL_LINES)
+        for line in read_lines(path):
+            record = FTPLogService._parse_record(parser, line)
+            if record is None:
+                continue
+            if live:
+                first = record.epoch
+                break
+            first = record.epoch if first is None else min(first, record.epoch)
+            last = record.epoch if last is None else max(last, record.epoch)
+            tail.append(record)
+
+        if live and first is None:
+            # Nothing logged yet; look again next time
+            return None
+        entry = (version, first, None if live else last, None if live else list(tail))
+        with FTPLogService._lock:
+            if len(FTPLogService._file_spans) >= 1024:
+                FTPLogService._forget_missing_files()
+            FTPLogService._file_spans[key] = entry
+        return entry[1:] if first is not None else None
+
+    @staticmethod
+    def _forget_missing_files():
+        """Drop cached spans of files logrotate has deleted; caller holds _lock"""
+        present = set()
+        for _, path, _ in FTPLogService.log_sources():
+            for log_file in FTPLogService.log_files(path):
+                try:
+                    st = os.stat(log_file)
+                except OSError:
+                    continue
+                present.add((st.st_dev, st.st_ino))
+        for key in [key for key in FTPLogService._file_spans if key not in present]:
+            del FTPLogService._file_spans[key]
+
+    @staticmethod
+    def _parse_record(parser, line):
+        """A record for ``line``, None unless it parses with a timestamp of its own"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            record = parser(line)
+        except Exception:
+            return None
+        # A guessed time would stretch a file's span and defeat the since/until skip
+        return record if record is not None and record.epoch is not None else None
+
     @staticmethod
     def _parse_log_line(line):
         """Parse a single log line from vsftpd.log"""
         try:
-            # Common vsftpd log patterns
-            patterns = [
-                # Login pattern: Mon Dec 4 10:30:15 2023 [pid 1234] [user] OK LOGIN: Client "192.168.1.100"
-                r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+\[pid\s+(\d+)\]\s+\[([^\]]+)\]\s+(\w+)\s+(\w+):\s+(.+)',
-                # Connection pattern: Mon Dec 4 10:30:15 2023 [pid 1234] CONNECT: Client "192.168.1.100"
-                r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+\[pid\s+(\d+)\]\s+(\w+):\s+(.+)',
-                # Generic pattern
-                r'(\w+\s+\w+\s+\d+\s+\d+:\d+:\d+\s+\d+)\s+(.+)'
-            ]
-            
-            for pattern in patterns:
-                match = re.match(pattern, line)
-                if match:
-                    groups = match.groups()
-                    
-                    if len(groups) >= 6:  # Full pattern
-                        return {
-                            'timestamp': groups[0],
-                            'pid': groups[1],
-                            'username': groups[2],
-                            'status': groups[3],
-                            'action': groups[4],
-                            'details': groups[5],
-                            'ip_address': FTPLogService._extract_ip(groups[5])
-                        }
-                    elif len(groups) >= 4:  # Connection pattern
-                        return {
-                            'timestamp': groups[0],
-                            'pid': groups[1],
-                            'username': 'unknown',
-                            'status': 'INFO',
-                            'action': groups[2],
-                            'details': groups[3],
-                            'ip_address': FTPLogService._extract_ip(groups[3])
-                        }
-                    elif len(groups) >= 2:  # Generic pattern
-                        return {
-                            'timestamp': groups[0],
-                            'pid': 'unknown',
-                            'username': 'unknown',
-                            'status': 'INFO',
-                            'action': 'LOG',
-                            'details': groups[1],
-                            'ip_address': FTPLogService._extract_ip(groups[1])
-                        }
-            
-            # If no pattern matches, return basic entry
-            return {
-                'timestamp': datetime.now().strftime('%a %b %d %H:%M:%S %Y'),
-                'pid': 'unknown',
-                'username': 'unknown',
-                'status': 'INFO',
-                'action': 'LOG',
-                'details': line,
-                'ip_address': FTPLogService._extract_ip(line)
-            }
-            
-        except Exception as e:
+            record = parse_vsftpd_line(line)
+            return record.to_dict() if record else None
+        except Exception:
             return None
     
     @staticmethod
     def _parse_xfer_line(line):
         """Parse xferlog format line"""
         try:
-            # xferlog format: DDD MMM dd hh:mm:ss YYYY n hostname filesize filename b _ o r username ftp 0 * c
-            parts = line.split()
-            if len(parts) >= 14:
-                return {
-                    'timestamp': ' '.join(parts[:5]),
-                    'pid': 'xfer',
-                    'username': parts[13] if parts[13] != '*' else 'anonymous',
-                    'status': 'OK',
-                    'action': 'TRANSFER',
-                    'details': f"File: {parts[8]}, Size: {parts[7]} bytes",
-                    'ip_address': parts[6]
-                }
+            record = parse_xfer_line(line)
+            return record.to_dict() if record else None
         except Exception:
-            pass
-        return None
+            return None
     
     @staticmethod
     def _extract_ip(text):
         """Extract IP address from log text"""
-        ip_pattern = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'
-        match = re.search(ip_pattern, text)
-        return match.group(0) if match else 'unknown'
+        return extract_ip(text)
     
     @staticmethod
     def sync_logs_to_db():
-        """Sync recent logs to database (optional)"""
+        """Sync newly appended log lines to the database"""
         try:
-            recent_logs = FTPLogService.get_recent_logs(50)
-            
-            for log_data in recent_logs:
-                # Check if log entry already exists
-                existing = FTPLog.select().where(
-                    (FTPLog.timestamp == log_data['timestamp']) &
-                    (FTPLog.username == log_data['username']) &
-                    (FTPLog.action == log_data['action'])
-                ).exists()
-                
-                if not existing:
-                    FTPLog.create(
-                        timestamp=log_data['timestamp'],
-                        username=log_data['username'],
-                        action=log_data['action'],
-                        ip_address=log_data['ip_address'],
-                        status=log_data['status'],
-                        details=log_data['details']
-                    )
-                    
+            from services.log_ingest_service import LogIngestService
+            return LogIngestService.run_once()
         except Exception as e:
             print(f"Error syncing logs to database: {e}")
+            return 0
     
     @staticmethod
     def get_log_stats():
-        """Get log statistics"""
+        """Get log statistics for the last 24 hours from the traffic rollups"""
         try:
-            logs = FTPLogService.get_recent_logs(1000)
+            since = int((datetime.now() - timedelta(days=1)).timestamp())
+            totals = AnalyticsService.totals('hour', start=since)
             
             stats = {
-                'total_entries': len(logs),
-                'successful_logins': len([l for l in logs if 'LOGIN' in l.get('action', '') and l.get('status') == 'OK']),
-                'failed_logins': len([l for l in logs if 'LOGIN' in l.get('action', '') and l.get('status') != 'OK']),
-                'transfers': len([l for l in logs if 'TRANSFER' in l.get('action', '')]),
-                'unique_ips': len(set([l.get('ip_address') for l in logs if l.get('ip_address') != 'unknown']))
+                'total_entries': FTPLog.select().where(FTPLog.timestamp >= since).count(),
+                'successful_logins': totals['logins'],
+                'failed_logins': totals['failed_logins'],
+                'transfers': totals['files_in'] + totals['files_out'],
+                'unique_ips': totals['unique_ips']
             }
             
             return stats
         except Exception as e:
-            return {'error': str(e)}
\ No newline at end of file
+            return {'error': str(e)}
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from services.ftp_log_service import FTPLogService
+from utils.log_parser import parse_vsftpd_line
+from utils.log_tailer import LogTailer
+
+class FTPSessionService:
+    """In-memory index of FTP logins maintained from the vsftpd.log tail
+
+    Keeps pid -> (username, ip, login_time) and ip -> (username, login_time)
+    maps that are updated incrementally from newly appended log lines, so
+    resolving the user behind a connection is a dict lookup instead of a
+    log scan.
+    """
+
+    # Lines read from the end of the log when the index is first built
+    SEED_LINES = 5000
+    # Seconds between sweeps that drop sessions whose process has exited
+    PRUNE_INTERVAL = 10
+
+    _by_pid = {}
+    _by_ip = {}
+    _tailer = None
+    _last_prune = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def refresh():
+        """Apply log lines appended since the last refresh"""
+        with FTPSessionService._lock:
+            log_file = FTPLogService.VSFTPD_LOG_FILE
+            if FTPSessionService._tailer is None or FTPSessionService._tailer.path != log_file:
+                FTPSessionService._tailer = LogTailer(log_file, max_lines=FTPSessionService.SEED_LINES)
+                FTPSessionService._by_pid = {}
+                FTPSessionService._by_ip = {}
+            try:
+                lines = FTPSessionService._tailer.poll()
+            except OSError as e:
+                print(f"Error reading vsftpd log for sessions: {e}")
+                return
+
+            for line in lines:
+                FTPSessionService._apply(line)
+
+            now = time.time()
+            if now - FTPSessionService._last_prune > FTPSessionService.PRUNE_INTERVAL:
+                FTPSessionService._prune()
+                FTPSessionService._last_prune = now
+
+    @staticmethod
+    def _apply(line):
+        # Cheap substring checks first: most lines are neither logins nor closes
+        if 'LOGIN' in line:
+            record = parse_vsftpd_line(line)
+            if record and record.action == 'LOGIN' and record.status == 'OK' and record.pid:
+                pid = int(record.pid)
+                FTPSessionService._by_pid[pid] = (record.username, record.ip_address, record.epoch)
+                if record.ip_address != 'unknown':
+                    FTPSessionService._by_ip[record.ip_address] = (record.username, record.epoch)
+        elif 'LOGOUT' in line or 'FTP session closed' in line:
+            record = parse_vsftpd_line(line)
+            if record and record.pid and record.pid.isdigit():
+                FTPSessionService._by_pid.pop(int(record.pid), None)
+
+    @staticmethod
+    def _prune():
+        for pid in list(FTPSessionService._by_pid):
+            if not os.path.exists(f'/proc/{pid}'):
+                del FTPSessionService._by_pid[pid]
+
+    @staticmethod
+    def lookup_pid(pid):
+        """Return (username, ip, login_time) for a session pid, or None"""
+        return FTPSessionService._by_pid.get(int(pid))
+
+    @staticmethod
+    def lookup_ip(ip_address):
+        """Return (username, login_time) of the last login from an IP, or None"""
+        return FTPSessionService._by_ip.get(ip_address)
+
+    @staticmethod
+    def sessions():
+        """Return a copy of the pid map"""
+        with FTPSessionService._lock:
+            return dict(FTPSessionService._by_pid)
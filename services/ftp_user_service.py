@@ -2,20 +2,22 @@ import subprocess
 import os
 import pwd
 import grp
-import tempfile
-from models import FTPUser, db
-from datetime import datetime
-import subprocess
-import os
-import pwd
-import grp
+import re
 import stat
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from models import FTPUser, db
+from services.vsftpd_reload_service import VsftpdReloadService
 from datetime import datetime
 
 class FTPUserService:
     USER_LIST_FILE = '/etc/vsftpd/user_list'
+    # Writable subdirectories created in every FTP home directory
+    WRITABLE_DIRS = ['uploads', 'downloads', 'public', 'files']
+    # Threads used to prepare home directories in batch provisioning
+    HOME_SETUP_WORKERS = 8
+    MAX_BATCH_SIZE = 5000
     
     @staticmethod
     def create_system_user(username, password, home_dir):
@@ -56,27 +58,40 @@ class FTPUserService:
             
             # Get user info for proper ownership
             user_info = pwd.getpwnam(username)
-            uid = user_info.pw_uid
-            gid = user_info.pw_gid
             
-            # Set proper permissions for home directory
-            os.chmod(home_dir, 0o755)
-            os.chown(home_dir, uid, gid)
-            
-            # Create subdirectories with write permissions
-            upload_dir = os.path.join(home_dir, 'uploads')
-            downloads_dir = os.path.join(home_dir, 'downloads')
-            public_dir = os.path.join(home_dir, 'public')
-            
-            for directory in [upload_dir, downloads_dir, public_dir]:
-                os.makedirs(directory, exist_ok=True)
-                os.chmod(directory, 0o755)
-                os.chown(directory, uid, gid)
-            
-            # Create welcome file with proper permissions
-            welcome_file = os.path.join(home_dir, 'README.txt')
-            with open(welcome_file, 'w') as f:
-                f.write(f'''Welcome to FTP server, {username}!
+            # Set up the home directory tree in a single pass
+            FTPUserService._setup_home(username, home_dir, user_info.pw_uid, user_info.pw_gid)
+            
+            return True, f"User {username} created successfully with write access"
+            
+        except Exception as e:
+            return False, f"Unexpected error: {str(e)}"
+    
+    @staticmethod
+    def _setup_home(username, home_dir, uid, gid):
+        """Create the writable directory layout and welcome files, one pass"""
+        # Set proper permissions for home directory
+        os.chmod(home_dir, 0o755)
+        os.chown(home_dir, uid, gid)
+        
+        for dir_name in FTPUserService.WRITABLE_DIRS:
+            dir_path = os.path.join(home_dir, dir_name)
+            os.makedirs(dir_path, exist_ok=True)
+            os.chmod(dir_path, 0o755)
+            os.chown(dir_path, uid, gid)
+            
+            # Create a .keep file to ensure directory exists
+            keep_file = os.path.join(dir_path, '.keep')
+            if not os.path.exists(keep_file):
+                with open(keep_file, 'w') as f:
+                    f.write('This file keeps the directory in version control\n')
+                os.chown(keep_file, uid, gid)
+                os.chmod(keep_file, 0o644)
+        
+        # Create welcome file with proper permissions
+        welcome_file = os.path.join(home_dir, 'README.txt')
+        with open(welcome_file, 'w') as f:
+            f.write(f'''Welcome to FTP server, {username}!
 
 Your FTP account has been created successfully.
 
@@ -89,25 +104,134 @@ You have full read/write access to all directories.
 
 Happy file transferring!
 ''')
-            os.chmod(welcome_file, 0o644)
-            os.chown(welcome_file, uid, gid)
-            
-            # Create test file to verify write access
-            test_file = os.path.join(upload_dir, 'test_write_access.txt')
-            with open(test_file, 'w') as f:
-                f.write(f'This file confirms write access is working for {username}\n')
-                f.write(f'Created on: {datetime.now()}\n')
-            os.chmod(test_file, 0o644)
-            os.chown(test_file, uid, gid)
-            
-            # Ensure the user can write to their home directory
-            # This is crucial for chrooted users
-            FTPUserService._fix_chroot_permissions(home_dir, uid, gid)
-            
-            return True, f"User {username} created successfully with write access"
-            
-        except Exception as e:
-            return False, f"Unexpected error: {str(e)}"
+        os.chmod(welcome_file, 0o644)
+        os.chown(welcome_file, uid, gid)
+        
+        # Create test file to verify write access
+        test_file = os.path.join(home_dir, 'uploads', 'test_write_access.txt')
+        with open(test_file, 'w') as f:
+            f.write(f'This file confirms write access is working for {username}\n')
+            f.write(f'Created on: {datetime.now()}\n')
+        os.chmod(test_file, 0o644)
+        os.chown(test_file, uid, gid)
+    
+    @staticmethod
+    def create_system_users_batch(entries, created_by):
+        """Create many FTP users at once
+
+        useradd still runs per user (it locks /etc/passwd), but all passwords
+        go through one chpasswd call, home directories are prepared by a
+        bounded thread pool and the FTPUser rows are written with a single
+        insert_many. Returns (results, timing).
+        """
+        started = time.perf_counter()
+        timing = {}
+        results = [None] * len(entries)
+        
+        # Validate
+        existing = {user.pw_name for user in pwd.getpwall()}
+        seen = set()
+        pending = []
+        for index, entry in enumerate(entries):
+            fields = [entry.get(name) if isinstance(entry, dict) else None
+                      for name in ('username', 'password', 'home_directory')]
+            if not isinstance(entry, dict) or any(value is not None and not isinstance(value, str)
+                                                  for value in fields):
+                # One malformed entry fails its own row, not the whole batch
+                name = fields[0] if isinstance(fields[0], str) else ''
+                results[index] = (name, False, 'username, password and home_directory must be strings')
+                continue
+            username = (fields[0] or '').strip()
+            password = (fields[1] or '').strip()
+            home_dir = (fields[2] or '').strip() or f'/home/{username}'
+            
+            if not username:
+                results[index] = (username, False, 'Username is required')
+            elif username in seen:
+                results[index] = (username, False, 'Duplicate username in batch')
+            elif len(password) < 6:
+                results[index] = (username, False, 'Password must be at least 6 characters')
+            elif username in existing:
+                results[index] = (username, False, f"User {username} already exists")
+            else:
+                pending.append((index, username, password, home_dir))
+            seen.add(username)
+        
+        # Create accounts
+        step = time.perf_counter()
+        created = []
+        for index, username, password, home_dir in pending:
+            cmd = ['useradd', '-m', '-d', home_dir, '-s', '/bin/bash', '-G', 'ftp', username]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                results[index] = (username, False, f"Failed to create user: {result.stderr.strip()}")
+            else:
+                created.append((index, username, password, home_dir))
+        timing['useradd'] = time.perf_counter() - step
+        
+        # Set every password with one chpasswd invocation
+        step = time.perf_counter()
+        if created:
+            password_process = subprocess.run(
+                ['chpasswd'],
+                input=''.join(f"{username}:{password}\n" for _, username, password, _ in created),
+                text=True,
+                capture_output=True
+            )
+            if password_process.returncode != 0:
+                # chpasswd reports failures as "line N: ..." (1-based)
+                failed = {int(n) for n in re.findall(r'line (\d+)', password_process.stderr)}
+                if not failed:
+                    failed = set(range(1, len(created) + 1))
+                for line_number, (index, username, _, _) in enumerate(created, 1):
+                    if line_number in failed:
+                        # Remove the account again so the row can simply be retried
+                        subprocess.run(['userdel', '-r', username], capture_output=True, text=True)
+                        results[index] = (username, False, f"Failed to set password: {password_process.stderr.strip()}")
+                created = [c for n, c in enumerate(created, 1) if n not in failed]
+        timing['chpasswd'] = time.perf_counter() - step
+        
+        # Prepare home directories in parallel
+        step = time.perf_counter()
+        def setup(item):
+            index, username, _, home_dir = item
+            try:
+                user_info = pwd.getpwnam(username)
+                FTPUserService._setup_home(username, home_dir, user_info.pw_uid, user_info.pw_gid)
+                return index, (username, True, f"User {username} created successfully with write access")
+            except Exception as e:
+                return index, (username, True, f"User {username} created, but home setup failed: {e}")
+        
+        with ThreadPoolExecutor(max_workers=FTPUserService.HOME_SETUP_WORKERS) as pool:
+            for index, result in pool.map(setup, created):
+                results[index] = result
+        timing['homes'] = time.perf_counter() - step
+        
+        # Record all new users in one statement
+        step = time.perf_counter()
+        if created:
+            rows = [{
+                'username': username,
+                'home_directory': home_dir,
+                'created_by': created_by,
+                'is_active': True,
+                'is_blocked': False,
+                'created_at': datetime.now()
+            } for _, username, _, home_dir in created]
+            try:
+                with db.atomic():
+                    FTPUser.insert_many(rows).on_conflict_ignore().execute()
+            except Exception as db_error:
+                for index, username, _, _ in created:
+                    _, success, message = results[index]
+                    results[index] = (username, success, f"{message} (DB warning: {db_error})")
+        timing['database'] = time.perf_counter() - step
+        timing['total'] = time.perf_counter() - started
+        
+        return [
+            {'username': username, 'success': success, 'message': message}
+            for username, success, message in results
+        ], timing
     
     @staticmethod
     def _fix_chroot_permissions(home_dir, uid, gid):
@@ -120,9 +244,7 @@ Happy file transferring!
             os.chmod(home_dir, 0o755)
             
             # Create a writable subdirectory structure
-            writable_dirs = ['uploads', 'downloads', 'public', 'files']
-            
-            for dir_name in writable_dirs:
+            for dir_name in FTPUserService.WRITABLE_DIRS:
                 dir_path = os.path.join(home_dir, dir_name)
                 if not os.path.exists(dir_path):
                     os.makedirs(dir_path, exist_ok=True)
@@ -206,7 +328,8 @@ Happy file transferring!
     def delete_system_user(username):
         """Delete system user (running as root)"""
         try:
-            # Remove from blocked list first
+            # Remove from blocked list first, including any queued block
+            VsftpdReloadService.forget(username)
             FTPUserService._remove_from_user_list(username)
             
             # Delete system user and home directory
@@ -221,13 +344,12 @@ Happy file transferring!
     
     @staticmethod
     def block_user(username):
-        """Block FTP user by adding to vsftpd userlist"""
+        """Block FTP user by adding to vsftpd userlist
+
+        The user_list change is queued with VsftpdReloadService and applied
+        together with other pending changes in a single reload.
+        """
         try:
-            # Add to user_list file (blocked users)
-            success, message = FTPUserService._add_to_user_list(username)
-            if not success:
-                return False, message
-            
             # Update database
             try:
                 ftp_user = FTPUser.get(FTPUser.username == username)
@@ -246,25 +368,16 @@ Happy file transferring!
                 except:
                     pass
             
-            # Restart vsftpd to apply changes
-            restart_success, restart_msg = FTPUserService._restart_vsftpd()
-            if not restart_success:
-                return False, f"User blocked but failed to restart VSFTPD: {restart_msg}"
-            
-            return True, f"User {username} blocked successfully"
+            generation = VsftpdReloadService.block(username)
+            return True, f"User {username} blocked (pending reload, generation {generation})"
             
         except Exception as e:
             return False, f"Error blocking user: {str(e)}"
     
     @staticmethod
     def unblock_user(username):
-        """Unblock FTP user by removing from userlist"""
+        """Unblock FTP user by removing from userlist (applied on the next reload)"""
         try:
-            # Remove from user_list file
-            success, message = FTPUserService._remove_from_user_list(username)
-            if not success:
-                return False, message
-            
             # Update database
             try:
                 ftp_user = FTPUser.get(FTPUser.username == username)
@@ -273,46 +386,12 @@ Happy file transferring!
             except FTPUser.DoesNotExist:
                 pass
             
-            # Restart vsftpd to apply changes
-            restart_success, restart_msg = FTPUserService._restart_vsftpd()
-            if not restart_success:
-                return False, f"User unblocked but failed to restart VSFTPD: {restart_msg}"
-            
-            return True, f"User {username} unblocked successfully"
+            generation = VsftpdReloadService.unblock(username)
+            return True, f"User {username} unblocked (pending reload, generation {generation})"
             
         except Exception as e:
             return False, f"Error unblocking user: {str(e)}"
     
-    @staticmethod
-    def _add_to_user_list(username):
-        """Add username to vsftpd user_list file"""
-        try:
-            # Ensure the user_list file exists
-            if not os.path.exists(FTPUserService.USER_LIST_FILE):
-                with open(FTPUserService.USER_LIST_FILE, 'w') as f:
-                    pass
-                os.chmod(FTPUserService.USER_LIST_FILE, 0o644)
-            
-            # Check if user is already in the list
-            existing_users = []
-            try:
-                with open(FTPUserService.USER_LIST_FILE, 'r') as f:
-                    existing_users = [line.strip() for line in f.readlines()]
-            except FileNotFoundError:
-                pass
-            
-            if username in existing_users:
-                return True, f"User {username} already in block list"
-            
-            # Add user to the list
-            with open(FTPUserService.USER_LIST_FILE, 'a') as f:
-                f.write(f"{username}\n")
-            
-            return True, f"User {username} added to block list"
-            
-        except Exception as e:
-            return False, f"Error adding user to block list: {str(e)}"
-    
     @staticmethod
     def _remove_from_user_list(username):
         """Remove username from vsftpd user_list file"""
@@ -336,18 +415,6 @@ Happy file transferring!
         except Exception as e:
             return False, f"Error removing user from block list: {str(e)}"
     
-    @staticmethod
-    def _restart_vsftpd():
-        """Restart VSFTPD service"""
-        try:
-            result = subprocess.run(['systemctl', 'restart', 'vsftpd'], 
-                                  capture_output=True, text=True)
-            if result.returncode != 0:
-                return False, f"Failed to restart VSFTPD: {result.stderr}"
-            return True, "VSFTPD restarted successfully"
-        except Exception as e:
-            return False, f"Failed to restart VSFTPD: {str(e)}"
-    
     @staticmethod
     def check_user_exists(username):
         """Check if system user exists"""
@@ -371,12 +438,12 @@ Happy file transferring!
         """Get list of blocked users from user_list file"""
         try:
             if not os.path.exists(FTPUserService.USER_LIST_FILE):
-                return []
+                return VsftpdReloadService.pending_blocked([])
             
             with open(FTPUserService.USER_LIST_FILE, 'r') as f:
                 blocked_users = [line.strip() for line in f.readlines() if line.strip()]
             
-            return blocked_users
+            return VsftpdReloadService.pending_blocked(blocked_users)
             
         except Exception as e:
             print(f"Error reading blocked users: {e}")
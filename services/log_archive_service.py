@@ -0,0 +1,282 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from models import DB_PATH, ArchivedLogFile, FTPLog, LogOffset, db
+from utils.log_segment import COLUMNS, LogSegment, write_segment
+from utils.rotated_logs import open_log, read_entries, rotated_siblings
+from services.ftp_log_service import FTPLogService
+from services.log_ingest_service import LogIngestService
+
+class LogArchiveService:
+    """Long-term log history in compressed columnar segment files
+
+    When enabled (FTPMAN_ARCHIVE_AFTER_DAYS), FTPLog rows older than
+    ARCHIVE_AFTER_DAYS and rotated vsftpd.log / xferlog files are written
+    to segment files (utils/log_segment.py) of at most SEGMENT_ROWS rows in
+    ARCHIVE_DIR, and the archived rows are deleted from FTPLog. From then
+    on they are only served by query(), not by FTPLogService paging or
+    full-text search. A rotated file is archived once ingestion has read
+    all of it; its lines that are still in FTPLog are left to the row
+    archiver, and lines no newer than the rows archive_rows already moved
+    for that source are skipped, so nothing is stored twice.
+
+    Each segment header carries its time range and a bloom filter of its
+    usernames; queries read only the headers (cached per file) to skip
+    segments outside the time range or without the user.
+    """
+
+    ARCHIVE_DIR = os.environ.get('FTPMAN_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH), 'archive'))
+    # FTPLog rows older than this many days move to segments; 0 (the
+    # default) disables archiving
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('FTPMAN_ARCHIVE_AFTER_DAYS', 0))
+    # Delete rotated files once they are archived (logrotate removes them otherwise)
+    REMOVE_ROTATED = os.environ.get('FTPMAN_ARCHIVE_REMOVE_ROTATED', 'False').lower() == 'true'
+    SEGMENT_ROWS = 20000
+    DELETE_BATCH = 500
+    FINGERPRINT_BYTES = 64 * 1024
+
+    _segments = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def run_once(now=None):
+        """Archive aged FTPLog rows and new rotated files; returns counts"""
+        if not LogArchiveService.ARCHIVE_AFTER_DAYS:
+            return {'rows': 0, 'files': 0}
+        os.makedirs(LogArchiveService.ARCHIVE_DIR, exist_ok=True)
+        now = now if now is not None else time.time()
+        files = LogArchiveService.archive_rotated()
+        rows = LogArchiveService.archive_rows(int(now - LogArchiveService.ARCHIVE_AFTER_DAYS * 86400))
+        return {'rows': rows, 'files': files}
+
+    @staticmethod
+    def _segment_path(kind, rows):
+        first = min(row['timestamp'] for row in rows)
+        last = max(row['timestamp'] for row in rows)
+        # Names sort by time; the suffix keeps equal time ranges apart
+        return os.path.join(LogArchiveService.ARCHIVE_DIR,
+                            f"{first:011d}-{last:011d}-{kind}-{os.urandom(4).hex()}.seg")
+
+    @staticmethod
+    def archive_rows(cutoff):
+        """Move FTPLog rows older than ``cutoff`` (epoch) into segments"""
+        archived = 0
+        fields = [getattr(FTPLog, name) for name in COLUMNS]
+        while True:
+            rows = list(FTPLog.select(FTPLog.id, *fields)
+                        .where(FTPLog.timestamp < cutoff)
+                        .order_by(FTPLog.timestamp, FTPLog.id)
+                        .limit(LogArchiveService.SEGMENT_ROWS)
+                        .dicts())
+            if not rows:
+                return archived
+            path = LogArchiveService._segment_path('db', rows)
+            write_segment(path, rows)
+            ids = [row['id'] for row in rows]
+            try:
+                with db.atomic():
+                    for i in range(0, len(ids), LogArchiveService.DELETE_BATCH):
+                        FTPLog.delete().where(FTPLog.id.in_(ids[i:i + LogArchiveService.DELETE_BATCH])).execute()
+            except Exception:
+                # The rows stay in FTPLog, so the segment must not stay too
+                os.remove(path)
+                raise
+            archived += len(rows)
+
+    @staticmethod
+    def _fingerprint(path):
+        with open_log(path) as f:
+            return hashlib.sha1(f.read(LogArchiveService.FINGERPRINT_BYTES)).hexdigest()
+
+    @staticmethod
+    def archive_rotated():
+        """Archive rotated log files not archived before; returns files archived"""
+        archived = 0
+        for source, path, parser in LogIngestService.sources():
+            for rotated in rotated_siblings(path):
+                try:
+                    if not LogArchiveService._fully_ingested(path, rotated):
+                        continue
+                    fingerprint = LogArchiveService._fingerprint(rotated)
+                except OSError as e:
+                    print(f"Error reading {rotated}: {e}")
+                    continue
+                if not ArchivedLogFile.select().where(ArchivedLogFile.fingerprint == fingerprint).exists():
+                    rows = LogArchiveService._archive_file(source, rotated, parser)
+                    ArchivedLogFile.create(fingerprint=fingerprint, path=rotated, source=source, rows=rows)
+                    archived += 1
+                if LogArchiveService.REMOVE_ROTATED:
+                    os.remove(rotated)
+        return archived
+
+    @staticmethod
+    def _fully_ingested(path, rotated):
+        """Whether ingestion of ``path`` is done with its rotated copy ``rotated``"""
+        saved = LogOffset.get_or_none(LogOffset.path == path)
+        if saved is None or saved.inode is None:
+            # Never ingested; ingestion starts at the live file's tail
+            return True
+        st = os.stat(rotated)
+        if st.st_ino == saved.inode:
+            # Renamed from the live file: done once read to its end
+            return (saved.offset or 0) >= st.st_size
+        try:
+            # Ingestion has moved on to the new live file, after draining
+            # the old one; a compressed copy only exists after that rename
+            return os.stat(path).st_ino == saved.inode
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _archive_file(source, path, parser):
+        stored = 0
+        batch = []
+        for entry in read_entries(path):
+            batch.append(entry)
+            if len(batch) >= LogArchiveService.SEGMENT_ROWS:
+                stored += LogArchiveService._archive_lines(source, batch, parser)
+                batch = []
+        if batch:
+            stored += LogArchiveService._archive_lines(source, batch, parser)
+        return stored
+
+    @staticmethod
+    def _archived_until(source):
+        """Newest ``source`` timestamp moved out of FTPLog by archive_rows, or None"""
+        bounds = [segment.source_max_ts(source) for segment in LogArchiveService.segments()
+                  if '-db-' in os.path.basename(segment.path)]
+        return max((bound for bound in bounds if bound is not None), default=None)
+
+    @staticmethod
+    def _archive_lines(source, entries, parser):
+        rows, records = LogIngestService._build_rows(source, entries, parser)
+        # Lines still in FTPLog are archived from there once they age out
+        rows, _ = LogIngestService._drop_stored(rows, records)
+        # and those already archived from FTPLog are no longer there to match
+        archived_until = LogArchiveService._archived_until(source)
+        if archived_until is not None:
+            rows = [row for row in rows if row['timestamp'] > archived_until]
+        if rows:
+            write_segment(LogArchiveService._segment_path('file', rows), rows)
+        return len(rows)
+
+    @staticmethod
+    def prune(cutoff):
+        """Delete segments whose newest row is older than ``cutoff``; returns files deleted"""
+        deleted = 0
+        for segment in LogArchiveService.segments():
+            if segment.max_ts is not None and segment.max_ts < cutoff:
+                os.remove(segment.path)
+                deleted += 1
+        return deleted
+
+    @staticmethod
+    def segments():
+        """Headers of every segment, oldest first; cached per file name"""
+        try:
+            names = sorted(name for name in os.listdir(LogArchiveService.ARCHIVE_DIR) if name.endswith('.seg'))
+        except FileNotFoundError:
+            names = []
+        with LogArchiveService._lock:
+            cache = LogArchiveService._segments
+            segments = []
+            for name in names:
+                segment = cache.get(name)
+                if segment is None:
+                    try:
+                        segment = LogSegment.open(os.path.join(LogArchiveService.ARCHIVE_DIR, name))
+                    except (OSError, ValueError) as e:
+                        print(f"Skipping archive segment {name}: {e}")
+                        continue
+                segments.append(segment)
+            # Segments are immutable, so only names decide what is cached
+            LogArchiveService._segments = {os.path.basename(segment.path): segment for segment in segments}
+        return segments
+
+    @staticmethod
+    def query(filters=None, cursor=None, limit=None):
+        """One page of archived logs, newest first
+
+        Accepts the filters of FTPLogService.query_logs. Segments outside
+        the since/until range or whose bloom filter rules out the username
+        are never opened. Returns (logs, next_cursor, stats).
+        """
+        filters = filters or {}
+        limit = min(max(int(limit or FTPLogService.DEFAULT_PAGE_SIZE), 1), FTPLogService.MAX_PAGE_SIZE)
+        start = FTPLogService._parse_time(filters['since']) if filters.get('since') else None
+        end = FTPLogService._parse_time(filters['until']) if filters.get('until') else None
+        columns = {column: filters.get(param) for param, column in FTPLogService.FILTER_FIELDS.items()}
+        after = LogArchiveService._decode_cursor(cursor) if cursor else None
+        if after is not None:
+            # Rows at the cursor's second may remain; the key filter below drops the rest
+            end = after[0] + 1 if end is None else min(end, after[0] + 1)
+
+        candidates = [segment for segment in LogArchiveService.segments()
+                      if segment.overlaps(start, end)
+                      and (not columns['username'] or segment.may_contain_user(columns['username']))]
+        stats = {'segments': len(LogArchiveService._segments), 'scanned': 0}
+
+        matches = []
+        for segment in sorted(candidates, key=lambda segment: segment.max_ts, reverse=True):
+            if len(matches) >= limit and segment.max_ts < matches[limit - 1][0][0]:
+                # Every remaining segment ends before the oldest row we keep
+                break
+            stats['scanned'] += 1
+            name = os.path.basename(segment.path)
+            for index, row in segment.select(start, end, columns):
+                key = (row['timestamp'], name, index)
+                if after is None or key < after:
+                    matches.append((key, row))
+            matches.sort(key=lambda match: match[0], reverse=True)
+            del matches[limit + 1:]
+
+        next_cursor = None
+        if len(matches) > limit:
+            matches = matches[:limit]
+            next_cursor = LogArchiveService._encode_cursor(matches[-1][0])
+        return [LogArchiveService._row_to_dict(row) for _, row in matches], next_cursor, stats
+
+    @staticmethod
+    def _row_to_dict(row):
+        return {
+            'id': None,
+            'timestamp': datetime.fromtimestamp(row['timestamp']).isoformat(),
+            'epoch': row['timestamp'],
+            'pid': row['pid'],
+            'username': row['username'],
+            'status': row['status'],
+            'action': row['action'],
+            'details': row['details'],
+            'ip_address': row['ip_address'],
+            'file_path': row['file_path'],
+            'source': row['source'],
+            'archived': True,
+        }
+
+    @staticmethod
+    def _encode_cursor(key):
+        return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, name, index = json.loads(base64.urlsafe_b64decode(padded))
+            return int(timestamp), str(name), int(index)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def status():
+        segments = LogArchiveService.segments()
+        return {
+            'segments': len(segments),
+            'rows': sum(segment.rows for segment in segments),
+            'bytes': sum(os.path.getsize(segment.path) for segment in segments if os.path.exists(segment.path)),
+            'oldest': min((segment.min_ts for segment in segments if segment.rows), default=None),
+            'newest': max((segment.max_ts for segment in segments if segment.rows), default=None),
+        }
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from models import FTPLog, LogOffset, db
+from services.ftp_log_service import FTPLogService
+from services.analytics_service import AnalyticsService
+from utils.log_tailer import LogTailer
+
+class LogIngestService:
+    """Background worker that streams new log lines into the FTPLog table"""
+
+    # Seconds between polls of the log files
+    INTERVAL = float(os.environ.get('FTPMAN_INGEST_INTERVAL', 2))
+    # Rows per insert_many statement and bytes read per slice
+    BATCH_SIZE = 500
+    READ_BYTES = 4 * 1024 * 1024
+    # Seconds between removals of expired rollup buckets
+    PRUNE_INTERVAL = 3600
+
+    _thread = None
+    _stop = threading.Event()
+    _tailers = {}
+    _listeners = []
+    _last_prune = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def sources():
+        """Log files to ingest as (source, path, line parser)"""
+        return FTPLogService.log_sources()
+
+    @staticmethod
+    def add_listener(callback):
+        """Call ``callback(source, records)`` with the parsed records of every stored batch"""
+        LogIngestService._listeners.append(callback)
+
+    @staticmethod
+    def start():
+        """Start the ingestion thread if it is not running yet"""
+        with LogIngestService._lock:
+            if LogIngestService._thread and LogIngestService._thread.is_alive():
+                return
+            LogIngestService._stop.clear()
+            LogIngestService._thread = threading.Thread(
+                target=LogIngestService._run, name='log-ingest', daemon=True
+            )
+            LogIngestService._thread.start()
+
+    @staticmethod
+    def stop():
+        LogIngestService._stop.set()
+
+    @staticmethod
+    def _run():
+        while not LogIngestService._stop.is_set():
+            try:
+                LogIngestService.run_once()
+            except Exception as e:
+                print(f"Error ingesting logs: {e}")
+            LogIngestService._stop.wait(LogIngestService.INTERVAL)
+
+    @staticmethod
+    def run_once():
+        """Ingest everything appended since the last run, returns rows seen"""
+        total = 0
+        with LogIngestService._lock, db.connection_context():
+            for source, path, parser in LogIngestService.sources():
+                if not os.path.exists(path):
+                    continue
+                tailer = LogIngestService._get_tailer(path)
+                while True:
+                    entries = tailer.poll(max_bytes=LogIngestService.READ_BYTES, offsets=True)
+                    if not entries:
+                        break
+                    rows, records = LogIngestService._build_rows(source, entries, parser)
+                    rows, records = LogIngestService._drop_stored(rows, records)
+                    LogIngestService._store(tailer, rows, AnalyticsService.rollup(source, records))
+                    LogIngestService._notify(source, records)
+                    total += len(rows)
+            LogIngestService._prune_rollups()
+        return total
+
+    @staticmethod
+    def _get_tailer(path):
+        tailer = LogIngestService._tailers.get(path)
+        if tailer is None:
+            saved = LogOffset.get_or_none(LogOffset.path == path)
+            if saved:
+                tailer = LogTailer(path, max_lines=1, offset=saved.offset, inode=saved.inode)
+            else:
+                # First run: start from the tail instead of the whole history
+                tailer = LogTailer(path, max_lines=FTPLogService.TAIL_LINES)
+            LogIngestService._tailers[path] = tailer
+        return tailer
+
+    @staticmethod
+    def _build_rows(source, entries, parser):
+        """FTPLog rows and parsed records for (byte offset, line) pairs
+
+        The content hash covers the line's offset in its file, so a re-read
+        line matches its stored row while identical lines (two equal
+        transfers in the same second) are kept apart.
+        """
+        rows = []
+        records = []
+        for offset, line in entries:
+            line = line.strip()
+            if not line:
+                continue
+            record = parser(line)
+            if record is None:
+                continue
+            records.append(record)
+            rows.append({
+                'timestamp': record.epoch,
+                'username': record.username,
+                'action': record.action,
+                'ip_address': record.ip_address,
+                'file_path': record.file_path,
+                'status': record.status,
+                'pid': record.pid,
+                'details': record.details,
+                'source': source,
+                'content_hash': hashlib.sha1(f"{source}\0{offset}\0{line}".encode('utf-8')).hexdigest(),
+            })
+        return rows, records
+
+    @staticmethod
+    def _drop_stored(rows, records):
+        """Skip lines already stored (re-read after a restart or rotation) so
+        rollups and listeners only see each line once"""
+        seen = set()
+        hashes = [row['content_hash'] for row in rows]
+        for i in range(0, len(hashes), LogIngestService.BATCH_SIZE):
+            seen.update(h for (h,) in FTPLog.select(FTPLog.content_hash).where(
+                FTPLog.content_hash.in_(hashes[i:i + LogIngestService.BATCH_SIZE])).tuples())
+
+        kept_rows, kept_records = [], []
+        for row, record in zip(rows, records):
+            if row['content_hash'] in seen:
+                continue
+            seen.add(row['content_hash'])
+            kept_rows.append(row)
+            kept_records.append(record)
+        return kept_rows, kept_records
+
+    @staticmethod
+    def _prune_rollups():
+        now = time.monotonic()
+        if now - LogIngestService._last_prune < LogIngestService.PRUNE_INTERVAL:
+            return
+        LogIngestService._last_prune = now
+        with db.atomic():
+            AnalyticsService.prune()
+
+    @staticmethod
+    def _notify(source, records):
+        for callback in LogIngestService._listeners:
+            try:
+                callback(source, records)
+            except Exception as e:
+                print(f"Error in log ingest listener {callback.__qualname__}: {e}")
+
+    @staticmethod
+    def _store(tailer, rows, rollups):
+        """Insert rows, add their rollups and advance the saved offset in one transaction"""
+        inode, offset = tailer.state()
+        with db.atomic():
+            for i in range(0, len(rows), LogIngestService.BATCH_SIZE):
+                FTPLog.insert_many(rows[i:i + LogIngestService.BATCH_SIZE]).on_conflict_ignore().execute()
+            AnalyticsService.store(rollups)
+            LogOffset.insert(
+                path=tailer.path, inode=inode, offset=offset, updated_at=datetime.now()
+            ).on_conflict(
+                conflict_target=[LogOffset.path],
+                update={LogOffset.inode: inode, LogOffset.offset: offset,
+                        LogOffset.updated_at: datetime.now()}
+            ).execute()
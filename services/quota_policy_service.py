@@ -0,0 +1,153 @@
+import os
+import threading
+from datetime import datetime
+from models import QuotaLimit, db
+from utils.vsftpd_conf import VsftpdConf
+from services.ftp_config_service import FTPConfigService
+from services.ftp_user_service import FTPUserService
+from services.quota_service import QuotaService
+from services.user_directory_service import UserDirectoryService
+from services.vsftpd_reload_service import VsftpdReloadService
+
+class QuotaPolicyService:
+    """Enforces hard quota limits on top of QuotaService usage
+
+    A user above the hard limit is blocked through user_list or, with the
+    'readonly' action, gets write_enable=NO in their per-user vsftpd config.
+    Once usage is back under the limit the restriction is lifted again.
+    Only restrictions the policy applied itself (QuotaLimit.enforced) are
+    lifted, and users already blocked by hand are never marked as enforced,
+    so manual blocks are left alone. All user_list changes of one
+    evaluation are applied with a single vsftpd reload.
+    """
+
+    ACTIONS = ('block', 'readonly')
+
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start():
+        """Re-evaluate users whenever their tracked usage changes"""
+        QuotaService.add_listener(QuotaPolicyService.evaluate)
+
+    @staticmethod
+    def evaluate(usernames=None):
+        """Apply or lift restrictions; returns {'enforced': [...], 'released': [...]}"""
+        with QuotaPolicyService._lock:
+            report = QuotaService.get_quota()
+            if usernames is not None:
+                report = [entry for entry in report if entry['username'] in usernames]
+            limits = QuotaService.limits()
+
+            enforced, released = [], []
+            blocked = None
+            for entry in report:
+                if entry['error']:
+                    continue
+                username = entry['username']
+                limit = limits.get(username)
+                current = limit.enforced if limit else None
+
+                if entry['over_limit'] and current is None:
+                    action = limit.action if limit else 'block'
+                    if action == 'block':
+                        if blocked is None:
+                            blocked = set(FTPUserService.get_blocked_users())
+                        if username in blocked:
+                            # Blocked by hand: the block is not ours to lift later
+                            continue
+                    if QuotaPolicyService._restrict(username, action):
+                        enforced.append((username, action))
+                elif current is not None and not entry['over_limit']:
+                    if QuotaPolicyService._release(username, current):
+                        released.append(username)
+
+            if not enforced and not released:
+                return {'enforced': [], 'released': []}
+
+            with db.atomic():
+                for username, action in enforced:
+                    QuotaLimit.insert(username=username, enforced=action, updated_at=datetime.now()).on_conflict(
+                        conflict_target=[QuotaLimit.username],
+                        update={QuotaLimit.enforced: action, QuotaLimit.updated_at: datetime.now()}
+                    ).execute()
+                if released:
+                    QuotaLimit.update(enforced=None, updated_at=datetime.now()).where(
+                        QuotaLimit.username.in_(released)).execute()
+
+            # One reload for every user_list change made in this pass
+            VsftpdReloadService.flush()
+            UserDirectoryService.invalidate()
+            for username, action in enforced:
+                print(f"Quota exceeded by {username}: {action} applied")
+            return {'enforced': [username for username, _ in enforced], 'released': released}
+
+    @staticmethod
+    def _restrict(username, action):
+        if action == 'readonly':
+            return QuotaPolicyService._set_write_enable(username, False)
+        success, message = FTPUserService.block_user(username)
+        if not success:
+            print(message)
+        return success
+
+    @staticmethod
+    def _release(username, action):
+        if action == 'readonly':
+            return QuotaPolicyService._set_write_enable(username, True)
+        success, message = FTPUserService.unblock_user(username)
+        if not success:
+            print(message)
+        return success
+
+    @staticmethod
+    def _set_write_enable(username, enabled):
+        """Toggle write_enable in the user's file under vsftpd's user_config_dir"""
+        config_dir = FTPConfigService.read_config().get('user_config_dir')
+        if not config_dir:
+            print(f"Cannot write-protect {username}: user_config_dir is not set in vsftpd.conf")
+            return False
+        path = os.path.join(config_dir, username)
+        try:
+            conf = VsftpdConf.load(path) if os.path.exists(path) else VsftpdConf()
+            conf.set('write_enable', 'YES' if enabled else 'NO')
+            os.makedirs(config_dir, exist_ok=True)
+            # Per-user files are read at login, so no reload is needed
+            FTPConfigService._write_atomic(path, conf.serialize())
+            return True
+        except OSError as e:
+            print(f"Error updating {path}: {e}")
+            return False
+
+    @staticmethod
+    def set_limit(username, soft_limit=None, hard_limit=None, action='block'):
+        """Create or replace a user's limits (bytes) and re-evaluate the user"""
+        if action not in QuotaPolicyService.ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(QuotaPolicyService.ACTIONS)}")
+        for value in (soft_limit, hard_limit):
+            if value is not None and value < 0:
+                raise ValueError("limits must not be negative")
+        if soft_limit is not None and hard_limit is not None and soft_limit > hard_limit:
+            raise ValueError("soft limit must not exceed hard limit")
+
+        existing = QuotaLimit.get_or_none(QuotaLimit.username == username)
+        if existing is not None and existing.enforced is not None and existing.action != action:
+            # Lift the old restriction first so it is not left behind
+            QuotaPolicyService._release(username, existing.enforced)
+            existing.enforced = None
+
+        QuotaLimit.insert(
+            username=username, soft_limit=soft_limit, hard_limit=hard_limit, action=action,
+            enforced=existing.enforced if existing else None, updated_at=datetime.now()
+        ).on_conflict(
+            conflict_target=[QuotaLimit.username],
+            update={QuotaLimit.soft_limit: soft_limit, QuotaLimit.hard_limit: hard_limit,
+                    QuotaLimit.action: action, QuotaLimit.enforced: existing.enforced if existing else None,
+                    QuotaLimit.updated_at: datetime.now()}
+        ).execute()
+        return QuotaPolicyService.evaluate({username})
+
+    @staticmethod
+    def remove_limit(username):
+        """Drop a user's own limits (defaults apply again) and re-evaluate"""
+        return QuotaPolicyService.set_limit(username)
@@ -0,0 +1,301 @@
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from models import QuotaLimit, db
+from utils.dir_usage import DirUsageCache
+from utils.log_parser import extract_path
+from services.user_directory_service import UserDirectoryService
+from services.shared_state_service import SharedStateService
+
+class QuotaService:
+    """Per-user home directory usage, kept current from the transfer logs
+
+    Usage starts from a directory scan and is then adjusted from the log
+    records LogIngestService stores: xferlog uploads add their size (minus
+    the previous size when a known file is overwritten), vsftpd.log DELETEs
+    subtract the size of files we saw uploaded. A delete of a file we do
+    not know the size of marks the user dirty, and dirty users are rescanned
+    within DIRTY_INTERVAL seconds.
+
+    A full reconciliation scan runs every INTERVAL seconds at low CPU
+    priority to correct drift. Home directories are walked in parallel with
+    os.scandir; each user keeps a DirUsageCache so a rescan only lists
+    directories whose mtime changed, and every FULL_SCAN_EVERY scans
+    everything is listed again to pick up files that grew in place.
+    Requests only read the current numbers; in a multi-worker server the
+    leader shares them with the other workers through SharedStateService.
+    """
+
+    INTERVAL = float(os.environ.get('FTPMAN_QUOTA_INTERVAL', 6 * 3600))
+    DIRTY_INTERVAL = 30.0
+    FULL_SCAN_EVERY = 12
+    SCAN_WORKERS = 8
+    # Nice value of the scanner threads
+    SCAN_NICE = 10
+    # Uploaded file sizes remembered to account for deletes and overwrites
+    MAX_TRACKED_FILES = 200000
+    # Limits for users without a QuotaLimit row, in MB; 0 means no limit
+    DEFAULT_LIMIT_MB = int(os.environ.get('FTPMAN_QUOTA_LIMIT_MB', 0))
+    DEFAULT_SOFT_LIMIT_MB = int(os.environ.get('FTPMAN_QUOTA_SOFT_LIMIT_MB', 0))
+
+    _usage = {}
+    _caches = {}
+    _file_sizes = OrderedDict()
+    _dirty = set()
+    _listeners = []
+    _scans = 0
+    _scanned_at = None
+    _last_duration = None
+    _scanning = False
+    _scan_requested = False
+    _force_next = False
+    _thread = None
+    _stop = threading.Event()
+    _wake = threading.Event()
+    _lock = threading.Lock()
+    _scan_lock = threading.Lock()
+
+    @staticmethod
+    def add_listener(callback):
+        """Call ``callback(usernames)`` after the usage of those users changed"""
+        QuotaService._listeners.append(callback)
+
+    @staticmethod
+    def _notify(usernames):
+        if not usernames:
+            return
+        for callback in QuotaService._listeners:
+            try:
+                callback(usernames)
+            except Exception as e:
+                print(f"Error in quota listener {callback.__qualname__}: {e}")
+
+    @staticmethod
+    def start():
+        """Start the scanner thread if it is not running yet"""
+        with QuotaService._lock:
+            if QuotaService._thread and QuotaService._thread.is_alive():
+                return
+            QuotaService._stop.clear()
+            SharedStateService.on_signal('quota.scan', lambda payload: QuotaService.request_scan(payload['force']))
+            QuotaService._thread = threading.Thread(
+                target=QuotaService._run, name='quota-scanner', daemon=True
+            )
+            QuotaService._thread.start()
+
+    @staticmethod
+    def stop():
+        QuotaService._stop.set()
+        QuotaService._wake.set()
+
+    @staticmethod
+    def request_scan(force=False):
+        """Ask for a reconciliation scan now; ``force`` re-lists every directory"""
+        if not SharedStateService.is_leader():
+            SharedStateService.send_signal('quota.scan', {'force': force})
+            return
+        with QuotaService._lock:
+            QuotaService._scan_requested = True
+            QuotaService._force_next = QuotaService._force_next or force
+        QuotaService._wake.set()
+
+    @staticmethod
+    def _run():
+        QuotaService._lower_priority()
+        next_full = 0.0
+        while not QuotaService._stop.is_set():
+            QuotaService._wake.clear()
+            with QuotaService._lock:
+                requested, force = QuotaService._scan_requested, QuotaService._force_next
+                QuotaService._scan_requested = QuotaService._force_next = False
+                dirty = QuotaService._dirty
+                QuotaService._dirty = set()
+            try:
+                if requested or time.monotonic() >= next_full:
+                    QuotaService.scan_once(force=force)
+                    next_full = time.monotonic() + QuotaService.INTERVAL
+                elif dirty:
+                    QuotaService.scan_once(usernames=dirty)
+            except Exception as e:
+                print(f"Error scanning quotas: {e}")
+            QuotaService._wake.wait(QuotaService.DIRTY_INTERVAL)
+
+    @staticmethod
+    def _lower_priority():
+        """Renice the calling thread so scans yield to request handling (Linux)"""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), QuotaService.SCAN_NICE)
+        except (AttributeError, OSError):
+            pass
+
+    @staticmethod
+    def scan_once(force=False, usernames=None):
+        """Measure home directories of every system user, or only ``usernames``"""
+        with QuotaService._scan_lock:
+            started = time.monotonic()
+            QuotaService._scanning = True
+            try:
+                with db.connection_context():
+                    users, _, _ = UserDirectoryService.list_users()
+                users = [user for user in users if user['exists_in_system'] and user['home_directory']]
+                if usernames is not None:
+                    users = [user for user in users if user['username'] in usernames]
+                full = force or (usernames is None and QuotaService._scans % QuotaService.FULL_SCAN_EVERY == 0)
+
+                with ThreadPoolExecutor(max_workers=QuotaService.SCAN_WORKERS,
+                                        initializer=QuotaService._lower_priority) as pool:
+                    results = list(pool.map(lambda user: QuotaService._scan_user(user, full), users))
+
+                with QuotaService._lock:
+                    if usernames is None:
+                        usage = {}
+                        scanned = {result['username'] for result in results}
+                        # Users that no longer exist do not need their caches
+                        for username in list(QuotaService._caches):
+                            if username not in scanned:
+                                del QuotaService._caches[username]
+                        QuotaService._scans += 1
+                        QuotaService._scanned_at = datetime.now()
+                        QuotaService._last_duration = time.monotonic() - started
+                    else:
+                        usage = dict(QuotaService._usage)
+                    for result in results:
+                        usage[result['username']] = result
+                    QuotaService._usage = usage
+            finally:
+                QuotaService._scanning = False
+        QuotaService._share()
+        QuotaService._notify({result['username'] for result in results})
+        return results
+
+    @staticmethod
+    def _scan_user(user, full):
+        username = user['username']
+        with QuotaService._lock:
+            cache = QuotaService._caches.setdefault(username, DirUsageCache())
+        result = {
+            'username': username,
+            'home_directory': user['home_directory'],
+            'used_bytes': 0,
+            'scanned_bytes': 0,
+            'file_count': 0,
+            'scan_epoch': time.time(),
+            'error': None
+        }
+        try:
+            result['scanned_bytes'], result['file_count'] = cache.usage(user['home_directory'], force=full)
+            result['used_bytes'] = result['scanned_bytes']
+        except OSError as e:
+            result['error'] = str(e)
+        return result
+
+    @staticmethod
+    def apply_records(source, records):
+        """LogIngestService listener: adjust usage from uploads and deletes
+
+        Records older than the user's last scan are already part of it and
+        are skipped. Returns the usernames whose usage changed.
+        """
+        changed = set()
+        with QuotaService._lock:
+            for record in records:
+                entry = QuotaService._usage.get(record.username)
+                if entry is None or record.epoch < int(entry['scan_epoch']):
+                    continue
+
+                if source == 'xferlog':
+                    # Incomplete uploads leave their partial file behind too
+                    if record.direction != 'i':
+                        continue
+                    key = (record.username, posixpath.normpath(record.file_path))
+                    previous = QuotaService._file_sizes.pop(key, 0)
+                    QuotaService._file_sizes[key] = record.file_size
+                    if len(QuotaService._file_sizes) > QuotaService.MAX_TRACKED_FILES:
+                        QuotaService._file_sizes.popitem(last=False)
+                    delta = record.file_size - previous
+                elif record.action == 'DELETE' and record.status == 'OK':
+                    path = extract_path(record.details)
+                    if path is None:
+                        continue
+                    size = QuotaService._file_sizes.pop((record.username, posixpath.normpath(path)), None)
+                    if size is None:
+                        # Size unknown: measure this user again soon
+                        QuotaService._dirty.add(record.username)
+                        continue
+                    delta = -size
+                else:
+                    continue
+
+                # Entries are replaced, never mutated, so readers can copy them unlocked
+                QuotaService._usage[record.username] = dict(entry, used_bytes=max(0, entry['used_bytes'] + delta))
+                changed.add(record.username)
+        if changed:
+            QuotaService._share()
+        QuotaService._notify(changed)
+        return changed
+
+    @staticmethod
+    def limits():
+        """Return {username: QuotaLimit} for users with their own limits"""
+        return {limit.username: limit for limit in QuotaLimit.select()}
+
+    @staticmethod
+    def limit_for(username, limit=None):
+        """(soft, hard) limits in bytes for a user; None means unlimited"""
+        soft = QuotaService.DEFAULT_SOFT_LIMIT_MB * 1024 * 1024 or None
+        hard = QuotaService.DEFAULT_LIMIT_MB * 1024 * 1024 or None
+        if limit is not None:
+            soft = limit.soft_limit if limit.soft_limit is not None else soft
+            hard = limit.hard_limit if limit.hard_limit is not None else hard
+        return soft or None, hard or None
+
+    @staticmethod
+    def get_quota(username=None):
+        """Current usage against limits, optionally for a single user"""
+        if SharedStateService.is_leader():
+            with QuotaService._lock:
+                usage = QuotaService._usage
+        else:
+            usage = SharedStateService.get('quota', {}).get('usage', {})
+        if username is not None:
+            usage = {username: usage[username]} if username in usage else {}
+        limits = QuotaService.limits()
+
+        report = []
+        for name in sorted(usage):
+            entry = dict(usage[name])
+            limit = limits.get(name)
+            soft, hard = QuotaService.limit_for(name, limit)
+            entry['soft_limit_bytes'] = soft
+            entry['limit_bytes'] = hard
+            entry['percent'] = round(entry['used_bytes'] * 100.0 / hard, 1) if hard else None
+            entry['over_soft_limit'] = bool(soft) and entry['used_bytes'] > soft
+            entry['over_limit'] = bool(hard) and entry['used_bytes'] > hard
+            entry['action'] = limit.action if limit else 'block'
+            entry['enforced'] = limit.enforced if limit else None
+            report.append(entry)
+        return report
+
+    @staticmethod
+    def _share():
+        if not SharedStateService.enabled():
+            return
+        with QuotaService._lock:
+            usage = QuotaService._usage
+        SharedStateService.put('quota', {'usage': usage, 'status': QuotaService.status()})
+
+    @staticmethod
+    def status():
+        if not SharedStateService.is_leader():
+            return SharedStateService.get('quota', {}).get('status', {})
+        return {
+            'scanning': QuotaService._scanning,
+            'scanned_at': QuotaService._scanned_at.isoformat() if QuotaService._scanned_at else None,
+            'last_duration': QuotaService._last_duration,
+            'interval': QuotaService.INTERVAL,
+            'dirty_users': len(QuotaService._dirty)
+        }
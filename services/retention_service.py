@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from models import ConfigChange, FTPLog, db
+from services.log_archive_service import LogArchiveService
+
+class RetentionService:
+    """Deletes old log and config history rows and returns the space
+
+    Every INTERVAL seconds rows older than their retention are deleted in
+    chunks of CHUNK_SIZE, each in its own short transaction, so log
+    ingestion and requests can write in between. The freed pages are then
+    released with incremental vacuum, VACUUM_PAGES at a time. Databases
+    created before auto_vacuum=INCREMENTAL get one full VACUUM the first
+    time there is space to reclaim.
+
+    Log rows past the archive age are moved to archive segments first
+    (LogArchiveService), so the log retention applies to the segments too.
+    """
+
+    INTERVAL = float(os.environ.get('FTPMAN_RETENTION_INTERVAL', 3600))
+    # Days kept; 0 keeps everything
+    LOG_RETENTION_DAYS = int(os.environ.get('FTPMAN_LOG_RETENTION_DAYS', 365))
+    CONFIG_HISTORY_DAYS = int(os.environ.get('FTPMAN_CONFIG_HISTORY_DAYS', 0))
+    CHUNK_SIZE = 5000
+    # Seconds to yield the write lock between chunks
+    CHUNK_PAUSE = 0.05
+    VACUUM_PAGES = 2000
+
+    _thread = None
+    _stop = threading.Event()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start():
+        """Start the retention thread if it is not running yet"""
+        with RetentionService._lock:
+            if RetentionService._thread and RetentionService._thread.is_alive():
+                return
+            RetentionService._stop.clear()
+            RetentionService._thread = threading.Thread(
+                target=RetentionService._run, name='retention', daemon=True
+            )
+            RetentionService._thread.start()
+
+    @staticmethod
+    def stop():
+        RetentionService._stop.set()
+
+    @staticmethod
+    def _run():
+        while not RetentionService._stop.is_set():
+            try:
+                with db.connection_context():
+                    RetentionService.run_once()
+            except Exception as e:
+                print(f"Error applying retention: {e}")
+            RetentionService._stop.wait(RetentionService.INTERVAL)
+
+    @staticmethod
+    def run_once(now=None):
+        """Apply retention once; returns rows archived and deleted per table and pages vacuumed"""
+        now = now if now is not None else time.time()
+        result = {'ftplog': 0, 'configchange': 0, 'vacuumed_pages': 0, 'archived': 0, 'segments_deleted': 0}
+        result['archived'] = LogArchiveService.run_once(now)['rows']
+        if RetentionService.LOG_RETENTION_DAYS:
+            cutoff = int(now - RetentionService.LOG_RETENTION_DAYS * 86400)
+            result['ftplog'] = RetentionService._delete_before(FTPLog, FTPLog.timestamp, cutoff)
+            result['segments_deleted'] = LogArchiveService.prune(cutoff)
+        if RetentionService.CONFIG_HISTORY_DAYS:
+            cutoff = datetime.fromtimestamp(now) - timedelta(days=RetentionService.CONFIG_HISTORY_DAYS)
+            result['configchange'] = RetentionService._delete_before(ConfigChange, ConfigChange.changed_at, cutoff)
+        if result['ftplog'] or result['configchange'] or result['archived']:
+            result['vacuumed_pages'] = RetentionService._vacuum()
+        return result
+
+    @staticmethod
+    def _delete_before(model, field, cutoff):
+        """Delete rows with ``field < cutoff`` oldest first, one chunk per transaction"""
+        deleted = 0
+        while not RetentionService._stop.is_set():
+            chunk = (model.select(model.id)
+                     .where(field < cutoff)
+                     .order_by(field)
+                     .limit(RetentionService.CHUNK_SIZE))
+            with db.atomic():
+                count = model.delete().where(model.id.in_(chunk)).execute()
+            deleted += count
+            if count < RetentionService.CHUNK_SIZE:
+                break
+            time.sleep(RetentionService.CHUNK_PAUSE)
+        return deleted
+
+    @staticmethod
+    def _convert_to_incremental():
+        """One full VACUUM to switch auto_vacuum to INCREMENTAL; returns pages released
+
+        Copies the whole database and holds the write lock until done, so
+        it runs here in the background, once, the first time there is space
+        to reclaim, not during startup.
+        """
+        free = db.execute_sql('PRAGMA freelist_count').fetchone()[0]
+        print("Converting the database to incremental vacuum (one-time full VACUUM)")
+        # The pragma only sticks if VACUUM runs on the same connection
+        db.connection().executescript('PRAGMA auto_vacuum = INCREMENTAL; VACUUM;')
+        return free
+
+    @staticmethod
+    def _vacuum():
+        """Release free pages to the filesystem in steps; returns pages released"""
+        if db.execute_sql('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return RetentionService._convert_to_incremental()
+        released = 0
+        while not RetentionService._stop.is_set():
+            free = db.execute_sql('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            # executescript steps the pragma to completion; execute() would
+            # stop after the first page
+            db.connection().executescript(f'PRAGMA incremental_vacuum({RetentionService.VACUUM_PAGES})')
+            left = db.execute_sql('PRAGMA freelist_count').fetchone()[0]
+            released += free - left
+            if left >= free:
+                break
+            time.sleep(RetentionService.CHUNK_PAUSE)
+        return released
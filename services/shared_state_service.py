@@ -0,0 +1,214 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from peewee import EXCLUDED
+from models import SharedEvent, SharedState, db
+
+class SharedStateService:
+    """State shared between the worker processes of a multi-worker server
+
+    With FTPMAN_WORKERS > 1 every worker imports the app, but only the one
+    holding an exclusive flock on LOCK_FILE (the leader) runs the background
+    threads: log ingestion, the dashboard sampler and the quota scanner.
+    The leader writes what those threads produce to the SharedState table
+    and stream events to SharedEvent; the other workers read from there
+    instead of repeating the same scans. Followers reach the leader through
+    signals (e.g. "sample now"), which it polls every POLL_INTERVAL seconds.
+    When the leader exits, the kernel releases its lock and a waiting
+    worker takes over.
+
+    With a single worker nothing is shared and the process is the leader.
+    """
+
+    WORKERS = int(os.environ.get('FTPMAN_WORKERS', 1))
+    LOCK_FILE = os.environ.get('FTPMAN_LEADER_LOCK', f"{db.database}.leader")
+    POLL_INTERVAL = 1.0
+    # Seconds stream events are kept for followers to pick up
+    EVENT_TTL = 120
+
+    _leader = False
+    _lock_fd = None
+    _cache = {}
+    _signal_handlers = {}
+    _relay_thread = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enabled():
+        return SharedStateService.WORKERS > 1
+
+    @staticmethod
+    def is_leader():
+        return not SharedStateService.enabled() or SharedStateService._leader
+
+    @staticmethod
+    def elect(on_elected):
+        """Run ``on_elected()`` in the worker that holds the leader lock
+
+        The call returns at once; workers that do not get the lock wait for
+        it in a background thread and take over when the leader goes away.
+        """
+        if not SharedStateService.enabled():
+            SharedStateService._leader = True
+            on_elected()
+            return
+
+        fd = os.open(SharedStateService.LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            threading.Thread(
+                target=SharedStateService._wait_for_lock, args=(fd, on_elected),
+                name='leader-election', daemon=True
+            ).start()
+            return
+        SharedStateService._become_leader(fd, on_elected)
+
+    @staticmethod
+    def _wait_for_lock(fd, on_elected):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        SharedStateService._become_leader(fd, on_elected)
+
+    @staticmethod
+    def _become_leader(fd, on_elected):
+        SharedStateService._lock_fd = fd
+        SharedStateService._leader = True
+        print(f"Worker {os.getpid()} is running the background services")
+        threading.Thread(target=SharedStateService._serve_signals, name='leader-signals', daemon=True).start()
+        on_elected()
+
+    @staticmethod
+    @contextmanager
+    def interprocess_lock(name):
+        """Exclusive lock held across worker processes for a read-modify-write"""
+        if not SharedStateService.enabled():
+            yield
+            return
+        with open(f"{db.database}.{name}.lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def put(key, value):
+        """Store a JSON-serializable value and bump its version"""
+        SharedState.insert(key=key, value=json.dumps(value), updated_at=time.time()).on_conflict(
+            conflict_target=[SharedState.key],
+            update={SharedState.value: EXCLUDED.value, SharedState.version: SharedState.version + 1,
+                    SharedState.updated_at: EXCLUDED.updated_at}
+        ).execute()
+
+    @staticmethod
+    def get(key, default=None):
+        """Latest value of ``key``; the decoded value is reused until its version changes"""
+        row = (SharedState.select(SharedState.version, SharedState.value)
+               .where(SharedState.key == key).tuples().first())
+        if row is None:
+            return default
+        version, text = row
+        cached = SharedStateService._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = json.loads(text) if text is not None else default
+        SharedStateService._cache[key] = (version, value)
+        return value
+
+    @staticmethod
+    def bump(key):
+        """Increase a version counter, e.g. to invalidate caches in every worker"""
+        SharedState.insert(key=key, updated_at=time.time()).on_conflict(
+            conflict_target=[SharedState.key],
+            update={SharedState.version: SharedState.version + 1, SharedState.updated_at: EXCLUDED.updated_at}
+        ).execute()
+
+    @staticmethod
+    def version(key):
+        return (SharedState.select(SharedState.version)
+                .where(SharedState.key == key).scalar()) or 0
+
+    @staticmethod
+    def on_signal(name, callback):
+        """Leader side: call ``callback(payload)`` when a worker sends ``name``"""
+        SharedStateService._signal_handlers[name] = callback
+
+    @staticmethod
+    def send_signal(name, payload=None):
+        """Follower side: ask the leader to act; repeated signals are merged"""
+        SharedStateService.put(f"signal.{name}", payload or {})
+
+    @staticmethod
+    def _serve_signals():
+        last_prune = 0.0
+        while True:
+            time.sleep(SharedStateService.POLL_INTERVAL)
+            try:
+                with db.connection_context():
+                    SharedStateService._dispatch_signals()
+                    if time.monotonic() - last_prune >= SharedStateService.EVENT_TTL:
+                        SharedEvent.delete().where(
+                            SharedEvent.created_at < time.time() - SharedStateService.EVENT_TTL).execute()
+                        last_prune = time.monotonic()
+            except Exception as e:
+                print(f"Error serving worker signals: {e}")
+
+    @staticmethod
+    def _dispatch_signals():
+        with db.atomic():
+            rows = list(SharedState.select(SharedState.key, SharedState.value)
+                        .where(SharedState.key.startswith('signal.')).tuples())
+            if rows:
+                SharedState.delete().where(SharedState.key.in_([key for key, _ in rows])).execute()
+        for key, text in rows:
+            callback = SharedStateService._signal_handlers.get(key[len('signal.'):])
+            if callback is not None:
+                callback(json.loads(text))
+
+    @staticmethod
+    def emit_many(events):
+        """Leader side: store (event_type, data) stream events for the followers"""
+        now = time.time()
+        rows = [{'event_type': event_type, 'data': json.dumps(data), 'created_at': now}
+                for event_type, data in events]
+        with db.atomic():
+            for i in range(0, len(rows), 100):
+                SharedEvent.insert_many(rows[i:i + 100]).execute()
+
+    @staticmethod
+    def relay_events(callback):
+        """Follower side: start passing the leader's events to ``callback(event_type, data)``"""
+        with SharedStateService._lock:
+            if SharedStateService._relay_thread is not None:
+                return
+            SharedStateService._relay_thread = threading.Thread(
+                target=SharedStateService._relay, args=(callback,), name='event-relay', daemon=True
+            )
+            SharedStateService._relay_thread.start()
+
+    @staticmethod
+    def _relay(callback):
+        last_id = None
+        while True:
+            try:
+                with db.connection_context():
+                    if last_id is None or SharedStateService._leader:
+                        # Start at the end; a leader publishes its own events directly
+                        last_id = SharedEvent.select(SharedEvent.id).order_by(SharedEvent.id.desc()).scalar() or 0
+                    else:
+                        rows = list(SharedEvent.select()
+                                    .where(SharedEvent.id > last_id)
+                                    .order_by(SharedEvent.id)
+                                    .tuples())
+                        if rows and rows[0][0] != last_id + 1:
+                            # Events were pruned before we saw them
+                            callback('resync', {})
+                        for event_id, event_type, data, _ in rows:
+                            callback(event_type, json.loads(data))
+                            last_id = event_id
+            except Exception as e:
+                print(f"Error relaying stream events: {e}")
+            time.sleep(SharedStateService.POLL_INTERVAL)
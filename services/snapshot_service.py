@@ -0,0 +1,268 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from utils.log_parser import parse_vsftpd_line, parse_xfer_line
+from utils.log_tailer import LogTailer
+from services.ftp_user_service import FTPUserService
+from services.ftp_log_service import FTPLogService
+from services.ftp_connection_service import FTPConnectionService
+from services.ftp_config_service import FTPConfigService
+from services.connection_history_service import ConnectionHistoryService
+from services.shared_state_service import SharedStateService
+
+class SnapshotService:
+    """Background sampler shared by every dashboard client
+
+    One thread collects connections, counters and the vsftpd service status
+    every INTERVAL seconds, swaps the result into a shared snapshot and adds
+    the connection counts to ConnectionHistoryService. API
+    handlers only read that snapshot, so their cost does not depend on how
+    many browser tabs are polling.
+
+    The same thread pushes changes to /api/stream subscribers: new log lines
+    (checked every STREAM_INTERVAL seconds), connection open/close events
+    and stat changes.
+
+    In a multi-worker server only the leader samples; it shares snapshots
+    and stream events through SharedStateService and the other workers
+    serve those.
+    """
+
+    INTERVAL = float(os.environ.get('FTPMAN_SAMPLE_INTERVAL', 5))
+    STREAM_INTERVAL = 1.0
+    # Events buffered per subscriber before it is told to resync
+    QUEUE_SIZE = 1000
+    # Log lines pushed per file per tick at most
+    MAX_LOG_EVENTS = 200
+
+    _snapshot = None
+    _thread = None
+    _stop = threading.Event()
+    _wake = threading.Event()
+    _lock = threading.Lock()
+    _sample_lock = threading.Lock()
+    _subscribers = set()
+    _outbox = []
+    _log_tailers = None
+
+    @staticmethod
+    def start():
+        """Start the sampler thread if it is not running yet"""
+        with SnapshotService._lock:
+            if SnapshotService._thread and SnapshotService._thread.is_alive():
+                return
+            SnapshotService._stop.clear()
+            SharedStateService.on_signal('snapshot.refresh', lambda payload: SnapshotService._wake.set())
+            SnapshotService._thread = threading.Thread(
+                target=SnapshotService._run, name='snapshot-sampler', daemon=True
+            )
+            SnapshotService._thread.start()
+
+    @staticmethod
+    def stop():
+        SnapshotService._stop.set()
+        SnapshotService._wake.set()
+
+    @staticmethod
+    def request_refresh():
+        """Ask the sampler to take a new sample now (after a mutation)"""
+        if not SharedStateService.is_leader():
+            SharedStateService.send_signal('snapshot.refresh')
+            return
+        SnapshotService._wake.set()
+
+    @staticmethod
+    def _run():
+        next_sample = 0.0
+        while not SnapshotService._stop.is_set():
+            now = time.monotonic()
+            if now >= next_sample or SnapshotService._wake.is_set():
+                # Cleared before sampling so a refresh requested meanwhile is not lost
+                SnapshotService._wake.clear()
+                try:
+                    SnapshotService.sample_once()
+                except Exception as e:
+                    print(f"Error sampling dashboard snapshot: {e}")
+                next_sample = now + SnapshotService.INTERVAL
+            try:
+                SnapshotService._publish_log_lines()
+            except Exception as e:
+                print(f"Error streaming log lines: {e}")
+            try:
+                SnapshotService._flush_outbox()
+            except Exception as e:
+                print(f"Error sharing stream events: {e}")
+            SnapshotService._wake.wait(SnapshotService.STREAM_INTERVAL)
+
+    @staticmethod
+    def sample_once():
+        """Collect a fresh snapshot and publish it (only the leader publishes)"""
+        with SnapshotService._sample_lock:
+            connections = FTPConnectionService.get_active_connections()
+            system_users = FTPUserService.get_system_users()
+            blocked_users = FTPUserService.get_blocked_users()
+            recent_logs = FTPLogService.get_recent_logs(limit=10)
+
+            snapshot = {
+                'connections': connections,
+                'stats': {
+                    'total_users': len(system_users),
+                    'active_connections': len(connections),
+                    'blocked_users': len(blocked_users),
+                    'recent_activity': len(recent_logs),
+                    'vsftpd_status': FTPConfigService.get_service_status()
+                },
+                'sampled_at': datetime.now().isoformat(),
+                'sampled_epoch': time.time()
+            }
+
+            if not SharedStateService.is_leader():
+                # A follower's stopgap sample; the leader's shared one wins from now on
+                return snapshot
+
+            ConnectionHistoryService.record(
+                snapshot['sampled_epoch'], FTPConnectionService.get_connection_stats(connections)
+            )
+            if SharedStateService.enabled():
+                SharedStateService.put('snapshot', snapshot)
+
+            with SnapshotService._lock:
+                previous = SnapshotService._snapshot
+                SnapshotService._snapshot = snapshot
+            if previous is not None:
+                SnapshotService._publish_changes(previous, snapshot)
+            return snapshot
+
+    @staticmethod
+    def get():
+        """Return the latest snapshot, sampling synchronously only before the first one"""
+        if SharedStateService.is_leader():
+            snapshot = SnapshotService._snapshot
+        else:
+            snapshot = SharedStateService.get('snapshot')
+        if snapshot is None:
+            snapshot = SnapshotService.sample_once()
+        return snapshot
+
+    @staticmethod
+    def subscribe():
+        """Register a stream client; returns the queue its events arrive on"""
+        events = queue.Queue(maxsize=SnapshotService.QUEUE_SIZE)
+        with SnapshotService._lock:
+            SnapshotService._subscribers.add(events)
+        if not SharedStateService.is_leader():
+            SharedStateService.relay_events(SnapshotService._deliver)
+        return events
+
+    @staticmethod
+    def unsubscribe(events):
+        with SnapshotService._lock:
+            SnapshotService._subscribers.discard(events)
+
+    @staticmethod
+    def publish(event_type, data):
+        """Send an event to every stream client, in every worker"""
+        if SharedStateService.enabled():
+            with SnapshotService._lock:
+                SnapshotService._outbox.append((event_type, data))
+        SnapshotService._deliver(event_type, data)
+
+    @staticmethod
+    def _deliver(event_type, data):
+        """Send an event to this worker's stream clients"""
+        with SnapshotService._lock:
+            subscribers = list(SnapshotService._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait((event_type, data))
+            except queue.Full:
+                # Client fell behind: drop its backlog and make it refetch
+                SnapshotService._drain(events)
+                events.put_nowait(('resync', {}))
+
+    @staticmethod
+    def _has_listeners():
+        # Other workers' stream clients cannot be seen from here
+        return bool(SnapshotService._subscribers) or SharedStateService.enabled()
+
+    @staticmethod
+    def _flush_outbox():
+        """Hand this tick's events to the other workers in one transaction"""
+        with SnapshotService._lock:
+            outbox = SnapshotService._outbox
+            SnapshotService._outbox = []
+        if outbox:
+            SharedStateService.emit_many(outbox)
+
+    @staticmethod
+    def _drain(events):
+        try:
+            while True:
+                events.get_nowait()
+        except queue.Empty:
+            pass
+
+    @staticmethod
+    def _connection_key(conn):
+        return f"{conn['pid']}-{conn.get('remote_address', conn['ip_address'])}"
+
+    @staticmethod
+    def _publish_changes(previous, snapshot):
+        """Publish connection open/close events and changed stats"""
+        if not SnapshotService._has_listeners():
+            return
+
+        before = {SnapshotService._connection_key(c): c for c in previous['connections']}
+        after = {SnapshotService._connection_key(c): c for c in snapshot['connections']}
+        for key in after.keys() - before.keys():
+            SnapshotService.publish('connection_open', dict(after[key], key=key))
+        for key in before.keys() - after.keys():
+            SnapshotService.publish('connection_close', {'key': key, 'pid': before[key]['pid']})
+
+        if SnapshotService._comparable_stats(previous) != SnapshotService._comparable_stats(snapshot):
+            SnapshotService.publish('stats', snapshot['stats'])
+
+    @staticmethod
+    def _comparable_stats(snapshot):
+        # systemctl status text changes every call (uptime), so only compare the state
+        stats = dict(snapshot['stats'])
+        status = stats.pop('vsftpd_status', {})
+        return stats, status.get('active'), status.get('status')
+
+    @staticmethod
+    def _publish_log_lines():
+        """Push lines appended to vsftpd.log and xferlog since the last tick"""
+        if SnapshotService._log_tailers is None:
+            SnapshotService._log_tailers = [
+                (SnapshotService._tailer_at_eof(FTPLogService.VSFTPD_LOG_FILE), parse_vsftpd_line),
+                (SnapshotService._tailer_at_eof(FTPLogService.XFERLOG_FILE), parse_xfer_line),
+            ]
+
+        for tailer, parser in SnapshotService._log_tailers:
+            lines = tailer.poll()
+            if not lines or not SnapshotService._has_listeners():
+                continue
+            for line in lines[-SnapshotService.MAX_LOG_EVENTS:]:
+                record = parser(line)
+                if record is not None:
+                    SnapshotService.publish('log', record.to_dict())
+
+    @staticmethod
+    def _tailer_at_eof(path):
+        """A tailer that only reports lines written after it was created"""
+        try:
+            st = os.stat(path)
+            return LogTailer(path, max_lines=1, offset=st.st_size, inode=st.st_ino)
+        except OSError:
+            # Not there yet: read it from the start once it appears
+            return LogTailer(path, max_lines=1, offset=0)
+
+    @staticmethod
+    def snapshot_event():
+        """The initial event sent to a new stream client"""
+        snapshot = SnapshotService.get()
+        return 'snapshot', {'stats': snapshot['stats'], 'connections': [
+            dict(c, key=SnapshotService._connection_key(c)) for c in snapshot['connections']
+        ]}
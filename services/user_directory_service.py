@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pwd
+import threading
+from models import FTPUser
+from services.ftp_user_service import FTPUserService
+from services.shared_state_service import SharedStateService
+
+class UserDirectoryService:
+    """In-memory join of /etc/passwd, user_list and the FTPUser table
+
+    The directory is rebuilt only when /etc/passwd or user_list change on
+    disk (inode/mtime/size) or after invalidate() is called for a database
+    change. Each build does one getpwall() pass and one FTPUser query and
+    joins them through dicts and sets; sorted views are cached per sort key.
+    """
+
+    PASSWD_FILE = '/etc/passwd'
+    DEFAULT_SORT = 'username'
+    SORT_FIELDS = {'username', 'home_directory', 'is_blocked', 'is_active', 'created_at', 'exists_in_system'}
+    MAX_PAGE_SIZE = 1000
+
+    _users = None
+    _by_name = {}
+    _sorted = {}
+    _key = None
+    _version = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def invalidate():
+        """Drop the cached directory after an FTPUser change, in every worker"""
+        with UserDirectoryService._lock:
+            UserDirectoryService._version += 1
+        if SharedStateService.enabled():
+            SharedStateService.bump('users')
+
+    @staticmethod
+    def _file_key(path):
+        try:
+            st = os.stat(path)
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    @staticmethod
+    def _current_key():
+        return (
+            UserDirectoryService._file_key(UserDirectoryService.PASSWD_FILE),
+            UserDirectoryService._file_key(FTPUserService.USER_LIST_FILE),
+            UserDirectoryService._version,
+            SharedStateService.version('users') if SharedStateService.enabled() else 0,
+        )
+
+    @staticmethod
+    def _load():
+        """Return the cached user list, rebuilding it when a source changed"""
+        with UserDirectoryService._lock:
+            key = UserDirectoryService._current_key()
+            if UserDirectoryService._users is None or key != UserDirectoryService._key:
+                users = UserDirectoryService._build()
+                UserDirectoryService._users = users
+                UserDirectoryService._by_name = {user['username']: user for user in users}
+                UserDirectoryService._sorted = {}
+                UserDirectoryService._key = key
+            return UserDirectoryService._users
+
+    @staticmethod
+    def _build():
+        system_users = {}
+        for entry in pwd.getpwall():
+            # Same UID range as FTPUserService.get_system_users
+            if 1000 <= entry.pw_uid < 65534:
+                system_users[entry.pw_name] = entry
+        blocked_users = set(FTPUserService.get_blocked_users())
+
+        users = []
+        db_names = set()
+        for user in FTPUser.select().dicts():
+            db_names.add(user['username'])
+            user['exists_in_system'] = user['username'] in system_users
+            user['is_blocked'] = user['username'] in blocked_users
+            users.append(user)
+
+        # System users not in the database
+        for name, entry in system_users.items():
+            if name in db_names:
+                continue
+            users.append({
+                'id': None,
+                'username': name,
+                'home_directory': entry.pw_dir,
+                'is_active': True,
+                'is_blocked': name in blocked_users,
+                'created_at': None,
+                'created_by': None,
+                'exists_in_system': True
+            })
+        return users
+
+    @staticmethod
+    def get_user(username):
+        UserDirectoryService._load()
+        return UserDirectoryService._by_name.get(username)
+
+    @staticmethod
+    def etag():
+        """Validator for conditional /api/users requests; changes with the directory"""
+        UserDirectoryService._load()
+        with UserDirectoryService._lock:
+            key = UserDirectoryService._key
+        return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _sorted_view(sort, descending):
+        """Return (users, {username: position}) in the requested order"""
+        with UserDirectoryService._lock:
+            users = UserDirectoryService._users
+            views = UserDirectoryService._sorted
+        view = views.get((sort, descending))
+        if view is None:
+            if sort == 'username':
+                ordered = sorted(users, key=lambda user: user['username'], reverse=descending)
+            else:
+                # None (e.g. created_at of system-only users) sorts first
+                ordered = sorted(users, key=lambda user: (user[sort] is not None,
+                                                          user[sort] if user[sort] is not None else 0,
+                                                          user['username']),
+                                 reverse=descending)
+            view = (ordered, {user['username']: position for position, user in enumerate(ordered)})
+            views[(sort, descending)] = view
+        return view
+
+    @staticmethod
+    def list_users(sort=None, order='asc', offset=0, limit=None, cursor=None, search=None):
+        """Return (page, total, next_cursor) of users sorted server side
+
+        ``cursor`` is the username of the last row of the previous page and
+        takes precedence over ``offset``; ``search`` keeps users whose name or
+        home directory contains it. ``limit`` of None returns every user from
+        the start position on.
+        """
+        sort = sort or UserDirectoryService.DEFAULT_SORT
+        if sort not in UserDirectoryService.SORT_FIELDS:
+            raise ValueError(f"Cannot sort by '{sort}'")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        offset = int(offset or 0)
+        if offset < 0:
+            raise ValueError("offset must not be negative")
+
+        UserDirectoryService._load()
+        view, positions = UserDirectoryService._sorted_view(sort, order == 'desc')
+
+        if search:
+            needle = search.lower()
+            view = [user for user in view
+                    if needle in user['username'].lower() or needle in (user['home_directory'] or '').lower()]
+            if cursor is not None:
+                positions = {user['username']: position for position, user in enumerate(view)}
+
+        if cursor is not None:
+            if cursor not in positions:
+                raise ValueError("Unknown cursor")
+            offset = positions[cursor] + 1
+
+        if limit is None:
+            return view[offset:], len(view), None
+        limit = max(1, min(int(limit), UserDirectoryService.MAX_PAGE_SIZE))
+        page = view[offset:offset + limit]
+        next_cursor = page[-1]['username'] if offset + limit < len(view) else None
+        return page, len(view), next_cursor
@@ -0,0 +1,252 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from models import db
+from utils.system_utils import SystemUtils
+from services.shared_state_service import SharedStateService
+
+class VsftpdReloadService:
+    """Coalesces user_list edits and config changes into one vsftpd reload
+
+    Block/unblock requests and config changes are queued; once no new change
+    has arrived for DEBOUNCE seconds (or MAX_DELAY after the first queued
+    change) the user_list file is rewritten atomically and vsftpd is
+    reloaded once. A restart is only issued when one of the changed keys is
+    in RESTART_KEYS. Every queued change bumps the requested generation;
+    the applied generation catches up when the batch has been applied; a
+    batch that fails stays queued and is retried after RETRY_DELAY.
+
+    With several workers the queue and both generations are kept in
+    SharedState under an interprocess lock, so every worker reports the
+    same status and any of them can apply the batch.
+    """
+
+    SERVICE_NAME = 'vsftpd'
+    DEBOUNCE = float(os.environ.get('FTPMAN_RELOAD_DEBOUNCE', 2))
+    MAX_DELAY = 10.0
+    # Seconds before a failed batch is tried again
+    RETRY_DELAY = 30.0
+
+    # The standalone listener re-reads vsftpd.conf on SIGHUP, but the
+    # listening socket itself is only set up when the process starts
+    RESTART_KEYS = {
+        'listen', 'listen_ipv6', 'listen_port', 'listen_address', 'listen_address6',
+        'background',
+    }
+
+    _local_state = None
+    _timer = None
+    _lock = threading.RLock()
+    _flush_lock = threading.Lock()
+
+    @staticmethod
+    def _stored_state():
+        if SharedStateService.enabled():
+            stored = SharedStateService.get('reload')
+        else:
+            stored = VsftpdReloadService._local_state
+        state = {
+            'generation': 0, 'applied_generation': 0, 'first_pending_at': None,
+            'applying': None, 'last_action': None, 'last_error': None,
+        }
+        state.update(stored or {})
+        # Fresh sets: SharedStateService.get hands out its cached value
+        for name in ('pending_blocks', 'pending_unblocks', 'pending_keys'):
+            state[name] = set((stored or {}).get(name, ()))
+        return state
+
+    @staticmethod
+    @contextmanager
+    def _state():
+        """Read-modify-write the queue; with several workers it lives in SharedState"""
+        with VsftpdReloadService._lock, SharedStateService.interprocess_lock('reload'):
+            state = VsftpdReloadService._stored_state()
+            before = dict(state, **{name: set(state[name]) for name in
+                                    ('pending_blocks', 'pending_unblocks', 'pending_keys')})
+            yield state
+            if state == before:
+                return
+            stored = {key: sorted(value) if isinstance(value, set) else value for key, value in state.items()}
+            if SharedStateService.enabled():
+                SharedStateService.put('reload', stored)
+            else:
+                VsftpdReloadService._local_state = stored
+
+    @staticmethod
+    def block(username):
+        """Queue adding a user to user_list"""
+        with VsftpdReloadService._state() as state:
+            state['pending_unblocks'].discard(username)
+            state['pending_blocks'].add(username)
+            return VsftpdReloadService._schedule(state)
+
+    @staticmethod
+    def unblock(username):
+        """Queue removing a user from user_list"""
+        with VsftpdReloadService._state() as state:
+            state['pending_blocks'].discard(username)
+            state['pending_unblocks'].add(username)
+            return VsftpdReloadService._schedule(state)
+
+    @staticmethod
+    def forget(username):
+        """Drop queued user_list changes for a user (e.g. when it is deleted)"""
+        with VsftpdReloadService._state() as state:
+            state['pending_blocks'].discard(username)
+            state['pending_unblocks'].discard(username)
+
+    @staticmethod
+    def config_changed(keys):
+        """Queue a reload (or restart) for config keys already written to disk"""
+        with VsftpdReloadService._state() as state:
+            state['pending_keys'].update(keys)
+            return VsftpdReloadService._schedule(state)
+
+    @staticmethod
+    def _schedule(state):
+        state['generation'] += 1
+        # Wall clock, as the queue may have been started by another worker
+        now = time.time()
+        if state['first_pending_at'] is None:
+            state['first_pending_at'] = now
+
+        # Debounce, but never postpone a change by more than MAX_DELAY
+        delay = min(VsftpdReloadService.DEBOUNCE,
+                    state['first_pending_at'] + VsftpdReloadService.MAX_DELAY - now)
+        VsftpdReloadService._arm(delay)
+        return state['generation']
+
+    @staticmethod
+    def _arm(delay):
+        with VsftpdReloadService._lock:
+            if VsftpdReloadService._timer is not None:
+                VsftpdReloadService._timer.cancel()
+            VsftpdReloadService._timer = threading.Timer(max(delay, 0), VsftpdReloadService._flush_on_timer)
+            VsftpdReloadService._timer.daemon = True
+            VsftpdReloadService._timer.start()
+
+    @staticmethod
+    def _flush_on_timer():
+        with db.connection_context():
+            VsftpdReloadService.flush()
+
+    @staticmethod
+    def flush():
+        """Apply every queued change now, whichever worker queued it; returns (success, message)"""
+        with VsftpdReloadService._flush_lock:
+            with VsftpdReloadService._lock:
+                if VsftpdReloadService._timer is not None:
+                    VsftpdReloadService._timer.cancel()
+                    VsftpdReloadService._timer = None
+            with VsftpdReloadService._state() as state:
+                blocks = state['pending_blocks']
+                unblocks = state['pending_unblocks']
+                keys = state['pending_keys']
+                generation = state['generation']
+                first_pending_at = state['first_pending_at']
+                state['pending_blocks'] = set()
+                state['pending_unblocks'] = set()
+                state['pending_keys'] = set()
+                state['first_pending_at'] = None
+                if not (blocks or unblocks or keys):
+                    if state['applying'] is None:
+                        # Queued changes were dropped again (forget)
+                        state['applied_generation'] = max(state['applied_generation'], generation)
+                    return True, "Nothing to apply"
+                # Another worker's flush must not report this batch as applied
+                state['applying'] = generation
+
+            try:
+                if blocks or unblocks:
+                    # Other workers may be rewriting the list at the same time
+                    with SharedStateService.interprocess_lock('user_list'):
+                        VsftpdReloadService._write_user_list(blocks, unblocks)
+
+                restart = bool(keys & VsftpdReloadService.RESTART_KEYS)
+                success, message = VsftpdReloadService._apply_service_action(restart)
+            except Exception as e:
+                success, message = False, f"Error applying changes: {str(e)}"
+
+            with VsftpdReloadService._state() as state:
+                state['applying'] = None
+                if success:
+                    state['applied_generation'] = max(state['applied_generation'], generation)
+                else:
+                    # Queue the batch again; changes made meanwhile win over it
+                    state['pending_blocks'].update(blocks - state['pending_unblocks'])
+                    state['pending_unblocks'].update(unblocks - state['pending_blocks'])
+                    state['pending_keys'].update(keys)
+                    if state['first_pending_at'] is None or (first_pending_at or 0) < state['first_pending_at']:
+                        state['first_pending_at'] = first_pending_at
+                state['last_action'] = message
+                state['last_error'] = None if success else message
+            if not success:
+                print(f"{message}; retrying in {VsftpdReloadService.RETRY_DELAY:.0f}s")
+                VsftpdReloadService._arm(VsftpdReloadService.RETRY_DELAY)
+            return success, message
+
+    @staticmethod
+    def _write_user_list(blocks, unblocks):
+        """Rewrite user_list once with all queued additions and removals"""
+        from services.ftp_user_service import FTPUserService
+        path = FTPUserService.USER_LIST_FILE
+
+        lines = []
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                lines = [line.rstrip('\n') for line in f]
+
+        present = {line.strip() for line in lines}
+        lines = [line for line in lines if line.strip() not in unblocks]
+        lines.extend(sorted(username for username in blocks if username not in present))
+
+        # Atomic replace so vsftpd never sees a half written list
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.user_list.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(''.join(f"{line}\n" for line in lines))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _apply_service_action(restart):
+        service = VsftpdReloadService.SERVICE_NAME
+        if not restart:
+            success, output = SystemUtils.run_command(['systemctl', 'reload', service])
+            if success:
+                return True, "VSFTPD reloaded successfully"
+            # Units without ExecReload cannot be reloaded; fall back to a restart
+        success, output = SystemUtils.restart_service(service)
+        if success:
+            return True, "VSFTPD restarted successfully"
+        return False, f"Failed to restart VSFTPD: {output}"
+
+    @staticmethod
+    def pending_blocked(blocked_users):
+        """Overlay queued changes on the blocked users read from user_list"""
+        state = VsftpdReloadService._stored_state()
+        if not state['pending_blocks'] and not state['pending_unblocks']:
+            return blocked_users
+        result = [u for u in blocked_users if u not in state['pending_unblocks']]
+        present = set(result)
+        result.extend(u for u in sorted(state['pending_blocks']) if u not in present)
+        return result
+
+    @staticmethod
+    def status():
+        state = VsftpdReloadService._stored_state()
+        return {
+            'pending_generation': state['generation'],
+            'applied_generation': state['applied_generation'],
+            'pending_blocks': sorted(state['pending_blocks']),
+            'pending_unblocks': sorted(state['pending_unblocks']),
+            'pending_keys': sorted(state['pending_keys']),
+            'last_action': state['last_action'],
+            'last_error': state['last_error']
+        }
@@ -79,6 +79,7 @@ pip install Jinja2==3.1.2
 pip install MarkupSafe==2.1.3
 pip install click==8.1.7
 pip install itsdangerous==2.1.2
+pip install gunicorn==21.2.0
 "
 
 # Verify installation
@@ -201,6 +202,9 @@ source venv/bin/activate
 export FLASK_HOST="0.0.0.0"
 export FLASK_PORT="5000"
 export FLASK_DEBUG="False"
+# Server worker processes and threads per worker (see gunicorn.conf.py)
+export FTPMAN_WORKERS="2"
+export FTPMAN_THREADS="16"
 
 # Initialize database and create default admin user
 python3 -c "
@@ -219,9 +223,9 @@ except Exception as e:
     print(f'Error initializing database: {e}')
 "
 
-# Start Flask application as root
+# Start the application as root with the production server
 echo "Starting VSFTPD Manager as root..."
-python3 app.py
+exec gunicorn -c gunicorn.conf.py app:app
 EOF
 
 chmod +x $APP_DIR/start.sh
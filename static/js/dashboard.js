@@ -1,62 +1,205 @@
 // Dashboard JavaScript
 let connectionChart = null;
+let eventStream = null;
 
 // Initialize dashboard
 $(document).ready(function() {
-    loadStats();
+    // Initialize connection chart
+    initConnectionChart();
+    
     loadUsers();
-    loadConnections();
     loadLogs();
     loadConfig();
     
-    // Set up auto-refresh
+    // Live updates are pushed over Server-Sent Events; poll only without them
+    if (window.EventSource) {
+        openEventStream();
+    } else {
+        startPolling();
+    }
+});
+
+// Subscribe to /api/stream
+function openEventStream() {
+    eventStream = new EventSource('/api/stream');
+    
+    eventStream.addEventListener('snapshot', function(e) {
+        const data = JSON.parse(e.data);
+        renderStats(data.stats);
+        renderConnections(data.connections);
+    });
+    eventStream.addEventListener('stats', function(e) {
+        renderStats(JSON.parse(e.data));
+    });
+    eventStream.addEventListener('connection_open', function(e) {
+        addConnectionRow(JSON.parse(e.data));
+        updateConnectionChart();
+    });
+    eventStream.addEventListener('connection_close', function(e) {
+        removeConnectionRow(JSON.parse(e.data).key);
+        updateConnectionChart();
+    });
+    eventStream.addEventListener('log', function(e) {
+        prependLogRow(JSON.parse(e.data));
+    });
+    eventStream.addEventListener('resync', function() {
+        loadStats();
+        loadConnections();
+        loadLogs();
+    });
+    // EventSource reconnects by itself and gets a fresh snapshot on reconnect
+}
+
+// Fallback when the browser has no EventSource
+function startPolling() {
+    loadStats();
+    loadConnections();
     setInterval(loadStats, 5000);
     setInterval(loadConnections, 10000);
-    
-    // Initialize connection chart
-    initConnectionChart();
-});
+}
 
 // Load statistics
 function loadStats() {
-    $.get('/api/stats', function(data) {
-        $('#stat-users').text(data.total_users);
-        $('#stat-connections').text(data.active_connections);
-        $('#stat-blocked').text(data.blocked_users);
-    });
+    $.get('/api/stats', renderStats);
+}
+
+function renderStats(data) {
+    $('#stat-users').text(data.total_users);
+    $('#stat-connections').text(data.active_connections);
+    $('#stat-blocked').text(data.blocked_users);
 }
 
-// Load users
+// Users table: pages are fetched on demand and only the rows in view are rendered
+const USERS_PAGE_SIZE = 200;
+const USER_ROW_OVERSCAN = 20;
+let userRowHeight = 49;
+let userRowMeasured = false;
+let usersTotal = 0;
+let usersQuery = '';
+let usersEtag = null;
+let userPages = new Map();
+let userPagesLoading = new Set();
+let usersRenderQueued = false;
+
+$(document).ready(function() {
+    $('#usersScroll').on('scroll', scheduleUsersRender);
+    let searchTimer = null;
+    $('#userSearch').on('input', function() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(loadUsers, 300);
+    });
+});
+
+// Load users (revalidates the page in view; an unchanged directory answers 304)
 function loadUsers() {
-    $.get('/api/users', function(users) {
-        const tbody = $('#usersTable tbody');
-        tbody.empty();
-        
-        users.forEach(user => {
-            const statusBadge = user.is_blocked 
-                ? '<span class="badge bg-danger">Blocked</span>'
-                : '<span class="badge bg-success">Active</span>';
-            
-            const blockBtn = user.is_blocked
-                ? `<button class="btn btn-sm btn-success" onclick="unblockUser('${user.username}')">Unblock</button>`
-                : `<button class="btn btn-sm btn-warning" onclick="blockUser('${user.username}')">Block</button>`;
-            
-            tbody.append(`
-                <tr>
-                    <td>${user.username}</td>
-                    <td>${user.home_directory}</td>
-                    <td>${statusBadge}</td>
-                    <td>${new Date(user.created_at).toLocaleString()}</td>
-                    <td>
-                        ${blockBtn}
-                        <button class="btn btn-sm btn-danger" onclick="deleteUser('${user.username}')">Delete</button>
-                    </td>
-                </tr>
-            `);
-        });
+    const query = $('#userSearch').val().trim();
+    if (query !== usersQuery) {
+        usersQuery = query;
+        userPages = new Map();
+        usersEtag = null;
+        $('#usersScroll').scrollTop(0);
+    }
+    const first = Math.floor($('#usersScroll').scrollTop() / userRowHeight);
+    fetchUserPage(Math.floor(first / USERS_PAGE_SIZE));
+}
+
+function fetchUserPage(page) {
+    if (userPagesLoading.has(page)) return;
+    userPagesLoading.add(page);
+    
+    const query = usersQuery;
+    const params = new URLSearchParams({offset: page * USERS_PAGE_SIZE, limit: USERS_PAGE_SIZE});
+    if (query) params.set('search', query);
+    const headers = userPages.has(page) && usersEtag ? {'If-None-Match': usersEtag} : {};
+    
+    $.ajax({url: '/api/users?' + params.toString(), headers: headers}).done(function(response, status, xhr) {
+        if (xhr.status === 304 || query !== usersQuery) return;
+        const etag = xhr.getResponseHeader('ETag');
+        if (etag !== usersEtag) {
+            // Directory changed: every other cached page is stale
+            userPages = new Map();
+            usersEtag = etag;
+        }
+        usersTotal = response.total;
+        userPages.set(page, response.users);
+        scheduleUsersRender();
+    }).always(function() {
+        userPagesLoading.delete(page);
     });
 }
 
+function scheduleUsersRender() {
+    if (usersRenderQueued) return;
+    usersRenderQueued = true;
+    window.requestAnimationFrame(renderUsers);
+}
+
+function renderUsers() {
+    usersRenderQueued = false;
+    const container = $('#usersScroll');
+    const tbody = $('#usersTable tbody');
+    
+    if (usersTotal === 0) {
+        tbody.html('<tr><td colspan="5" class="text-center text-muted">No users</td></tr>');
+        return;
+    }
+    
+    const first = Math.max(0, Math.floor(container.scrollTop() / userRowHeight) - USER_ROW_OVERSCAN);
+    const last = Math.min(usersTotal, first + Math.ceil(container.height() / userRowHeight) + 2 * USER_ROW_OVERSCAN);
+    
+    const rows = [];
+    for (let i = first; i < last; i++) {
+        const users = userPages.get(Math.floor(i / USERS_PAGE_SIZE));
+        const user = users && users[i % USERS_PAGE_SIZE];
+        if (!users) {
+            fetchUserPage(Math.floor(i / USERS_PAGE_SIZE));
+        }
+        rows.push(user ? userRowHtml(user)
+                       : '<tr class="user-row"><td colspan="5" class="text-muted">Loading...</td></tr>');
+    }
+    
+    tbody.html(userSpacerHtml(first * userRowHeight) + rows.join('') +
+               userSpacerHtml((usersTotal - last) * userRowHeight));
+    
+    if (!userRowMeasured) {
+        const height = tbody.find('tr.user-row').first().outerHeight();
+        if (height) {
+            userRowMeasured = true;
+            if (Math.abs(height - userRowHeight) > 1) {
+                userRowHeight = height;
+                scheduleUsersRender();
+            }
+        }
+    }
+}
+
+function userSpacerHtml(height) {
+    return height > 0 ? `<tr><td colspan="5" style="height: ${height}px; padding: 0; border: 0;"></td></tr>` : '';
+}
+
+function userRowHtml(user) {
+    const statusBadge = user.is_blocked 
+        ? '<span class="badge bg-danger">Blocked</span>'
+        : '<span class="badge bg-success">Active</span>';
+    
+    const blockBtn = user.is_blocked
+        ? `<button class="btn btn-sm btn-success" onclick="unblockUser('${user.username}')">Unblock</button>`
+        : `<button class="btn btn-sm btn-warning" onclick="blockUser('${user.username}')">Block</button>`;
+    
+    return `
+        <tr class="user-row">
+            <td>${user.username}</td>
+            <td>${user.home_directory}</td>
+            <td>${statusBadge}</td>
+            <td>${user.created_at ? new Date(user.created_at).toLocaleString() : '-'}</td>
+            <td>
+                ${blockBtn}
+                <button class="btn btn-sm btn-danger" onclick="deleteUser('${user.username}')">Delete</button>
+            </td>
+        </tr>
+    `;
+}
+
 // Add user
 function addUser() {
     const data = {
@@ -128,32 +271,52 @@ function unblockUser(username) {
 }
 
 // Load connections
+const connectionRows = new Map();
+
 function loadConnections() {
     $.get('/api/connections', function(connections) {
-        const tbody = $('#connectionsTable tbody');
-        tbody.empty();
-        
-        connections.forEach(conn => {
-            tbody.append(`
-                <tr>
-                    <td>${conn.username}</td>
-                    <td>${conn.ip_address}</td>
-                    <td>${new Date(conn.connected_at).toLocaleString()}</td>
-                    <td>${conn.pid}</td>
-                    <td>
-                        <button class="btn btn-sm btn-danger" onclick="killConnection(${conn.pid})">
-                            <i class="bi bi-x-circle"></i> Kill
-                        </button>
-                    </td>
-                </tr>
-            `);
-        });
-        
-        // Update chart
-        updateConnectionChart(connections);
+        renderConnections(connections.map(conn => Object.assign(
+            {key: `${conn.pid}-${conn.remote_address || conn.ip_address}`}, conn)));
     });
 }
 
+function renderConnections(connections) {
+    $('#connectionsTable tbody').empty();
+    connectionRows.clear();
+    connections.forEach(addConnectionRow);
+    
+    // Update chart
+    updateConnectionChart();
+}
+
+function addConnectionRow(conn) {
+    if (connectionRows.has(conn.key)) return;
+    
+    const row = $(`
+        <tr>
+            <td>${conn.username}</td>
+            <td>${conn.ip_address}</td>
+            <td>${new Date(conn.connected_at).toLocaleString()}</td>
+            <td>${conn.pid}</td>
+            <td>
+                <button class="btn btn-sm btn-danger" onclick="killConnection(${conn.pid})">
+                    <i class="bi bi-x-circle"></i> Kill
+                </button>
+            </td>
+        </tr>
+    `);
+    $('#connectionsTable tbody').append(row);
+    connectionRows.set(conn.key, row);
+}
+
+function removeConnectionRow(key) {
+    const row = connectionRows.get(key);
+    if (row) {
+        row.remove();
+        connectionRows.delete(key);
+    }
+}
+
 // Kill connection
 function killConnection(pid) {
     if (confirm('Are you sure you want to terminate this connection?')) {
@@ -169,27 +332,57 @@ function killConnection(pid) {
     }
 }
 
-// Load logs
-function loadLogs() {
-    $.get('/api/logs', function(logs) {
+// Load logs (first page, or the next page when append is true)
+let logsCursor = null;
+
+function loadLogs(append = false) {
+    const params = {};
+    ['username', 'ip', 'action', 'status'].forEach(field => {
+        const value = $(`#logFilter_${field}`).val();
+        if (value) params[field] = value;
+    });
+    if (append && logsCursor) params.cursor = logsCursor;
+    
+    $.get('/api/logs', params, function(data) {
         const tbody = $('#logsTable tbody');
-        tbody.empty();
+        if (!append) tbody.empty();
         
-        logs.forEach(log => {
-            const statusClass = log.status === 'OK' ? 'text-success' : 'text-danger';
-            tbody.append(`
-                <tr class="log-entry">
-                    <td>${new Date(log.timestamp).toLocaleString()}</td>
-                    <td>${log.username}</td>
-                    <td>${log.action}</td>
-                    <td>${log.ip_address}</td>
-                    <td class="${statusClass}">${log.status}</td>
-                </tr>
-            `);
-        });
+        tbody.append(data.logs.map(logRowHtml).join(''));
+        
+        logsCursor = data.next_cursor;
+        $('#loadMoreLogs').toggle(Boolean(logsCursor));
     });
 }
 
+function logRowHtml(log) {
+    const statusClass = log.status === 'OK' ? 'text-success' : 'text-danger';
+    return `
+        <tr class="log-entry">
+            <td>${new Date(log.timestamp).toLocaleString()}</td>
+            <td>${log.username}</td>
+            <td>${log.action}</td>
+            <td>${log.ip_address}</td>
+            <td class="${statusClass}">${log.status}</td>
+        </tr>
+    `;
+}
+
+// Add a streamed log line on top when it matches the active filters
+function prependLogRow(log) {
+    const filters = {username: log.username, ip: log.ip_address, action: log.action, status: log.status};
+    for (const field in filters) {
+        const value = $(`#logFilter_${field}`).val();
+        if (value && value !== filters[field]) return;
+    }
+    
+    $('#logsTable tbody').prepend(logRowHtml(log));
+}
+
+// Load the next page of logs
+function loadMoreLogs() {
+    loadLogs(true);
+}
+
 // Refresh logs
 function refreshLogs() {
     loadLogs();
@@ -289,23 +482,36 @@ function initConnectionChart() {
             }
         }
     });
+    loadConnectionHistory();
+}
+
+// Seed the chart with the sampler's history of the last CHART_RANGE seconds
+const CHART_RANGE = 1800;
+const CHART_MAX_POINTS = 400;
+
+function loadConnectionHistory() {
+    $.get('/api/stats/history', {range: CHART_RANGE}, function(data) {
+        const points = data.points.slice(-CHART_MAX_POINTS);
+        connectionChart.data.labels = points.map(p => new Date(p.t * 1000).toLocaleTimeString());
+        connectionChart.data.datasets[0].data = points.map(p => p.active);
+        connectionChart.update();
+    });
 }
 
 // Update connection chart
-function updateConnectionChart(connections) {
+function updateConnectionChart() {
     if (!connectionChart) return;
     
     const now = new Date();
     const timeLabel = now.toLocaleTimeString();
     
-    // Keep only last 20 data points
-    if (connectionChart.data.labels.length >= 20) {
+    if (connectionChart.data.labels.length >= CHART_MAX_POINTS) {
         connectionChart.data.labels.shift();
         connectionChart.data.datasets[0].data.shift();
     }
     
     connectionChart.data.labels.push(timeLabel);
-    connectionChart.data.datasets[0].data.push(connections.length);
+    connectionChart.data.datasets[0].data.push(connectionRows.size);
     connectionChart.update();
 }
 
@@ -349,19 +555,3 @@ $('#mainTabs button[data-bs-toggle="tab"]').on('shown.bs.tab', function (e) {
             break;
     }
 });
-
-// Auto-refresh for active tab
-setInterval(() => {
-    const activeTab = $('.nav-link.active').attr('data-bs-target');
-    
-    switch(activeTab) {
-        case '#connections':
-            loadConnections();
-            break;
-        case '#logs':
-            if (Math.random() < 0.1) { // 10% chance to refresh logs
-                loadLogs();
-            }
-            break;
-    }
-}, 5000);
\ No newline at end of file
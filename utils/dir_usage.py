@@ -0,0 +1,95 @@
+import os
+
+
+class DirEntryUsage:
+    """Cached totals of the regular files directly inside one directory"""
+
+    __slots__ = ('mtime_ns', 'file_bytes', 'file_count', 'subdirs')
+
+    def __init__(self, mtime_ns, file_bytes, file_count, subdirs):
+        self.mtime_ns = mtime_ns
+        self.file_bytes = file_bytes
+        self.file_count = file_count
+        self.subdirs = subdirs
+
+
+class DirUsageCache:
+    """Disk usage of a directory tree with per-directory caching.
+
+    A directory is only listed again when its mtime changed, i.e. when
+    entries were created, removed or renamed in it; otherwise its cached
+    file totals are reused and only its subdirectories are stat'ed. Files
+    that grow in place do not change the directory mtime, so callers should
+    pass ``force=True`` now and then to re-list everything.
+
+    Sizes are apparent sizes (st_size), symlinks are not followed and hard
+    links are counted once per name.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self.listed = 0
+        self.visited = 0
+
+    def usage(self, root, force=False):
+        """Return (total_bytes, file_count) of the tree under ``root``"""
+        total_bytes = 0
+        file_count = 0
+        self.listed = 0
+        self.visited = 0
+
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.lstat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._forget(path)
+                continue
+            self.visited += 1
+
+            cached = self._dirs.get(path)
+            if cached is None or force or cached.mtime_ns != mtime_ns:
+                try:
+                    fresh = self._list(path, mtime_ns)
+                except PermissionError:
+                    if path == root:
+                        raise
+                    continue
+                if cached is not None:
+                    for gone in set(cached.subdirs) - set(fresh.subdirs):
+                        self._forget(gone)
+                self._dirs[path] = cached = fresh
+                self.listed += 1
+
+            total_bytes += cached.file_bytes
+            file_count += cached.file_count
+            stack.extend(cached.subdirs)
+
+        return total_bytes, file_count
+
+    @staticmethod
+    def _list(path, mtime_ns):
+        file_bytes = 0
+        file_count = 0
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        file_bytes += entry.stat(follow_symlinks=False).st_size
+                        file_count += 1
+                except FileNotFoundError:
+                    # Removed while we were listing
+                    continue
+        return DirEntryUsage(mtime_ns, file_bytes, file_count, subdirs)
+
+    def _forget(self, path):
+        """Drop a directory and everything cached below it"""
+        stack = [path]
+        while stack:
+            cached = self._dirs.pop(stack.pop(), None)
+            if cached is not None:
+                stack.extend(cached.subdirs)
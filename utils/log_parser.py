@@ -0,0 +1,166 @@
+import re
+import time
+from datetime import datetime
+
+# Mon Dec  4 10:30:15 2023 [pid 1234] [user] OK LOGIN: Client "192.168.1.100"
+# Mon Dec  4 10:30:15 2023 [pid 1234] CONNECT: Client "192.168.1.100"
+# Mon Dec  4 10:30:15 2023 <anything else>
+VSFTPD_LINE_RE = re.compile(
+    r'(?P<ts>\w{3}\s+\w{3}\s+\d+\s+\d+:\d+:\d+\s+\d{4})\s+'
+    r'(?:\[pid\s+(?P<pid>\d+)\]\s+'
+    r'(?:\[(?P<user>[^\]]+)\]\s+(?P<status>\w+)\s+(?P<action>\w+):\s+'
+    r'|(?P<event>\w+):\s+))?'
+    r'(?P<details>(?:Client\s+"(?:::ffff:)?(?P<ip>[^"]+)")?.*)'
+)
+
+IP_RE = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
+
+# Client "192.168.1.100", "/uploads/file.txt"[, 1234 bytes, ...]
+DETAILS_PATH_RE = re.compile(r'Client\s+"[^"]*",\s+"(?P<path>[^"]*)"')
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+
+class LogRecord:
+    """A parsed vsftpd.log or xferlog line"""
+
+    __slots__ = (
+        'epoch', 'pid', 'username', 'status', 'action', 'details',
+        'ip_address', 'file_path', 'file_size', 'direction',
+        'transfer_time', 'source',
+    )
+
+    def __init__(self, epoch, pid, username, status, action, details,
+                 ip_address, file_path=None, file_size=None, direction=None,
+                 transfer_time=None, source='vsftpd'):
+        self.epoch = epoch
+        self.pid = pid
+        self.username = username
+        self.status = status
+        self.action = action
+        self.details = details
+        self.ip_address = ip_address
+        self.file_path = file_path
+        self.file_size = file_size
+        self.direction = direction
+        self.transfer_time = transfer_time
+        self.source = source
+
+    def to_dict(self):
+        entry = {
+            'timestamp': datetime.fromtimestamp(self.epoch).isoformat(),
+            'epoch': self.epoch,
+            'pid': self.pid,
+            'username': self.username,
+            'status': self.status,
+            'action': self.action,
+            'details': self.details,
+            'ip_address': self.ip_address,
+        }
+        if self.file_path is not None:
+            entry['file_path'] = self.file_path
+            entry['file_size'] = self.file_size
+            entry['direction'] = self.direction
+        return entry
+
+    def __repr__(self):
+        return f"LogRecord({self.source}, {self.epoch}, {self.username}, {self.action})"
+
+
+_ts_cache = {}
+
+def parse_timestamp(value):
+    """Convert a ctime style 'Mon Dec  4 10:30:15 2023' (local time) to epoch"""
+    epoch = _ts_cache.get(value)
+    if epoch is not None:
+        return epoch
+    try:
+        _, month, day, clock, year = value.split()
+        hour, minute, second = clock.split(':')
+        epoch = int(time.mktime((int(year), MONTHS[month], int(day),
+                                 int(hour), int(minute), int(second), 0, 0, -1)))
+    except (ValueError, KeyError):
+        return None
+    # Log lines arrive in time order, so only recent seconds are worth keeping
+    if len(_ts_cache) >= 4096:
+        _ts_cache.clear()
+    _ts_cache[value] = epoch
+    return epoch
+
+
+def extract_ip(text):
+    """Extract the client IP address from log text"""
+    if text.startswith('Client "'):
+        end = text.find('"', 8)
+        if end > 8:
+            ip = text[8:end]
+            return ip[7:] if ip.startswith('::ffff:') else ip
+    match = IP_RE.search(text)
+    return match.group(0) if match else 'unknown'
+
+
+def extract_path(details):
+    """The file path of an UPLOAD/DELETE/MKDIR... vsftpd.log entry, or None"""
+    match = DETAILS_PATH_RE.match(details)
+    return match.group('path') if match else None
+
+
+def parse_vsftpd_line(line):
+    """Parse a vsftpd.log line in a single regex pass
+
+    Returns None for lines without a readable timestamp; stamping them with
+    the read time would sort them among the newest entries.
+    """
+    match = VSFTPD_LINE_RE.match(line)
+    if match is None:
+        return None
+
+    ts, pid, user, status, action, event, details, ip = match.groups()
+    epoch = parse_timestamp(ts)
+    if epoch is None:
+        return None
+    if ip is None:
+        ip = extract_ip(details)
+
+    if user is not None:
+        return LogRecord(epoch, pid, user, status, action, details, ip)
+    if event is not None:
+        return LogRecord(epoch, pid, 'unknown', 'INFO', event, details, ip)
+    return LogRecord(epoch, 'unknown', 'unknown', 'INFO', 'LOG', details, ip)
+
+
+def parse_xfer_line(line):
+    """Parse an xferlog line
+
+    Format: DDD MMM dd hh:mm:ss YYYY transfer-time host size filename
+    type action-flag direction access-mode username service auth-method
+    auth-user-id completion-status. Filenames may contain spaces, so the
+    fixed trailing fields are split from the right.
+    """
+    head = line.split(None, 8)
+    if len(head) < 9:
+        return None
+    tail = head[8].rsplit(None, 9)
+    if len(tail) < 10:
+        return None
+
+    epoch = parse_timestamp(' '.join(head[:5]))
+    if epoch is None:
+        return None
+    try:
+        size = int(head[7])
+        transfer_time = int(head[5])
+    except ValueError:
+        return None
+
+    file_path = tail[0]
+    direction = tail[3]
+    username = tail[5] if tail[5] != '*' else 'anonymous'
+    status = 'OK' if tail[9] == 'c' else 'INCOMPLETE'
+    return LogRecord(epoch, 'xfer', username, status, 'TRANSFER',
+                     f"File: {file_path}, Size: {size} bytes", head[6],
+                     file_path=file_path, file_size=size, direction=direction,
+                     transfer_time=transfer_time, source='xferlog')
@@ -0,0 +1,249 @@
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left
+
+MAGIC = b'FTPSEG1\n'
+# Columns with few distinct values, stored as a dictionary plus codes
+DICT_COLUMNS = ('username', 'ip_address', 'action', 'status', 'source')
+# Free-form columns, stored as a compressed JSON list
+TEXT_COLUMNS = ('file_path', 'pid', 'details')
+COLUMNS = ('timestamp',) + DICT_COLUMNS + TEXT_COLUMNS
+
+
+def _to_bytes(values):
+    # Segments are little-endian whatever the machine
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class BloomFilter:
+    """Fixed-size set membership test without false negatives"""
+
+    __slots__ = ('size', 'hashes', 'bits')
+
+    def __init__(self, size, hashes=7, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_items(cls, items, bits_per_item=10):
+        """Sized for about 1% false positives"""
+        items = set(items)
+        bloom = cls(max(64, len(items) * bits_per_item))
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_dict(self):
+        return {'size': self.size, 'hashes': self.hashes, 'bits': base64.b64encode(bytes(self.bits)).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['hashes'], bytearray(base64.b64decode(data['bits'])))
+
+
+def write_segment(path, rows):
+    """Write log rows (dicts with COLUMNS keys) as a compressed columnar segment
+
+    Rows are sorted by timestamp; timestamps are stored as deltas,
+    DICT_COLUMNS as dictionary codes, every column zlib-compressed on its
+    own. The uncompressed header holds the time range and a bloom filter of
+    the usernames, so readers can skip a segment after reading the header
+    only. The file is replaced atomically. Returns the header.
+    """
+    rows = sorted(rows, key=lambda row: row['timestamp'])
+    blobs = {}
+
+    timestamps = [int(row['timestamp']) for row in rows]
+    deltas = array('q', [b - a for a, b in zip([0] + timestamps, timestamps)])
+    blobs['timestamp'] = zlib.compress(_to_bytes(deltas), 9)
+
+    for name in DICT_COLUMNS:
+        dictionary = {}
+        codes = array('I', [dictionary.setdefault(row.get(name), len(dictionary)) for row in rows])
+        encoded = json.dumps(list(dictionary)).encode('utf-8')
+        blobs[name] = zlib.compress(struct.pack('<I', len(encoded)) + encoded + _to_bytes(codes), 9)
+
+    for name in TEXT_COLUMNS:
+        blobs[name] = zlib.compress(json.dumps([row.get(name) for row in rows]).encode('utf-8'), 9)
+
+    # Newest row per source
+    sources = {}
+    for row, timestamp in zip(rows, timestamps):
+        sources[row.get('source')] = timestamp
+
+    columns = {}
+    offset = 0
+    for name in COLUMNS:
+        columns[name] = [offset, len(blobs[name])]
+        offset += len(blobs[name])
+    header = {
+        'version': 1,
+        'rows': len(rows),
+        'min_ts': timestamps[0] if timestamps else None,
+        'max_ts': timestamps[-1] if timestamps else None,
+        'users': BloomFilter.for_items(row.get('username') for row in rows).to_dict(),
+        'sources': sources,
+        'columns': columns,
+    }
+    encoded_header = json.dumps(header).encode('utf-8')
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.segment.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(encoded_header)))
+            f.write(encoded_header)
+            for name in COLUMNS:
+                f.write(blobs[name])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return header
+
+
+class LogSegment:
+    """Read side of a segment file; columns are loaded only when asked for"""
+
+    __slots__ = ('path', 'header', 'data_offset', 'users')
+
+    def __init__(self, path, header, data_offset):
+        self.path = path
+        self.header = header
+        self.data_offset = data_offset
+        self.users = BloomFilter.from_dict(header['users'])
+
+    @classmethod
+    def open(cls, path):
+        """Read only the header of a segment"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a log segment")
+            (length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length))
+        return cls(path, header, len(MAGIC) + 4 + length)
+
+    @property
+    def rows(self):
+        return self.header['rows']
+
+    @property
+    def min_ts(self):
+        return self.header['min_ts']
+
+    @property
+    def max_ts(self):
+        return self.header['max_ts']
+
+    def overlaps(self, start=None, end=None):
+        """Whether any row may have start <= timestamp < end"""
+        if not self.rows:
+            return False
+        return (start is None or self.max_ts >= start) and (end is None or self.min_ts < end)
+
+    def source_max_ts(self, source):
+        """Newest timestamp of ``source`` rows, None if there are none"""
+        sources = self.header.get('sources')
+        if sources is None:
+            # Written before per-source bounds were recorded
+            return self.max_ts
+        return sources.get(source)
+
+    def may_contain_user(self, username):
+        return username in self.users
+
+    def _blob(self, f, name):
+        offset, length = self.header['columns'][name]
+        f.seek(self.data_offset + offset)
+        return zlib.decompress(f.read(length))
+
+    def _decode(self, f, name):
+        data = self._blob(f, name)
+        if name == 'timestamp':
+            timestamps = _from_bytes('q', data)
+            total = 0
+            for i, delta in enumerate(timestamps):
+                total += delta
+                timestamps[i] = total
+            return timestamps
+        if name in DICT_COLUMNS:
+            (length,) = struct.unpack('<I', data[:4])
+            dictionary = json.loads(data[4:4 + length])
+            return dictionary, _from_bytes('I', data[4 + length:])
+        return json.loads(data)
+
+    def select(self, start=None, end=None, filters=None):
+        """Rows with start <= timestamp < end matching ``filters`` ({column: value})
+
+        Returns (row index, row dict) pairs in timestamp order. Only the
+        columns needed for filtering are decoded for rows that end up
+        rejected; a filter value missing from a column dictionary rejects
+        the whole segment.
+        """
+        filters = {name: value for name, value in (filters or {}).items() if value}
+        with open(self.path, 'rb') as f:
+            timestamps = self._decode(f, 'timestamp')
+            first = bisect_left(timestamps, start) if start is not None else 0
+            last = bisect_left(timestamps, end) if end is not None else len(timestamps)
+            indexes = range(first, last)
+
+            for name, value in filters.items():
+                dictionary, codes = self._decode(f, name)
+                try:
+                    code = dictionary.index(value)
+                except ValueError:
+                    return []
+                indexes = [i for i in indexes if codes[i] == code]
+            if not indexes:
+                return []
+
+            columns = {}
+            for name in DICT_COLUMNS:
+                dictionary, codes = self._decode(f, name)
+                columns[name] = [dictionary[codes[i]] for i in indexes]
+            for name in TEXT_COLUMNS:
+                values = self._decode(f, name)
+                columns[name] = [values[i] for i in indexes]
+
+        result = []
+        for position, i in enumerate(indexes):
+            row = {'timestamp': timestamps[i]}
+            for name, values in columns.items():
+                row[name] = values[position]
+            result.append((i, row))
+        return result
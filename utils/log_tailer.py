@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import deque
+
+
+class LogTailer:
+    """Incremental reader for an append-only log file.
+
+    Remembers the byte offset and inode of the file between calls so that
+    every poll only reads bytes appended since the previous one. The first
+    poll without saved state seeks backwards from EOF to fetch the last
+    ``max_lines`` lines instead of reading the whole file. Rotation (inode
+    change) and truncation are detected and the file is reopened from the
+    start.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, max_lines=1000, offset=None, inode=None):
+        self.path = path
+        self.max_lines = max_lines
+        self.offset = offset
+        self.inode = inode
+        self.lines = deque(maxlen=max_lines)
+        self._fh = None
+        self._partial = b''
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, path, max_lines=1000):
+        """Get the process-wide tailer for a log file"""
+        with cls._shared_lock:
+            tailer = cls._shared.get(path)
+            if tailer is None:
+                tailer = cls(path, max_lines=max_lines)
+                cls._shared[path] = tailer
+            return tailer
+
+    def poll(self, max_bytes=None, offsets=False):
+        """Return complete lines appended since the last poll
+
+        ``max_bytes`` bounds how much is read in one call so a consumer that
+        fell far behind can catch up in slices instead of loading everything.
+        With ``offsets`` the result holds (byte offset, line) pairs, the
+        offset being where the line starts in its file.
+        """
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._close()
+                return []
+
+            new_lines = []
+
+            if self._fh is not None and st.st_ino != self.inode:
+                # Rotated: drain what was written to the old file, then reopen
+                new_lines.extend(self._read_appended())
+                if self._partial:
+                    new_lines.append((self.offset - len(self._partial), self._partial.decode('utf-8', 'replace')))
+                self._close()
+                self.offset = 0
+                self._partial = b''
+            elif self.offset is not None and st.st_size < self.offset:
+                # Truncated in place (copytruncate)
+                self._close()
+                self.offset = 0
+                self._partial = b''
+            elif self.inode is not None and st.st_ino != self.inode:
+                # Saved state belongs to a previous file
+                self.offset = 0
+                self._partial = b''
+
+            if self._fh is None:
+                self._fh = open(self.path, 'rb')
+                self.inode = os.fstat(self._fh.fileno()).st_ino
+                if self.offset is None:
+                    new_lines.extend(self._seed_from_tail())
+                else:
+                    self._fh.seek(self.offset)
+
+            new_lines.extend(self._read_appended(max_bytes))
+            self.lines.extend(line for _, line in new_lines)
+            return new_lines if offsets else [line for _, line in new_lines]
+
+    def recent(self, limit=None):
+        """Return the last ``limit`` lines, refreshing from disk first"""
+        self.poll()
+        with self._lock:
+            if limit is None or limit >= len(self.lines):
+                return list(self.lines)
+            return list(self.lines)[-limit:]
+
+    def state(self):
+        """Return (inode, offset) so the position can be persisted
+
+        The offset points at the start of any unterminated trailing line, so
+        resuming from it never loses a line that was only half written.
+        """
+        with self._lock:
+            if self.offset is None:
+                return self.inode, None
+            return self.inode, self.offset - len(self._partial)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+        self._fh = None
+
+    def _read_appended(self, max_bytes=None):
+        start = self._fh.tell()
+        data = self._fh.read(-1 if max_bytes is None else max_bytes)
+        if not data:
+            return []
+        self.offset = self._fh.tell()
+        return self._split(data, start)
+
+    def _split(self, data, start):
+        """(offset, line) pairs of the complete lines in ``data`` read at ``start``"""
+        start -= len(self._partial)
+        data = self._partial + data
+        parts = data.split(b'\n')
+        # Keep an unterminated trailing line for the next poll
+        self._partial = parts.pop()
+        entries = []
+        for part in parts:
+            if part.strip():
+                entries.append((start, part.decode('utf-8', 'replace').rstrip('\r')))
+            start += len(part) + 1
+        return entries
+
+    def _seed_from_tail(self):
+        """Read the last max_lines lines by seeking backwards from EOF"""
+        end = self._fh.seek(0, os.SEEK_END)
+        pos = end
+        buf = b''
+        while pos > 0 and buf.count(b'\n') <= self.max_lines:
+            step = min(self.CHUNK_SIZE, pos)
+            pos -= step
+            self._fh.seek(pos)
+            buf = self._fh.read(step) + buf
+
+        if pos > 0:
+            # Drop the (probably partial) first line of the window
+            skip = buf.index(b'\n') + 1
+            buf = buf[skip:]
+            pos += skip
+
+        self._fh.seek(end)
+        self.offset = end
+        return self._split(buf, pos)[-self.max_lines:]
+
+    @staticmethod
+    def tail(path, limit=100):
+        """Return the last ``limit`` lines of a file without reading all of it"""
+        tailer = LogTailer(path, max_lines=limit)
+        try:
+            return tailer.poll()
+        finally:
+            tailer.close()
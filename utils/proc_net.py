@@ -0,0 +1,97 @@
+import os
+import socket
+
+# /proc/net/tcp state code for ESTABLISHED
+TCP_ESTABLISHED = '01'
+
+
+class ProcNet:
+    """Read TCP sockets and their owning processes straight from /proc"""
+
+    @staticmethod
+    def _decode_address(address):
+        """Decode '0100007F:0015' (or the 32 hex digit IPv6 form) to (ip, port)"""
+        host, port = address.split(':')
+        raw = bytes.fromhex(host)
+        # The kernel prints each 32-bit word in host (little endian) order
+        raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+        if len(raw) == 4:
+            ip = socket.inet_ntop(socket.AF_INET, raw)
+        else:
+            ip = socket.inet_ntop(socket.AF_INET6, raw)
+            if ip.startswith('::ffff:'):
+                ip = ip[7:]
+        return ip, int(port, 16)
+
+    @staticmethod
+    def established_sockets(port, proc_root='/proc'):
+        """Return {inode: (local_ip, local_port, remote_ip, remote_port)}
+
+        Only ESTABLISHED sockets whose local port is ``port`` are decoded;
+        every other line is rejected with string comparisons.
+        """
+        port_suffix = ':%04X' % port
+        sockets = {}
+        for name in ('tcp', 'tcp6'):
+            try:
+                with open(os.path.join(proc_root, 'net', name), 'r') as f:
+                    next(f, None)  # header
+                    for line in f:
+                        fields = line.split()
+                        if len(fields) < 10 or fields[3] != TCP_ESTABLISHED:
+                            continue
+                        if not fields[1].endswith(port_suffix):
+                            continue
+                        inode = int(fields[9])
+                        if inode == 0:
+                            continue
+                        local_ip, local_port = ProcNet._decode_address(fields[1])
+                        remote_ip, remote_port = ProcNet._decode_address(fields[2])
+                        sockets[inode] = (local_ip, local_port, remote_ip, remote_port)
+            except FileNotFoundError:
+                continue
+        return sockets
+
+    @staticmethod
+    def find_pids(process_name, proc_root='/proc'):
+        """Return pids whose comm equals ``process_name``"""
+        pids = []
+        for entry in os.scandir(proc_root):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(os.path.join(entry.path, 'comm'), 'r') as f:
+                    if f.read().strip() == process_name:
+                        pids.append(int(entry.name))
+            except OSError:
+                continue
+        return pids
+
+    @staticmethod
+    def socket_inodes(pid, proc_root='/proc'):
+        """Return inodes of the sockets held open by a process"""
+        inodes = set()
+        fd_dir = os.path.join(proc_root, str(pid), 'fd')
+        try:
+            entries = os.listdir(fd_dir)
+        except OSError:
+            return inodes
+        for fd in entries:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            # socket:[12345]
+            if target.startswith('socket:['):
+                inodes.add(int(target[8:-1]))
+        return inodes
+
+    @staticmethod
+    def socket_owners(inodes, pids, proc_root='/proc'):
+        """Map each wanted socket inode to the pids that hold it"""
+        wanted = set(inodes)
+        owners = {}
+        for pid in pids:
+            for inode in ProcNet.socket_inodes(pid, proc_root) & wanted:
+                owners.setdefault(inode, []).append(pid)
+        return owners
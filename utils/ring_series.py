@@ -0,0 +1,71 @@
+from array import array
+from bisect import bisect_left
+
+
+class RingSeries:
+    """Fixed-capacity time series backed by one array per column.
+
+    Memory is allocated once (8 bytes per value); once full, each append
+    overwrites the oldest point. Timestamps must be appended in increasing
+    order.
+    """
+
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.times = array('d', [0.0]) * capacity
+        self.columns = {name: array('d', [0.0]) * capacity for name in self.fields}
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, values):
+        if self.size < self.capacity:
+            index = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[index] = timestamp
+        for name in self.fields:
+            self.columns[name][index] = values.get(name, 0)
+
+    def last_time(self):
+        if not self.size:
+            return None
+        return self.times[(self.start + self.size - 1) % self.capacity]
+
+    def _time_at(self, position):
+        return self.times[(self.start + position) % self.capacity]
+
+    def points(self, since=None):
+        """Points in time order, optionally only those at or after ``since``"""
+        first = 0
+        if since is not None:
+            # Binary search over the logical (rotated) order
+            first = bisect_left(_LogicalTimes(self), since)
+        result = []
+        for position in range(first, self.size):
+            index = (self.start + position) % self.capacity
+            point = {'t': self.times[index]}
+            for name in self.fields:
+                point[name] = self.columns[name][index]
+            result.append(point)
+        return result
+
+
+class _LogicalTimes:
+    """Sequence view of a RingSeries' timestamps in logical order (for bisect)"""
+
+    __slots__ = ('series',)
+
+    def __init__(self, series):
+        self.series = series
+
+    def __len__(self):
+        return self.series.size
+
+    def __getitem__(self, position):
+        return self.series._time_at(position)
@@ -0,0 +1,82 @@
+import gzip
+import os
+import re
+
+
+def rotated_siblings(path):
+    """Rotated copies of a log file, newest first
+
+    Matches logrotate's numbered names (vsftpd.log.1, vsftpd.log.2.gz) and
+    dateext names (vsftpd.log-20240101, vsftpd.log-20240101.gz).
+    """
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r'(?:\.\d+|-\d{8}(?:\d{2})?)(?:\.gz)?$')
+    try:
+        names = os.listdir(directory or '.')
+    except OSError:
+        return []
+
+    siblings = []
+    for entry in names:
+        if not pattern.match(entry):
+            continue
+        full = os.path.join(directory, entry)
+        try:
+            siblings.append((os.stat(full).st_mtime, full))
+        except FileNotFoundError:
+            continue
+    return [full for _, full in sorted(siblings, reverse=True)]
+
+
+def open_log(path):
+    """Open a plain or gzip-compressed log file for binary reading"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_lines(path):
+    """Yield the decoded lines of a plain or gzip-compressed log file"""
+    for _, line in read_entries(path):
+        yield line
+
+
+def read_entries(path):
+    """Yield (byte offset, line) pairs; offsets of a .gz file count decompressed bytes"""
+    offset = 0
+    with open_log(path) as f:
+        for raw in f:
+            yield offset, raw.decode('utf-8', 'replace').rstrip('\r\n')
+            offset += len(raw)
+
+
+def read_lines_reversed(path, chunk_size=64 * 1024):
+    """Yield the lines of a plain log file, last line first
+
+    Reads blocks backwards from EOF, so the cost depends on how many lines
+    the caller takes, not on the file size. An unterminated last line
+    (still being written) is skipped.
+    """
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b''
+        end_seen = False
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            parts = buf.split(b'\n')
+            if not end_seen:
+                if len(parts) == 1:
+                    continue
+                # Whatever follows the last newline is empty or half written
+                parts.pop()
+                end_seen = True
+            # The first part may continue in the previous block
+            buf = parts[0]
+            for part in reversed(parts[1:]):
+                if part.strip():
+                    yield part.decode('utf-8', 'replace').rstrip('\r')
+        if end_seen and buf.strip():
+            yield buf.decode('utf-8', 'replace').rstrip('\r')
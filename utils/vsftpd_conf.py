@@ -0,0 +1,126 @@
+BOOL_VALUES = {'YES': True, 'TRUE': True, '1': True, 'NO': False, 'FALSE': False, '0': False}
+
+
+def coerce_value(value, option_type):
+    """Convert a raw option value to its Python type; raises ValueError"""
+    if option_type == 'bool':
+        try:
+            return BOOL_VALUES[value.upper()]
+        except KeyError:
+            raise ValueError(f"expected YES or NO, got '{value}'")
+    if option_type == 'int':
+        if not value.isdigit():
+            raise ValueError(f"expected a non-negative integer, got '{value}'")
+        return int(value)
+    return value
+
+
+class ConfLine:
+    """One line of vsftpd.conf: an option, or text kept verbatim"""
+
+    __slots__ = ('key', 'value', 'raw')
+
+    def __init__(self, key=None, value=None, raw=None):
+        self.key = key
+        self.value = value
+        self.raw = raw
+
+    def render(self):
+        if self.key is None:
+            return self.raw
+        return f'{self.key}={self.value}\n'
+
+
+class VsftpdConf:
+    """Round-trippable model of vsftpd.conf.
+
+    Comments, blank lines and option order are kept as they are; option
+    lines are only rewritten when their value changes, so serializing an
+    unmodified model gives back the original text. vsftpd uses the last
+    occurrence of a repeated option, and so does this model.
+    """
+
+    def __init__(self, lines=None):
+        self.lines = lines or []
+        self._index = {}
+        for position, line in enumerate(self.lines):
+            if line.key is not None:
+                self._index[line.key] = position
+
+    @classmethod
+    def parse(cls, text):
+        lines = []
+        for raw in text.splitlines(keepends=True):
+            stripped = raw.strip()
+            if stripped and not stripped.startswith('#') and '=' in stripped:
+                key, value = stripped.split('=', 1)
+                line = ConfLine(key.strip(), value.strip())
+                # Keep the original text until the value is changed
+                line.raw = raw if raw.endswith('\n') else raw + '\n'
+                lines.append(line)
+            else:
+                lines.append(ConfLine(raw=raw if raw.endswith('\n') else raw + '\n'))
+        return cls(lines)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.parse(f.read())
+
+    def copy(self):
+        return VsftpdConf([ConfLine(line.key, line.value, line.raw) for line in self.lines])
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return self.lines[position].value if position is not None else default
+
+    def get_typed(self, key, options, default=None):
+        """Value of ``key`` converted with its CONFIG_OPTIONS type"""
+        value = self.get(key)
+        if value is None:
+            return default
+        return coerce_value(value, options.get(key, {}).get('type'))
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def as_dict(self):
+        return {key: self.lines[position].value for key, position in self._index.items()}
+
+    def set(self, key, value):
+        """Patch an option in place; returns the previous value (None if new)
+
+        A new option is placed right after a commented-out ``#key=...``
+        example when the file has one, otherwise at the end.
+        """
+        position = self._index.get(key)
+        if position is not None:
+            line = self.lines[position]
+            old_value = line.value
+            if old_value != value:
+                line.value = value
+                line.raw = None
+            return old_value
+
+        line = ConfLine(key, value)
+        position = self._commented_example(key)
+        if position is None:
+            self.lines.append(line)
+            self._index[key] = len(self.lines) - 1
+        else:
+            self.lines.insert(position + 1, line)
+            # Positions after the insert moved by one
+            self._index = {k: p + 1 if p > position else p for k, p in self._index.items()}
+            self._index[key] = position + 1
+        return None
+
+    def _commented_example(self, key):
+        prefix = f'{key}='
+        for position in range(len(self.lines) - 1, -1, -1):
+            line = self.lines[position]
+            if line.key is None and line.raw.lstrip('# \t').startswith(prefix):
+                return position
+        return None
+
+    def serialize(self):
+        return ''.join(line.raw if line.raw is not None else line.render() for line in self.lines)